@@ -0,0 +1,206 @@
+"""
+Daily response activity, rolled up from ``Response`` into ``Dailyactivity``.
+
+``update_rollup`` processes the responses added since the ``Watermark`` of the
+rollup. Distinct respondents cannot be added up across runs, so every day the
+new responses fall on is recomputed as a whole and replaced; selected by
+timestamp range, so with an index on ``responseTimestamp`` a run costs a few
+days of responses however large the table is. ``activity_series`` answers the
+time series endpoint from the rollup alone.
+"""
+
+from datetime import datetime, time, timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.db.models.functions import TruncDate, TruncMonth, TruncWeek
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import *
+
+WATERMARK = 'daily_activity'
+
+GRANULARITIES = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+class ActivityError(ValueError):
+    pass
+
+
+def rollup_watermark():
+
+    watermark = Watermark.objects.filter(name=WATERMARK).values_list('responseid', flat=True).first()
+    return watermark or 0
+
+
+def day_ranges(days):
+    """
+    Condition selecting the responses timestamped on ``days``: a timestamp
+    range per run of consecutive days, which an index can seek to, unlike a
+    filter on the timestamps truncated to their day.
+    """
+
+    runs = []
+    for day in sorted(days):
+        if runs and runs[-1][1] == day:
+            runs[-1][1] = day + timedelta(days=1)
+        else:
+            runs.append([day, day + timedelta(days=1)])
+
+    condition = Q()
+    for start, end in runs:
+        # Days in the current time zone, as TruncDate has them
+        condition |= Q(
+            responsetimestamp__gte=timezone.make_aware(datetime.combine(start, time.min)),
+            responsetimestamp__lt=timezone.make_aware(datetime.combine(end, time.min)),
+        )
+    return condition
+
+
+def rollup_days(days, upto):
+    """
+    ``Dailyactivity`` rows of ``days`` computed from the responses up to
+    response id ``upto``.
+    """
+
+    if not days:
+        return []
+    rows = (
+        Response.objects.filter(day_ranges(days), responseid__lte=upto)
+        .annotate(day=TruncDate('responsetimestamp'))
+        .values('day', 'personid__communityid', 'surveyquestionid__surveyid')
+        .annotate(responses=Count('responseid'), respondents=Count('personid', distinct=True))
+        .order_by()
+    )
+    return [
+        Dailyactivity(
+            day=row['day'],
+            communityid_id=row['personid__communityid'],
+            surveyid_id=row['surveyquestionid__surveyid'],
+            responses=row['responses'],
+            respondents=row['respondents'],
+        )
+        for row in rows
+    ]
+
+
+def update_rollup(batch_size=50000):
+    """
+    Bring ``Dailyactivity`` up to date, ``batch_size`` response ids at a time,
+    each batch in its own transaction. Returns the number of responses and
+    days processed.
+    """
+
+    latest = Response.objects.aggregate(responseid=Max('responseid'))['responseid'] or 0
+    watermark = rollup_watermark()
+    processed = days_processed = 0
+    while watermark < latest:
+        upto = min(watermark + batch_size, latest)
+        new_responses = Response.objects.filter(responseid__gt=watermark, responseid__lte=upto)
+        days = set(
+            new_responses.filter(responsetimestamp__isnull=False)
+            .annotate(day=TruncDate('responsetimestamp'))
+            .values_list('day', flat=True)
+            .distinct()
+        )
+        with transaction.atomic():
+            Dailyactivity.objects.filter(day__in=days).delete()
+            Dailyactivity.objects.bulk_create(rollup_days(days, upto))
+            Watermark.objects.update_or_create(name=WATERMARK, defaults={'responseid': upto})
+        processed += new_responses.count()
+        days_processed += len(days)
+        watermark = upto
+    return processed, days_processed
+
+
+def rebuild_rollup(batch_size=50000):
+
+    with transaction.atomic():
+        Dailyactivity.objects.all().delete()
+        Watermark.objects.filter(name=WATERMARK).delete()
+    return update_rollup(batch_size)
+
+
+def parse_day(value, name):
+
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is None:
+        raise ActivityError("'%s' must be an ISO 8601 date" % name)
+    return day
+
+
+def parse_id(value, name):
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ActivityError("'%s' must be an integer" % name)
+
+
+def activity_filters(granularity=None, since=None, until=None, community=None, country=None, survey=None):
+    """
+    Translate time series parameters (as strings, e.g. from a query string)
+    into ``activity_series`` arguments. Raises ``ActivityError`` for
+    malformed values.
+    """
+
+    granularity = granularity or 'day'
+    if granularity not in GRANULARITIES:
+        raise ActivityError("'granularity' must be one of: %s" % ', '.join(GRANULARITIES))
+    return {
+        'granularity': granularity,
+        'since': parse_day(since, 'since') if since else None,
+        'until': parse_day(until, 'until') if until else None,
+        'community': parse_id(community, 'community') if community else None,
+        'country': country or None,
+        'survey': parse_id(survey, 'survey') if survey else None,
+    }
+
+
+def activity_series(granularity='day', since=None, until=None, community=None, country=None, survey=None):
+    """
+    Responses and respondents per period, oldest first, from the rollup.
+    ``since`` and ``until`` are dates, ``until`` excluded. The rollup only
+    has distinct respondents per day, community and survey; a person belongs
+    to one community, so days of a single survey report them as
+    ``respondents``. Anything else reports their sum as ``respondentDays``,
+    counting a person once per day and survey answered.
+    """
+
+    rows = Dailyactivity.objects.all()
+    if since:
+        rows = rows.filter(day__gte=since)
+    if until:
+        rows = rows.filter(day__lt=until)
+    if community:
+        rows = rows.filter(communityid=community)
+    if country:
+        rows = rows.filter(communityid__countryid__code=country)
+    if survey:
+        rows = rows.filter(surveyid=survey)
+
+    trunc = GRANULARITIES[granularity]
+    if trunc is not None:
+        rows = rows.annotate(period=trunc('day'))
+        period = 'period'
+    else:
+        period = 'day'
+    respondents_field = 'respondents' if trunc is None and survey else 'respondentDays'
+    series = (
+        rows.values(period)
+        .annotate(responses=Sum('responses'), respondents=Sum('respondents'))
+        .order_by(period)
+        .values_list(period, 'responses', 'respondents')
+    )
+    return [
+        {'period': day.isoformat(), 'responses': responses, respondents_field: respondents}
+        for day, responses, respondents in series
+    ]
@@ -0,0 +1,77 @@
+"""
+Async variants of the report views, for serving under ASGI.
+
+The report is built off the event loop and its independent sections (each
+survey's or region's aggregates) run concurrently on the report pool, so a
+slow report neither blocks other requests nor waits on one query at a time.
+"""
+
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from .cache import cached_report
+from .concurrency import run_concurrently, run_in_connection
+from .metrics import TimedJSONEncoder
+from .models import *
+from .fields import FieldError, requested_fields
+from .pagination import PaginationError, flag, page_size
+from .reports import community_report, country_report, statistics_report, text_answer_limit
+from .routers import replica_reads
+
+
+async def build_report(builder, *args, **kwargs):
+
+    return await sync_to_async(run_in_connection, thread_sensitive=False)(
+        partial(builder, *args, run=run_concurrently, **kwargs),
+    )
+
+
+@replica_reads
+@cached_report('community', 'communityid')
+async def get_community(request, communityid):
+
+    try:
+        text_limit = page_size(request, text_answer_limit(), name='answers')
+        fields = requested_fields(request)
+    except (PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    try:
+        data = await build_report(
+            community_report, communityid, text_limit=text_limit, group_text=flag(request, 'group_text'),
+            approximate=flag(request, 'approximate'), fields=fields,
+        )
+        return JsonResponse(data, encoder=TimedJSONEncoder)
+
+    except Community.DoesNotExist:
+        return JsonResponse({'error': 'Community not found'}, status=404)
+
+@replica_reads
+@cached_report('global')
+async def survey_statistics(request):
+
+    try:
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    data = await build_report(statistics_report, approximate=flag(request, 'approximate'), fields=fields)
+    return JsonResponse(data, safe=False, encoder=TimedJSONEncoder)
+
+@replica_reads
+@cached_report('country', 'countrycode')
+async def get_country(request, countrycode):
+
+    try:
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    try:
+        data = await build_report(country_report, countrycode, approximate=flag(request, 'approximate'), fields=fields)
+        return JsonResponse(data, safe=False, encoder=TimedJSONEncoder)
+
+    except Country.DoesNotExist:
+        return JsonResponse({'error': 'Country not found'}, status=404)
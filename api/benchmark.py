@@ -0,0 +1,270 @@
+"""
+Synthetic dataset generator and endpoint benchmark.
+
+``generate_dataset`` fills the (local, SQLite) database with a seeded random
+dataset of a given scale; ``run_benchmark`` requests every report endpoint a
+number of times and records its query count and latency percentiles, which
+``check_budgets`` compares against the budgets stored in
+``benchmark_budgets.json``.
+"""
+
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from .cache import report_cache
+from .catalog import get_catalog
+from .crosstab import crosstab, orm_crosstab
+from .demographics import GENDERS
+from .models import *
+from .tally import MULTIPLE_CHOICE, build_response_options
+
+BUDGETS_PATH = os.path.join(os.path.dirname(__file__), 'benchmark_budgets.json')
+
+SCALES = {
+    'tiny': {
+        'countries': 2, 'communities': 2, 'persons': 5,
+        'surveys': 2, 'questions': 3, 'response_rate': 0.8,
+    },
+    'small': {
+        'countries': 3, 'communities': 4, 'persons': 25,
+        'surveys': 3, 'questions': 6, 'response_rate': 0.7,
+    },
+    'medium': {
+        'countries': 5, 'communities': 5, 'persons': 50,
+        'surveys': 4, 'questions': 8, 'response_rate': 0.6,
+    },
+    'large': {
+        'countries': 10, 'communities': 10, 'persons': 100,
+        'surveys': 6, 'questions': 10, 'response_rate': 0.5,
+    },
+}
+
+TEXT_ANSWERS = ['Yes', 'No', 'Too far away', 'Not enough water', 'The clinic is closed', 'Fine']
+
+
+def generate_dataset(countries, communities, persons, surveys, questions, response_rate, seed=0):
+    """
+    Create ``countries`` countries with ``communities`` communities each and
+    ``persons`` people per community, plus ``surveys`` surveys of
+    ``questions`` questions. Each person answers every question of a survey
+    with probability ``response_rate``. Returns the number of responses.
+    """
+
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+    country_rows = Country.objects.bulk_create([
+        Country(name='Country %d' % number, code='C%03d' % number,
+                latitude=rng.uniform(-40, 40), longitude=rng.uniform(-20, 60))
+        for number in range(countries)
+    ])
+    community_rows = Community.objects.bulk_create([
+        Community(countryid=country, region='Region %d-%d' % (country.countryid, number))
+        for country in country_rows
+        for number in range(communities)
+    ])
+    person_rows = Person.objects.bulk_create([
+        Person(
+            name='Person %d' % number,
+            sender_number=str(254700000000 + len(community_rows) * number + index),
+            gender=rng.choice(GENDERS),
+            date_of_birth=date(1940, 1, 1) + timedelta(days=rng.randrange(80 * 365)),
+            communityid=community,
+        )
+        for index, community in enumerate(community_rows)
+        for number in range(persons)
+    ])
+
+    survey_rows = Survey.objects.bulk_create([
+        Survey(title='Survey %d' % number, description='Synthetic survey %d' % number)
+        for number in range(surveys)
+    ])
+    question_rows = Question.objects.bulk_create([
+        Question(type=MULTIPLE_CHOICE if rng.random() < 0.7 else 'Text Entry', question='Question %d' % number)
+        for number in range(surveys * questions)
+    ])
+    options = {}
+    for question in question_rows:
+        if question.type == MULTIPLE_CHOICE:
+            options[question.questionid] = Option.objects.bulk_create([
+                Option(optiontext='Option %d' % number) for number in range(rng.randint(2, 6))
+            ])
+    Questionoption.objects.bulk_create([
+        Questionoption(questionid_id=questionid, optionid=option)
+        for questionid, question_options in options.items()
+        for option in question_options
+    ])
+    surveyquestion_rows = Surveyquestion.objects.bulk_create([
+        Surveyquestion(surveyid=survey, questionid=question_rows[index * questions + number], order_number=number + 1)
+        for index, survey in enumerate(survey_rows)
+        for number in range(questions)
+    ])
+    surveyquestions = {survey.surveyid: [] for survey in survey_rows}
+    for surveyquestion in surveyquestion_rows:
+        surveyquestions[surveyquestion.surveyid_id].append(surveyquestion)
+
+    responses = []
+    for person in person_rows:
+        for survey in survey_rows:
+            if rng.random() >= response_rate:
+                continue
+            timestamp = start + timedelta(minutes=rng.randrange(365 * 24 * 60))
+            for surveyquestion in surveyquestions[survey.surveyid]:
+                question_options = options.get(surveyquestion.questionid_id)
+                if question_options:
+                    selected = rng.sample(question_options, rng.randint(1, min(2, len(question_options))))
+                    responsedata = ','.join(str(option.optionid) for option in selected)
+                else:
+                    responsedata = rng.choice(TEXT_ANSWERS)
+                responses.append(Response(
+                    surveyquestionid=surveyquestion,
+                    personid=person,
+                    responsedata=responsedata,
+                    responsetimestamp=timestamp,
+                ))
+                timestamp += timedelta(seconds=rng.randint(5, 120))
+
+    Response.objects.bulk_create(responses, batch_size=2000)
+    option_ids = {option.optionid for question_options in options.values() for option in question_options}
+    Responseoption.objects.bulk_create(build_response_options(responses, option_ids), batch_size=2000)
+    return len(responses)
+
+
+def benchmark_urls():
+    """
+    One URL per route in ``api/urls.py``, using the first community and
+    country of the dataset.
+    """
+
+    community = Community.objects.order_by('communityid').first()
+    country = Country.objects.order_by('countryid').first()
+    return {
+        'get_community': reverse('get_community', args=[community.communityid]),
+        'get_communities': reverse('get_communities'),
+        'survey_statistics': reverse('survey_statistics'),
+        'get_countries': reverse('get_countries'),
+        'get_country': reverse('get_country', args=[country.code]),
+        'get_crosstab': reverse('get_crosstab'),
+    }
+
+
+def percentile(values, pct):
+
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(pct / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+
+def run_benchmark(iterations=10, cached=False):
+    """
+    Request every endpoint ``iterations`` times and return, per endpoint,
+    its query count and p50/p95 latency in milliseconds. The report cache is
+    cleared before each request unless ``cached`` is set.
+    """
+
+    client = Client()
+    results = {}
+    # The survey catalog lives for the whole process and its version is only
+    # checked every CATALOG_CHECK_INTERVAL seconds; measure between two checks
+    get_catalog()
+    with override_settings(CATALOG_CHECK_INTERVAL=3600):
+        for name, url in benchmark_urls().items():
+            timings = []
+            queries = None
+            for _ in range(iterations):
+                if not cached:
+                    report_cache().clear()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    response = client.get(url)
+                    timings.append((time.perf_counter() - started) * 1000)
+                if response.status_code != 200:
+                    raise RuntimeError('%s returned %d' % (url, response.status_code))
+                if queries is None:
+                    queries = len(captured)
+
+            results[name] = {
+                'url': url,
+                'queries': queries,
+                'p50_ms': round(percentile(timings, 50), 2),
+                'p95_ms': round(percentile(timings, 95), 2),
+            }
+    return results
+
+
+def run_connection_benchmark(iterations=10):
+    """
+    p50/p95 time in milliseconds to open a new connection to the database,
+    which a request pays with ``CONN_MAX_AGE = 0`` and a report pool thread
+    only when it starts or replaces its connection. The endpoint timings
+    reuse one connection, so add it to them for a fresh connection per request.
+    """
+
+    timings = []
+    for _ in range(iterations):
+        fresh = connections.create_connection(DEFAULT_DB_ALIAS)
+        started = time.perf_counter()
+        fresh.ensure_connection()
+        timings.append((time.perf_counter() - started) * 1000)
+        fresh.close()
+    return {
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+    }
+
+
+def run_crosstab_benchmark(iterations=10):
+    """
+    Time the NumPy cross-tab against the ORM one over the whole dataset and
+    return their p50/p95 latencies in milliseconds, after checking that both
+    compute the same tables.
+    """
+
+    get_catalog()
+    if crosstab() != orm_crosstab():
+        raise RuntimeError('crosstab and orm_crosstab disagree')
+
+    results = {}
+    for name, builder in [('crosstab_numpy', crosstab), ('crosstab_orm', orm_crosstab)]:
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            builder()
+            timings.append((time.perf_counter() - started) * 1000)
+        results[name] = {
+            'p50_ms': round(percentile(timings, 50), 2),
+            'p95_ms': round(percentile(timings, 95), 2),
+        }
+    return results
+
+
+def load_budgets(path=BUDGETS_PATH):
+
+    with open(path) as budgets:
+        return json.load(budgets)
+
+
+def check_budgets(results, budgets, latency=True):
+    """
+    Return a message for every endpoint whose query count or p95 latency
+    exceeds its budget.
+    """
+
+    violations = []
+    for name, result in results.items():
+        budget = budgets.get(name)
+        if budget is None:
+            continue
+        if result['queries'] > budget['queries']:
+            violations.append('%s: %d queries, budget %d' % (name, result['queries'], budget['queries']))
+        if latency and result['p95_ms'] > budget['p95_ms']:
+            violations.append('%s: p95 %.1fms, budget %.1fms' % (name, result['p95_ms'], budget['p95_ms']))
+    return violations
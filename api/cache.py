@@ -0,0 +1,209 @@
+import hashlib
+import threading
+from asyncio import iscoroutinefunction
+from functools import wraps
+from urllib.parse import quote, urlencode
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Max
+from django.http import HttpResponse
+from django.http.response import HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .activity import rollup_watermark
+from .catalog import get_catalog
+from .concurrency import run_in_connection
+from .leaderboard import leaderboard_version
+from .models import *
+from .tally import indexed_watermark
+
+
+# Response headers stored along with the payload
+CACHED_HEADERS = ('Link',)
+
+
+def report_cache():
+
+    return caches[getattr(settings, 'REPORT_CACHE_ALIAS', 'default')]
+
+
+class CacheStats:
+    """
+    Per-process hit and miss counters for the report cache, by view.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def hit(self, name):
+        with self.lock:
+            self.hits[name] = self.hits.get(name, 0) + 1
+
+    def miss(self, name):
+        with self.lock:
+            self.misses[name] = self.misses.get(name, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                name: {'hits': self.hits.get(name, 0), 'misses': self.misses.get(name, 0)}
+                for name in sorted(set(self.hits) | set(self.misses))
+            }
+
+    def reset(self):
+        with self.lock:
+            self.hits.clear()
+            self.misses.clear()
+
+
+stats = CacheStats()
+
+
+def scope_filters(scope, value):
+
+    # (Response filter, Person filter) selecting the data a report is computed from
+    if scope == 'community':
+        return {'personid__communityid': value}, {'communityid': value}
+    if scope == 'country':
+        # Country codes match whatever their case, as in country_reports
+        return (
+            {'personid__communityid__countryid__code__iexact': value},
+            {'communityid__countryid__code__iexact': value},
+        )
+    return {}, {}
+
+
+def data_version(scope, value=None):
+    """
+    Version of the data behind a report: the latest response id and
+    timestamp plus the number of people in the scope, and the version of the
+    survey catalog and of the multiple choice index. It only moves when new
+    responses or people arrive, the survey definitions change or the
+    backfill indexes older responses. No ``Last-Modified`` is derived from
+    it: the latest timestamp alone misses new people, responses arriving out
+    of order and catalog edits.
+    """
+
+    if scope == 'activity':
+        # Reports from the activity rollup change when the rollup runs
+        return str(rollup_watermark())
+
+    if scope == 'leaderboard':
+        # The leaderboard changes when update_leaderboard runs; its response rates with the catalog
+        return '%s-%s-%s' % (*leaderboard_version(), get_catalog().key())
+
+    if scope == 'communities':
+        latest = Community.objects.aggregate(communityid=Max('communityid'))
+        return '%s-%s' % (latest['communityid'] or 0, Community.objects.count())
+
+    response_filter, person_filter = scope_filters(scope, value)
+    latest = Response.objects.filter(**response_filter).aggregate(
+        responseid=Max('responseid'),
+        timestamp=Max('responsetimestamp'),
+    )
+    people = Person.objects.filter(**person_filter).count()
+    timestamp = latest['timestamp'].timestamp() if latest['timestamp'] else 0
+    return '%s-%s-%s-%s-%s' % (
+        latest['responseid'] or 0, timestamp, people, get_catalog().key(), indexed_watermark(),
+    )
+
+
+def report_key(name, kwargs, version, query=''):
+
+    return 'report:%s:%s:%s:%s' % (name, quote(urlencode(sorted(kwargs.items()))), version, quote(query))
+
+
+def validators(key):
+
+    # The cache key already names the view, its arguments, query and data version
+    return {'ETag': quote_etag(hashlib.md5(key.encode()).hexdigest())}
+
+
+def cached_content(view, scope, kwarg, request, kwargs):
+    """
+    Cache key and validators of a report request, plus either a 304 response
+    when the client's copy (``If-None-Match``) is still current, or the
+    cached payload, if any. ``If-Modified-Since`` is not honoured, as there
+    is no ``Last-Modified`` to compare it with.
+    Nothing of the report itself is computed here.
+    """
+
+    value = kwargs.get(kwarg) if kwarg else None
+    query = urlencode(sorted(request.GET.lists()), doseq=True)
+    key = report_key(view.__name__, kwargs, data_version(scope, value), query)
+    headers = validators(key)
+
+    not_modified = get_conditional_response(request, etag=headers['ETag'])
+    if not_modified is not None:
+        stats.hit(view.__name__)
+        for name, header in headers.items():
+            not_modified[name] = header
+        return key, headers, not_modified
+    return key, headers, report_cache().get(key)
+
+
+def hit_response(view, cached, validators):
+
+    if isinstance(cached, HttpResponseBase):
+        # Not modified
+        return cached
+    stats.hit(view.__name__)
+    content, headers = cached
+    response = HttpResponse(content, content_type='application/json', headers={**headers, **validators})
+    response['X-Cache'] = 'HIT'
+    return response
+
+
+def store_response(view, key, validators, response):
+
+    stats.miss(view.__name__)
+    if response.status_code == 200:
+        headers = {name: response[name] for name in CACHED_HEADERS if name in response}
+        report_cache().set(key, (response.content, headers))
+        for name, header in validators.items():
+            response[name] = header
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cached_report(scope, kwarg=None):
+    """
+    Serve a JSON report view from the report cache until the data version
+    of its scope moves, and answer conditional requests whose validators
+    still match with 304 before anything is computed or read from the
+    cache. ``kwarg`` names the URL argument identifying the scope, e.g. the
+    community id. Works for both sync and async views.
+    """
+
+    def decorator(view):
+
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def async_wrapper(request, *args, **kwargs):
+                key, headers, cached = await sync_to_async(run_in_connection, thread_sensitive=False)(
+                    cached_content, view, scope, kwarg, request, kwargs,
+                )
+                if cached is not None:
+                    return hit_response(view, cached, headers)
+                response = await view(request, *args, **kwargs)
+                await sync_to_async(store_response, thread_sensitive=False)(view, key, headers, response)
+                return response
+
+            return async_wrapper
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            key, headers, cached = cached_content(view, scope, kwarg, request, kwargs)
+            if cached is not None:
+                return hit_response(view, cached, headers)
+            return store_response(view, key, headers, view(request, *args, **kwargs))
+
+        return wrapper
+
+    return decorator
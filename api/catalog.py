@@ -0,0 +1,227 @@
+"""
+In-process catalog of survey definitions.
+
+Surveys, their questions in ``order_number`` order (``Surveyquestion``'s
+default ordering) with a pointer to the next one, option counts (and so the
+chart type) and option texts are loaded in a few queries into compact
+``__slots__`` records and shared by every request in the process. A cheap
+version query (row counts and highest ids of the catalog tables, plus their
+checksums on SQL Server) runs at most every ``CATALOG_CHECK_INTERVAL``
+seconds; when it changes, a new catalog is loaded and swapped in as a whole,
+so readers always see a consistent one. Counts and ids miss rows edited in
+place, so the catalog is also reloaded every ``CATALOG_MAX_AGE`` seconds; its
+key includes a digest of its content, so reports cached for the old
+definitions are not served for the new ones.
+"""
+
+import hashlib
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import connections, router
+
+from .models import *
+
+CATALOG_MODELS = [Survey, Surveyquestion, Question, Questionoption, Option]
+
+MULTIPLE_CHOICE = 'Multiple Choice'
+
+
+def chart_type(question_type, options_count):
+
+    if question_type == 'Text Entry':
+        return 'text'
+    elif options_count <= 4:
+        return 'bar'
+    return 'pie'
+
+
+class QuestionRecord:
+
+    __slots__ = (
+        'surveyquestionid', 'surveyid', 'order_number', 'questionid', 'question', 'type', 'chart_type', 'options',
+        'next_surveyquestionid',
+    )
+
+    def __init__(self, surveyquestionid, surveyid, order_number, questionid, question, type, options):
+        self.surveyquestionid = surveyquestionid
+        self.surveyid = surveyid
+        self.order_number = order_number
+        self.questionid = questionid
+        self.question = question
+        self.type = type
+        self.options = options
+        self.chart_type = chart_type(type, len(options))
+        # The question asked after this one in the same survey, if any
+        self.next_surveyquestionid = None
+
+    @property
+    def is_multiple_choice(self):
+        return self.type == MULTIPLE_CHOICE
+
+
+class SurveyRecord:
+
+    __slots__ = ('surveyid', 'title', 'description', 'questions')
+
+    def __init__(self, surveyid, title, description, questions):
+        self.surveyid = surveyid
+        self.title = title
+        self.description = description
+        self.questions = questions
+
+
+class Catalog:
+
+    __slots__ = ('version', 'surveys', 'questions', 'option_text', 'digest', 'loaded')
+
+    def __init__(self, version, surveys, questions, option_text):
+        self.version = version
+        # Surveys in surveyid order, each with its questions in order
+        self.surveys = surveys
+        # Survey question id -> QuestionRecord
+        self.questions = questions
+        # Option id -> option text
+        self.option_text = option_text
+        self.digest = content_digest(surveys, option_text)
+        self.loaded = time.monotonic()
+
+    def survey_ids(self):
+        return [survey.surveyid for survey in self.surveys]
+
+    def key(self):
+        return '.'.join(str(value or 0) for value in self.version) + '.' + self.digest
+
+
+def content_digest(surveys, option_text):
+
+    content = [
+        (survey.surveyid, survey.title, survey.description, [
+            (question.surveyquestionid, question.order_number, question.questionid, question.question,
+             question.type, question.options)
+            for question in survey.questions
+        ])
+        for survey in surveys
+    ]
+    return hashlib.md5(repr((content, sorted(option_text.items()))).encode()).hexdigest()[:12]
+
+
+def catalog_version(using=None):
+    """
+    Row count and highest primary key of every catalog table, and its
+    checksum on SQL Server, in one query.
+    """
+
+    using = using or router.db_for_read(Survey) or 'default'
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(catalog_version_sql(connection))
+        return tuple(cursor.fetchone())
+
+
+def catalog_version_sql(connection):
+
+    quote = connection.ops.quote_name
+    columns = []
+    for model in CATALOG_MODELS:
+        table, pk = quote(model._meta.db_table), quote(model._meta.pk.column)
+        columns.append('(SELECT COUNT(*) FROM %s)' % table)
+        columns.append('(SELECT MAX(%s) FROM %s)' % (pk, table))
+        if connection.vendor == 'microsoft':
+            # Moves when a row is edited in place, e.g. a question's text
+            columns.append('(SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM %s)' % table)
+    return 'SELECT %s' % ', '.join(columns)
+
+
+def has_expired(catalog):
+
+    # Backstop for edits in place, which only the SQL Server checksums see
+    max_age = getattr(settings, 'CATALOG_MAX_AGE', 600)
+    return max_age is not None and time.monotonic() - catalog.loaded >= max_age
+
+
+def load_catalog(version):
+
+    options = defaultdict(list)
+    for questionid, optionid in Questionoption.objects.order_by('questionoptionid').values_list('questionid', 'optionid'):
+        options[questionid].append(optionid)
+
+    questions = {}
+    survey_questions = defaultdict(list)
+    rows = (
+        Surveyquestion.objects.filter(questionid__isnull=False)
+        .order_by(*Surveyquestion._meta.ordering, 'surveyquestionid')
+        .values_list(
+            'surveyquestionid', 'surveyid', 'order_number',
+            'questionid', 'questionid__question', 'questionid__type',
+        )
+    )
+    for surveyquestionid, surveyid, order_number, questionid, question, question_type in rows:
+        record = QuestionRecord(
+            surveyquestionid, surveyid, order_number, questionid, question, question_type,
+            tuple(options.get(questionid, ())),
+        )
+        questions[surveyquestionid] = record
+        survey_questions[surveyid].append(record)
+
+    for records in survey_questions.values():
+        for record, following in zip(records, records[1:]):
+            record.next_surveyquestionid = following.surveyquestionid
+
+    surveys = tuple(
+        SurveyRecord(surveyid, title, description, tuple(survey_questions[surveyid]))
+        for surveyid, title, description in Survey.objects.order_by('surveyid').values_list('surveyid', 'title', 'description')
+    )
+    option_text = dict(Option.objects.values_list('optionid', 'optiontext'))
+    return Catalog(version, surveys, questions, option_text)
+
+
+class CatalogHolder:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (catalog, time of the last version check), replaced as a whole
+        self.state = None
+
+    def fresh(self, interval):
+        state = self.state
+        if state is not None and time.monotonic() - state[1] < interval:
+            return state[0]
+        return None
+
+    def get(self, check=False):
+        """
+        The current catalog. ``check`` forces a version check, e.g. when a
+        caller came across an id the catalog does not know yet.
+        """
+
+        interval = 0 if check else getattr(settings, 'CATALOG_CHECK_INTERVAL', 30)
+        catalog = self.fresh(interval)
+        if catalog is not None:
+            return catalog
+
+        with self.lock:
+            # Another thread may have checked it while we waited
+            catalog = self.fresh(interval)
+            if catalog is not None:
+                return catalog
+            version = catalog_version()
+            catalog = self.state[0] if self.state is not None else None
+            if catalog is None or catalog.version != version or has_expired(catalog):
+                catalog = load_catalog(version)
+            self.state = (catalog, time.monotonic())
+            return catalog
+
+    def reset(self):
+        with self.lock:
+            self.state = None
+
+
+holder = CatalogHolder()
+
+
+def get_catalog(check=False):
+
+    return holder.get(check)
@@ -0,0 +1,116 @@
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# Database execute wrappers of the current request, e.g. its query metrics,
+# which follow its work onto the threads running it, see run_in_connection
+query_wrappers = contextvars.ContextVar('query_wrappers', default=())
+
+
+def report_executor():
+    """
+    Process-wide pool running report sections. Its size, the
+    ``REPORT_CONCURRENCY`` setting, bounds how many report queries run
+    against the database at once across all requests.
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'REPORT_CONCURRENCY', 4),
+                thread_name_prefix='report',
+            )
+    return _executor
+
+
+def release_connections():
+    """
+    End a unit of work on a long-lived worker thread. Its connections stay
+    open for the next one, since with ``CONN_MAX_AGE = 0`` closing them would
+    cost a new database login per report section, unless they are unusable
+    after an error, were left in a transaction or are older than
+    ``REPORT_CONNECTION_MAX_AGE`` seconds.
+    """
+
+    max_age = getattr(settings, 'REPORT_CONNECTION_MAX_AGE', 300)
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is None:
+            continue
+        if connection.in_atomic_block or (connection.errors_occurred and not connection.is_usable()):
+            connection.close()
+            continue
+        connection.errors_occurred = False
+        # close_at is when CONN_MAX_AGE would have closed it: the time it was opened plus CONN_MAX_AGE
+        if max_age is not None and connection.close_at is not None:
+            opened = connection.close_at - connection.settings_dict['CONN_MAX_AGE']
+            if time.monotonic() - opened >= max_age:
+                connection.close()
+
+
+@contextmanager
+def execute_wrappers(wrappers):
+
+    # On this thread's connections, unless already there
+    with ExitStack() as stack:
+        for connection in connections.all():
+            for wrapper in wrappers:
+                if wrapper not in connection.execute_wrappers:
+                    stack.enter_context(connection.execute_wrapper(wrapper))
+        yield
+
+
+@contextmanager
+def wrapped_queries(wrapper):
+    """
+    Wrap the queries run in this context with ``wrapper``: those on this
+    thread, and those run by ``run_in_connection`` on other threads for it.
+    """
+
+    token = query_wrappers.set(query_wrappers.get() + (wrapper,))
+    try:
+        with execute_wrappers([wrapper]):
+            yield
+    finally:
+        query_wrappers.reset(token)
+
+
+def run_in_connection(func, *args, **kwargs):
+
+    # For pool threads, which keep their connections between calls
+    try:
+        with execute_wrappers(query_wrappers.get()):
+            return func(*args, **kwargs)
+    finally:
+        release_connections()
+
+
+def run_and_close_connections(func, *args, **kwargs):
+
+    # For a thread of its own: its connections end with it
+    try:
+        return func(*args, **kwargs)
+    finally:
+        connections.close_all()
+
+
+def run_concurrently(sections):
+    """
+    Drop-in replacement for ``reports.run_sections`` computing the sections
+    on the report pool. Results are returned in the order of ``sections``.
+    """
+
+    # Each section runs in a copy of the caller's context, e.g. its replica choice
+    futures = [
+        report_executor().submit(contextvars.copy_context().run, run_in_connection, section)
+        for section in sections
+    ]
+    return [future.result() for future in futures]
@@ -0,0 +1,113 @@
+"""
+Per-process cache of active survey conversations, keyed by sender number.
+
+Ingesting a message needs the sender's ``Userstate``; for senders in the
+middle of a conversation it is taken from here instead of the database. The
+cache holds at most ``CONVERSATION_CACHE_SIZE`` conversations, evicting the least
+recently used, and forgets entries after ``CONVERSATION_CACHE_TTL`` seconds so that
+states changed by another process are picked up again. Writes always go to the
+database first; the cache is only updated once the transaction commits.
+
+Entries are plain tuples of field values and every ``get`` builds fresh
+``Userstate`` instances, so a batch that fails leaves the cache untouched.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from .models import *
+
+
+def state_fields():
+
+    return [field.attname for field in Userstate._meta.concrete_fields]
+
+
+class ConversationCache:
+
+    def __init__(self, size=None, ttl=None):
+        self.size = size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # sender number -> (expiry, field values), least recently used first
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def limits(self):
+
+        size = self.size if self.size is not None else getattr(settings, 'CONVERSATION_CACHE_SIZE', 10000)
+        ttl = self.ttl if self.ttl is not None else getattr(settings, 'CONVERSATION_CACHE_TTL', 300)
+        return size, ttl
+
+    def get_many(self, senders):
+        """
+        Cached states of ``senders`` as ``Userstate`` instances, by sender
+        number, and the senders that have to be looked up in the database.
+        """
+
+        now = time.monotonic()
+        found, missing = {}, []
+        with self.lock:
+            for sender in senders:
+                entry = self.entries.get(sender)
+                if entry is not None and entry[0] <= now:
+                    del self.entries[sender]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    missing.append(sender)
+                    continue
+                self.hits += 1
+                self.entries.move_to_end(sender)
+                found[sender] = entry[1]
+        fields = state_fields()
+        states = {sender: Userstate.from_db(DEFAULT_DB_ALIAS, fields, values) for sender, values in found.items()}
+        return states, missing
+
+    def put_many(self, states):
+
+        size, ttl = self.limits()
+        fields = state_fields()
+        expiry = time.monotonic() + ttl
+        with self.lock:
+            for state in states:
+                if state.pk is None:
+                    continue
+                values = tuple(getattr(state, field) for field in fields)
+                self.entries[state.sender_number] = (expiry, values)
+                self.entries.move_to_end(state.sender_number)
+            while len(self.entries) > size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, senders):
+
+        with self.lock:
+            for sender in senders:
+                self.entries.pop(sender, None)
+
+    def hit_rate(self):
+
+        with self.lock:
+            lookups = self.hits + self.misses
+            return self.hits / lookups if lookups else 0.0
+
+    def snapshot(self):
+
+        with self.lock:
+            return {'size': len(self.entries), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def reset(self):
+
+        with self.lock:
+            self.entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+conversations = ConversationCache()
@@ -0,0 +1,185 @@
+"""
+Answer distributions of multiple choice questions by gender and age group.
+
+``crosstab`` loads the option selections of a scope once, as (survey
+question, option, person) ids, and the gender and age group of its people
+into NumPy arrays indexed by a dense numbering of the people, and computes
+every question's option x gender and option x age group table with
+``bincount`` over the flattened cells. ``orm_crosstab`` computes the same
+payload with a grouped query and is kept as the reference implementation.
+"""
+
+from datetime import date
+
+import numpy as np
+from django.db.models import Count, Value
+from django.db.models.functions import Coalesce
+
+from .cache import scope_filters
+from .catalog import get_catalog
+from .demographics import AGE_GROUPS, GENDERS, OLDEST_AGE_GROUP, age_group_expression
+from .models import *
+
+AGE_LABELS = [label for label, _ in AGE_GROUPS] + [OLDEST_AGE_GROUP]
+# Age at which each group after the first starts, for np.searchsorted
+AGE_BOUNDS = np.array([next_age for _, next_age in AGE_GROUPS])
+
+
+def choice_cells(catalog):
+    """
+    Every (survey question, option) of the catalog's multiple choice
+    questions, in survey and option order.
+    """
+
+    return [
+        (question, option_id)
+        for survey in catalog.surveys
+        for question in survey.questions
+        if question.is_multiple_choice
+        for option_id in question.options
+    ]
+
+
+def ages(birthdates, today):
+
+    # Whole years between each date of birth and today, like calculate_age()
+    years = birthdates.astype('datetime64[Y]').astype(np.int64) + 1970
+    months = birthdates.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    days = (birthdates - birthdates.astype('datetime64[M]')).astype(np.int64) + 1
+    before_birthday = (months > today.month) | ((months == today.month) & (days > today.day))
+    return today.year - years - before_birthday
+
+
+def contingency(cells, groups, cell_count, group_count):
+
+    # Cells x groups table; rows outside any group (-1) are left out
+    known = groups >= 0
+    table = np.bincount(cells[known] * group_count + groups[known], minlength=cell_count * group_count)
+    return table.reshape(cell_count, group_count)
+
+
+def payload(catalog, cells, totals, gender_table, age_table):
+
+    questions = {}
+    for index, (question, option_id) in enumerate(cells):
+        if question.surveyquestionid not in questions:
+            questions[question.surveyquestionid] = {
+                'surveyid': question.surveyid,
+                'questionid': question.questionid,
+                'question': question.question,
+                'answers': [],
+            }
+        questions[question.surveyquestionid]['answers'].append({
+            'answer': catalog.option_text.get(option_id),
+            'total': int(totals[index]),
+            'gender': dict(zip(GENDERS, map(int, gender_table[index]))),
+            'age': dict(zip(AGE_LABELS, map(int, age_table[index]))),
+        })
+    return list(questions.values())
+
+
+def person_groups(person_filters, people, today):
+    """
+    Gender and age group number of each of ``people`` (sorted person ids)
+    matching ``person_filters``, as arrays aligned with ``people``; -1 where
+    unknown.
+    """
+
+    gender_of = np.full(len(people), -1, dtype=np.int64)
+    age_of = np.full(len(people), -1, dtype=np.int64)
+    if not len(people):
+        return gender_of, age_of
+
+    rows = Person.objects.filter(**person_filters).values_list('personid', 'gender', 'date_of_birth')
+    ids, genders, birthdates = [np.array(column) for column in zip(*rows)] or [np.zeros(0, dtype=np.int64)] * 3
+    birthdates = birthdates.astype('datetime64[D]')
+
+    # Position of each person among people; those with no selections are left out
+    positions = np.minimum(np.searchsorted(people, ids), len(people) - 1)
+    known = people[positions] == ids
+    positions, genders, birthdates = positions[known], genders[known], birthdates[known]
+
+    for number, gender in enumerate(GENDERS):
+        gender_of[positions[genders == gender]] = number
+    born = ~np.isnat(birthdates)
+    age_of[positions[born]] = np.searchsorted(AGE_BOUNDS, ages(birthdates[born], today), side='right')
+    return gender_of, age_of
+
+
+def crosstab(scope='global', value=None, today=None):
+    """
+    Option selections per gender and age group for every multiple choice
+    question, counted over the ``Responseoption`` rows of a report scope
+    (``'global'``, or ``'community'``/``'country'`` with its id or code).
+    People of an unknown gender or age count towards the totals only.
+
+    Selections are loaded as plain (survey question, option, person) ids and
+    joined to the people of the scope by array indexing, over the people who
+    made them rather than the whole range of person ids.
+    """
+
+    today = today or date.today()
+    catalog = get_catalog()
+    cells = choice_cells(catalog)
+    if not cells:
+        return []
+
+    response_filters, person_filters = scope_filters(scope, value)
+    rows = (
+        Responseoption.objects.filter(**response_filters)
+        .annotate(person=Coalesce('personid', Value(0)))
+        .values_list('surveyquestionid', 'optionid', 'person')
+    )
+    selections = np.array(list(rows), dtype=np.int64).reshape(-1, 3)
+    surveyquestion_ids, option_ids, person_ids = selections.T
+
+    # Flatten (survey question, option) into one key and look up each row's cell
+    width = max(max(option_id for _, option_id in cells), int(option_ids.max(initial=0))) + 1
+    cell_keys = np.array([question.surveyquestionid * width + option_id for question, option_id in cells], dtype=np.int64)
+    order = np.argsort(cell_keys)
+    keys = surveyquestion_ids * width + option_ids
+    positions = np.minimum(np.searchsorted(cell_keys[order], keys), len(cells) - 1)
+    matched = cell_keys[order][positions] == keys
+    row_cells = order[positions[matched]]
+
+    people, person_index = np.unique(person_ids[matched], return_inverse=True)
+    gender_of, age_of = person_groups(person_filters, people, today)
+
+    totals = np.bincount(row_cells, minlength=len(cells))
+    gender_table = contingency(row_cells, gender_of[person_index], len(cells), len(GENDERS))
+    age_table = contingency(row_cells, age_of[person_index], len(cells), len(AGE_LABELS))
+    return payload(catalog, cells, totals, gender_table, age_table)
+
+
+def orm_crosstab(scope='global', value=None, today=None):
+    """
+    Same as ``crosstab``, with the grouping done by the database and the
+    tables filled in Python.
+    """
+
+    response_filters, _ = scope_filters(scope, value)
+    catalog = get_catalog()
+    cells = choice_cells(catalog)
+    index = {(question.surveyquestionid, option_id): number for number, (question, option_id) in enumerate(cells)}
+
+    totals = [0] * len(cells)
+    gender_table = [[0] * len(GENDERS) for _ in cells]
+    age_table = [[0] * len(AGE_LABELS) for _ in cells]
+    rows = (
+        Responseoption.objects.filter(**response_filters)
+        .annotate(age_group=age_group_expression(today, field='personid__date_of_birth'))
+        .values('surveyquestionid', 'optionid', 'personid__gender', 'age_group')
+        .annotate(total=Count('responseoptionid'))
+        .order_by()
+        .values_list('surveyquestionid', 'optionid', 'personid__gender', 'age_group', 'total')
+    )
+    for surveyquestionid, optionid, gender, age_group, total in rows:
+        cell = index.get((surveyquestionid, optionid))
+        if cell is None:
+            continue
+        totals[cell] += total
+        if gender in GENDERS:
+            gender_table[cell][GENDERS.index(gender)] += total
+        if age_group in AGE_LABELS:
+            age_table[cell][AGE_LABELS.index(age_group)] += total
+    return payload(catalog, cells, totals, gender_table, age_table)
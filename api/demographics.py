@@ -0,0 +1,133 @@
+from datetime import date
+
+from django.db.models import Case, CharField, Count, Value, When
+
+GENDERS = ['Male', 'Female', 'Other', 'I prefer not to say']
+
+# (label, age in whole years at which the next group starts)
+AGE_GROUPS = [
+    ('0-14', 15),
+    ('15-21', 22),
+    ('22-29', 30),
+    ('30-39', 40),
+    ('40-59', 60),
+]
+OLDEST_AGE_GROUP = 'Over 60'
+
+
+def calculate_age(birthdate, today=None):
+
+    today = today or date.today()
+    return today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
+
+
+def years_before(today, years):
+
+    try:
+        return today.replace(year=today.year - years)
+    except ValueError:
+        # 29 February in a year that is not a leap year
+        return today.replace(year=today.year - years, day=28)
+
+
+def age_group_expression(today=None, field='date_of_birth'):
+    """
+    Case/When expression labelling each person with their age group, using
+    ``date_of_birth`` (or ``field``, e.g. through a relation) against
+    ``today`` so the bucketing happens in the database. People without a
+    date of birth get no group.
+    """
+
+    today = today or date.today()
+    whens = [
+        When(**{'%s__gt' % field: years_before(today, next_age)}, then=Value(label))
+        for label, next_age in AGE_GROUPS
+    ]
+    whens.append(When(**{'%s__isnull' % field: False}, then=Value(OLDEST_AGE_GROUP)))
+    return Case(*whens, default=Value(None), output_field=CharField())
+
+
+def percentage(count, total):
+
+    return round((count / total) * 100, 1) if total else 0
+
+
+def calculate_demographics(queryset, today=None, by=None):
+    """
+    Count the people in ``queryset`` and compute their gender and age
+    composition as percentages, in a single grouped query. With ``by``, a
+    field of the people such as ``'communityid'``, the same is computed for
+    each of its values, still in one query, and returned as a dict keyed by
+    value; values without people are left out.
+    """
+
+    fields = [by] if by else []
+    rows = (
+        queryset.order_by()
+        .annotate(age_group=age_group_expression(today))
+        .values(*fields, 'gender', 'age_group')
+        .annotate(total=Count('pk'))
+        .values_list(*fields, 'gender', 'age_group', 'total')
+    )
+
+    groups = {}
+    for *key, gender, age_group, total in rows:
+        key = key[0] if by else None
+        if key not in groups:
+            groups[key] = empty_counts()
+        counts = groups[key]
+        counts['respondents'] += total
+        if gender in counts['gender']:
+            counts['gender'][gender] += total
+        if age_group in counts['age']:
+            counts['age'][age_group] += total
+
+    if by:
+        return {value: composition(**counts) for value, counts in groups.items()}
+    return composition(**groups.get(None, empty_counts()))
+
+
+def empty_counts():
+
+    return {
+        'respondents': 0,
+        'gender': dict.fromkeys(GENDERS, 0),
+        'age': dict.fromkeys([label for label, _ in AGE_GROUPS] + [OLDEST_AGE_GROUP], 0),
+    }
+
+
+def empty_demographics():
+
+    # What calculate_demographics() returns for nobody
+    return composition(**empty_counts())
+
+
+def composition(respondents, gender, age):
+
+    return {
+        'respondents': respondents,
+        'gender': {name: percentage(count, respondents) for name, count in gender.items()},
+        'age': {age_range: percentage(count, respondents) for age_range, count in age.items()},
+    }
+
+
+def calculate_gender_composition(queryset):
+
+    return calculate_demographics(queryset)['gender']
+
+
+def calculate_age_composition(queryset, today=None):
+
+    return calculate_demographics(queryset, today)['age']
+
+
+def age_distribution(age_composition):
+
+    return [
+        {'ageGroup': '0-14', 'percentage': age_composition['0-14']},
+        {'ageGroup': '15-21', 'percentage': age_composition['15-21']},
+        {'ageGroup': '22-29', 'percentage': age_composition['22-29']},
+        {'ageGroup': '30-39', 'percentage': age_composition['30-39']},
+        {'ageGroup': '40-59', 'percentage': age_composition['40-59']},
+        {'ageGroup': '60+', 'percentage': age_composition['Over 60']},
+    ]
@@ -0,0 +1,123 @@
+import csv
+import json
+from datetime import datetime, time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from .models import *
+
+FORMATS = ('ndjson', 'csv')
+
+# Output column -> Response lookup
+COLUMNS = [
+    ('responseId', 'responseid'),
+    ('responseData', 'responsedata'),
+    ('responseTimestamp', 'responsetimestamp'),
+    ('personId', 'personid'),
+    ('gender', 'personid__gender'),
+    ('dateOfBirth', 'personid__date_of_birth'),
+    ('communityId', 'personid__communityid'),
+    ('region', 'personid__communityid__region'),
+    ('countryCode', 'personid__communityid__countryid__code'),
+    ('countryName', 'personid__communityid__countryid__name'),
+    ('surveyId', 'surveyquestionid__surveyid'),
+    ('surveyQuestionId', 'surveyquestionid'),
+    ('questionId', 'surveyquestionid__questionid'),
+    ('question', 'surveyquestionid__questionid__question'),
+    ('questionType', 'surveyquestionid__questionid__type'),
+]
+
+
+class ExportError(ValueError):
+    pass
+
+
+def parse_timestamp(value, name):
+
+    try:
+        timestamp = parse_datetime(value) or parse_date(value)
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise ExportError("'%s' must be an ISO 8601 date or datetime" % name)
+    if not isinstance(timestamp, datetime):
+        timestamp = datetime.combine(timestamp, time.min)
+    if timezone.is_naive(timestamp):
+        timestamp = timezone.make_aware(timestamp)
+    return timestamp
+
+
+def parse_int(value, name):
+
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise ExportError("'%s' must be an integer" % name)
+
+
+def export_filters(survey=None, country=None, community=None, since=None, until=None, after=None):
+    """
+    Translate export parameters (as strings, e.g. from a query string) into
+    ``Response`` filters. Raises ``ExportError`` for malformed values.
+    """
+
+    filters = {}
+    if survey:
+        filters['surveyquestionid__surveyid'] = parse_int(survey, 'survey')
+    if country:
+        filters['personid__communityid__countryid__code'] = country
+    if community:
+        filters['personid__communityid'] = parse_int(community, 'community')
+    if since:
+        filters['responsetimestamp__gte'] = parse_timestamp(since, 'since')
+    if until:
+        filters['responsetimestamp__lt'] = parse_timestamp(until, 'until')
+    if after:
+        filters['responseid__gt'] = parse_int(after, 'after')
+    return filters
+
+
+def export_rows(filters, chunk_size=2000):
+    """
+    Yield one dict per response, in ``responseid`` order so an interrupted
+    export can resume with ``after`` set to the last id it received. Rows are
+    fetched in chunks, so memory use does not depend on the export size.
+    """
+
+    lookups = [lookup for _, lookup in COLUMNS]
+    responses = Response.objects.filter(**filters).order_by('responseid').values_list(*lookups)
+    for values in responses.iterator(chunk_size=chunk_size):
+        yield dict(zip((column for column, _ in COLUMNS), values))
+
+
+def ndjson_lines(rows):
+
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+class Echo:
+    # File-like object handing back what csv.writer writes to it
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+
+    writer = csv.writer(Echo())
+    yield writer.writerow([column for column, _ in COLUMNS])
+    for row in rows:
+        yield writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value
+            for value in row.values()
+        ])
+
+
+def export_lines(rows, format):
+
+    if format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
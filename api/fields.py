@@ -0,0 +1,87 @@
+"""
+Sparse fieldsets for the report endpoints.
+
+``?fields=`` (or its alias ``?include=``) lists the parts of a payload a
+client wants as dotted paths, e.g. ``communityInfo.responders`` or
+``surveyInfo``; in lists the path applies to every item. The reports ask
+``Fields.wants`` before computing a section, so what is not requested is not
+queried either, and ``Fields.apply`` leaves only the requested keys.
+"""
+
+import re
+
+# A node whose whole subtree is selected
+ALL = None
+
+PATH = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$')
+
+
+class FieldError(ValueError):
+    pass
+
+
+class Fields:
+    """
+    Selection of dotted paths; everything when there are none.
+    """
+
+    def __init__(self, paths=None):
+        self.tree = ALL
+        for path in paths or []:
+            if self.tree is ALL:
+                self.tree = {}
+            node = self.tree
+            *parents, last = path.split('.')
+            for name in parents:
+                if node.get(name, {}) is ALL:
+                    break
+                node = node.setdefault(name, {})
+            else:
+                node[last] = ALL
+
+    def wants(self, path):
+        """
+        Whether any part of ``path`` is selected.
+        """
+
+        node = self.tree
+        for name in path.split('.'):
+            if node is ALL:
+                return True
+            if name not in node:
+                return False
+            node = node[name]
+        return True
+
+    def apply(self, payload):
+
+        return prune(payload, self.tree)
+
+
+def prune(value, node):
+
+    if node is ALL:
+        return value
+    if isinstance(value, list):
+        return [prune(item, node) for item in value]
+    if isinstance(value, dict):
+        return {name: prune(item, node[name]) for name, item in value.items() if name in node}
+    return value
+
+
+def requested_fields(request):
+    """
+    The ``Fields`` of a request's ``fields`` and ``include`` parameters,
+    comma separated or repeated. Raises ``FieldError`` for malformed paths.
+    """
+
+    paths = [
+        path.strip()
+        for value in request.GET.getlist('fields') + request.GET.getlist('include')
+        for path in value.split(',')
+        if path.strip()
+    ]
+    for path in paths:
+        if not PATH.match(path):
+            raise FieldError("'%s' is not a field path, e.g. communityInfo.responders" % path)
+    return Fields(paths)
@@ -0,0 +1,261 @@
+"""
+Index advice for the report endpoints.
+
+The ``api`` models are unmanaged, so nothing guarantees the legacy tables have
+an index on the columns the reports filter, join and group on. ``advise``
+replays the queries of each endpoint, reads their plans (``EXPLAIN QUERY
+PLAN`` on SQLite, the XML showplan on SQL Server) and reports full scans of
+large tables along with covering indexes that would avoid them:
+
+- on SQLite each candidate index is created in turn, the endpoint's queries
+  are timed with and without it, and the measured speedup is the expected
+  benefit;
+- on SQL Server the optimizer's own missing index suggestions are used, with
+  their estimated impact.
+
+Proposals are written as SQL Server DDL, the production database.
+"""
+
+import re
+import time
+import xml.etree.ElementTree as ElementTree
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+
+from .benchmark import percentile
+from .catalog import get_catalog
+
+# Indexes the report queries can use on the legacy tables: (table, key columns, included columns)
+CANDIDATE_INDEXES = [
+    ('Response', ['personId'], ['surveyQuestionId', 'responseTimestamp']),
+    ('Response', ['surveyQuestionId'], ['personId']),
+    ('Response', ['responseTimestamp'], ['personId']),
+    ('Person', ['communityId'], ['gender', 'date_of_birth']),
+    ('Community', ['countryId'], []),
+    ('SurveyQuestion', ['surveyId'], ['questionId']),
+    ('QuestionOption', ['questionId'], ['optionId']),
+]
+
+SHOWPLAN = '{http://schemas.microsoft.com/sqlserver/2004/07/showplan}'
+SCAN_OPERATORS = {'Table Scan', 'Clustered Index Scan', 'Index Scan'}
+
+
+def index_name(table, columns):
+
+    return 'IX_%s_%s' % (table, '_'.join(columns))
+
+
+def index_ddl(table, columns, include=()):
+    """
+    SQL Server ``CREATE INDEX`` statement of a (covering) index.
+    """
+
+    ddl = 'CREATE NONCLUSTERED INDEX [%s] ON [dbo].[%s] (%s)' % (
+        index_name(table, columns), table, ', '.join('[%s]' % column for column in columns),
+    )
+    if include:
+        ddl += ' INCLUDE (%s)' % ', '.join('[%s]' % column for column in include)
+    return ddl
+
+
+def capture_queries(client, url):
+    """
+    The (sql, params) of every query run while requesting ``url``, with the
+    report cache bypassed (see ``advise``).
+    """
+
+    queries = []
+
+    def capture(execute, sql, params, many, context):
+        queries.append((sql, params))
+        return execute(sql, params, many, context)
+
+    with connection.execute_wrapper(capture):
+        response = client.get(url)
+    if response.status_code != 200:
+        raise RuntimeError('%s returned %d' % (url, response.status_code))
+    return [(sql, params) for sql, params in queries if sql.lstrip().upper().startswith('SELECT')]
+
+
+def sqlite_scans(sql, params):
+    """
+    Tables the SQLite plan of a query reads in full.
+    """
+
+    # Django aliases tables it joins more than once, e.g. "Person" T5
+    aliases = {alias: table for table, alias in re.findall(r'"(\w+)" (T\d+)', sql)}
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        details = [row[-1] for row in cursor.fetchall()]
+    # Subqueries, e.g. the "qualify" of window filters, are scanned too
+    tables = set(connection.introspection.table_names())
+    scans = []
+    for detail in details:
+        match = re.match(r'SCAN (\w+)', detail)
+        if match and aliases.get(match.group(1), match.group(1)) in tables:
+            scans.append(aliases.get(match.group(1), match.group(1)))
+    return scans
+
+
+def showplan(sql, params):
+
+    with connection.cursor() as cursor:
+        cursor.execute('SET SHOWPLAN_XML ON')
+        try:
+            cursor.execute(sql, params)
+            return ''.join(row[0] for row in cursor.fetchall())
+        finally:
+            cursor.execute('SET SHOWPLAN_XML OFF')
+
+
+def showplan_scans(plan):
+    """
+    Tables a SQL Server showplan reads in full, and its missing index
+    suggestions as (impact %, table, key columns, included columns).
+    """
+
+    root = ElementTree.fromstring(plan)
+    scans = []
+    for operator in root.iter(SHOWPLAN + 'RelOp'):
+        if operator.get('PhysicalOp') in SCAN_OPERATORS:
+            scanned = operator.find('.//%sObject' % SHOWPLAN)
+            if scanned is not None:
+                scans.append(scanned.get('Table', '').strip('[]'))
+
+    suggestions = []
+    for group in root.iter(SHOWPLAN + 'MissingIndexGroup'):
+        for missing in group.iter(SHOWPLAN + 'MissingIndex'):
+            columns = {'EQUALITY': [], 'INEQUALITY': [], 'INCLUDE': []}
+            for column_group in missing.iter(SHOWPLAN + 'ColumnGroup'):
+                columns[column_group.get('Usage')] += [
+                    column.get('Name').strip('[]') for column in column_group.iter(SHOWPLAN + 'Column')
+                ]
+            suggestions.append((
+                float(group.get('Impact')), missing.get('Table').strip('[]'),
+                columns['EQUALITY'] + columns['INEQUALITY'], columns['INCLUDE'],
+            ))
+    return scans, suggestions
+
+
+def table_rows(table):
+
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM %s' % connection.ops.quote_name(table))
+        return cursor.fetchone()[0]
+
+
+def replay(queries, repeat):
+
+    # Median time of running every query, in milliseconds
+    timings = []
+    with connection.cursor() as cursor:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for sql, params in queries:
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            timings.append((time.perf_counter() - started) * 1000)
+    return percentile(timings, 50)
+
+
+def measure_candidate(queries, table, columns, include, repeat):
+    """
+    Time ``queries`` with the candidate index added; SQLite has no INCLUDE,
+    so the included columns are appended to the key.
+    """
+
+    name = connection.ops.quote_name(index_name(table, columns))
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE INDEX %s ON %s (%s)' % (
+            name, connection.ops.quote_name(table),
+            ', '.join(connection.ops.quote_name(column) for column in [*columns, *include]),
+        ))
+        cursor.execute('ANALYZE')
+        try:
+            return replay(queries, repeat)
+        finally:
+            cursor.execute('DROP INDEX %s' % name)
+
+
+def query_scans(sql, params):
+
+    # (tables read in full, missing index suggestions) of one query
+    if connection.vendor == 'sqlite':
+        return sqlite_scans(sql, params), []
+    return showplan_scans(showplan(sql, params))
+
+
+def advise(urls, min_rows=1000, min_benefit=10, repeat=5):
+    """
+    Scans of tables of at least ``min_rows`` rows and proposed indexes for
+    every endpoint in ``urls`` (name to URL), keeping proposals expected to
+    speed the endpoint's queries up by at least ``min_benefit`` percent (all
+    of them when None). Reports are computed without the report cache, which
+    is neither read nor written: it may be shared with the web workers.
+    """
+
+    client = Client()
+    rows = {}
+    advice = {}
+    get_catalog()
+    alias = getattr(settings, 'REPORT_CACHE_ALIAS', 'default')
+    uncached = {**settings.CACHES, alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    with override_settings(CATALOG_CHECK_INTERVAL=3600, REPORT_REPLICAS=[], CACHES=uncached):
+        for name, url in urls.items():
+            queries = capture_queries(client, url)
+            scans, suggestions = [], []
+            for sql, params in queries:
+                tables, query_suggestions = query_scans(sql, params)
+                suggestions += query_suggestions
+                for table in tables:
+                    if table not in rows:
+                        rows[table] = table_rows(table)
+                    if rows[table] >= min_rows:
+                        scans.append({'table': table, 'rows': rows[table], 'query': sql})
+
+            proposals = {}
+            if connection.vendor == 'sqlite':
+                with connection.cursor() as cursor:
+                    cursor.execute('ANALYZE')
+                baseline = replay(queries, repeat)
+                scanned = {scan['table'] for scan in scans}
+                for table, columns, include in CANDIDATE_INDEXES:
+                    if table in scanned:
+                        timing = measure_candidate(queries, table, columns, include, repeat)
+                        benefit = (baseline - timing) / baseline * 100 if baseline else 0
+                        proposals[index_ddl(table, columns, include)] = round(benefit, 1)
+            else:
+                for impact, table, columns, include in suggestions:
+                    ddl = index_ddl(table, columns, include)
+                    proposals[ddl] = max(impact, proposals.get(ddl, 0))
+
+            advice[name] = {
+                'url': url,
+                'queries': len(queries),
+                'scans': scans,
+                'proposals': [
+                    {'ddl': ddl, 'benefit_pct': benefit}
+                    for ddl, benefit in sorted(proposals.items(), key=lambda proposal: -proposal[1])
+                    if min_benefit is None or benefit >= min_benefit
+                ],
+            }
+    return advice
+
+
+def drop_secondary_indexes(tables):
+    """
+    Drop the indexes Django created on ``tables`` (SQLite only), leaving
+    primary keys, to reproduce a legacy schema with nothing but those.
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN (%s)"
+            % ', '.join(['%s'] * len(tables)),
+            list(tables),
+        )
+        for (name,) in cursor.fetchall():
+            cursor.execute('DROP INDEX %s' % connection.ops.quote_name(name))
@@ -0,0 +1,429 @@
+"""
+Ingestion of inbound survey messages, e.g. SMS relayed by a gateway.
+
+Each sender's conversation lives in ``Userstate``: a new sender first names
+their country, region and gender, which creates their ``Person``, then picks a
+survey by id and answers its questions in ``order_number`` order, after which
+they can pick another survey.
+
+``ingest_messages`` applies a whole batch in memory and writes the outcome with
+a few bulk statements in one transaction, so its query count does not grow
+with the batch size. ``IngestQueue`` is an optional write-behind buffer that
+acknowledges messages at once and ingests them in batches, by size or age.
+Batches it fails to write are appended to a dead letter file, from which
+``replay_dead_letters`` ingests them again.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .catalog import get_catalog
+from .concurrency import run_and_close_connections
+from .conversations import conversations
+from .demographics import GENDERS
+from .export import ExportError, parse_timestamp
+from .models import *
+from .tally import index_responses
+
+logger = logging.getLogger('api.ingest')
+
+# Userstate.stage: what the next message from the sender answers
+STAGE_COUNTRY = 'country'
+STAGE_REGION = 'region'
+STAGE_GENDER = 'gender'
+STAGE_SURVEY = 'survey'
+STAGE_QUESTION = 'question'
+
+STATE_FIELDS = ['personid', 'stage', 'surveyid', 'surveyquestionid', 'temp_country', 'temp_region', 'temp_gender']
+
+
+class IngestError(ValueError):
+    pass
+
+
+class Message:
+
+    __slots__ = ('sender', 'text', 'timestamp')
+
+    def __init__(self, sender, text, timestamp):
+        self.sender = sender
+        self.text = text
+        self.timestamp = timestamp
+
+    def as_dict(self):
+        # The form parse_messages reads
+        return {
+            'sender': str(self.sender),
+            'text': self.text,
+            'timestamp': self.timestamp.isoformat() if self.timestamp else None,
+        }
+
+
+def parse_messages(data):
+    """
+    Messages from a request payload: either a list or ``{"messages": [...]}``
+    of ``{"sender": ..., "text": ..., "timestamp": ...}`` objects, the
+    timestamp being optional. Raises ``IngestError`` for malformed input.
+    """
+
+    if isinstance(data, dict):
+        data = data.get('messages')
+    if not isinstance(data, list):
+        raise IngestError("Expected a list of messages")
+
+    messages = []
+    for index, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise IngestError("Message %d must be an object" % index)
+        sender = str(item.get('sender', '')).strip().lstrip('+')
+        # isdecimal() rather than isdigit(): int() rejects digits such as '²'
+        if not sender.isdecimal():
+            raise IngestError("Message %d: 'sender' must be a phone number" % index)
+        text = item.get('text')
+        if not isinstance(text, str):
+            raise IngestError("Message %d: 'text' must be a string" % index)
+        timestamp = None
+        if item.get('timestamp'):
+            try:
+                timestamp = parse_timestamp(item['timestamp'], 'timestamp')
+            except ExportError as error:
+                raise IngestError("Message %d: %s" % (index, error))
+        messages.append(Message(int(sender), text.strip(), timestamp))
+    return messages
+
+
+def choose(text, choices):
+
+    # A choice given by its 1-based number or its text, case-insensitively
+    if text.isdecimal() and 1 <= int(text) <= len(choices):
+        return choices[int(text) - 1]
+    for choice in choices:
+        if choice.lower() == text.lower():
+            return choice
+    return None
+
+
+class Batch:
+    """
+    Conversation state of the senders in one batch, and the rows the batch
+    creates or changes, written together by ``save``.
+    """
+
+    def __init__(self, senders):
+        self.catalog = get_catalog()
+        self.surveys = {survey.surveyid: survey for survey in self.catalog.surveys}
+        self.now = timezone.now()
+
+        self.states, missing = conversations.get_many(senders)
+        if missing:
+            # The latest state of a sender wins should there be several
+            states = Userstate.objects.select_for_update().filter(sender_number__in=missing).order_by('userid')
+            for state in states:
+                self.states[state.sender_number] = state
+
+        self.countries = {}
+        for country in Country.objects.all():
+            for name in (country.code, country.name):
+                if name:
+                    self.countries[name.lower()] = country
+        self.communities = {
+            (community.countryid_id, (community.region or '').lower()): community
+            for community in Community.objects.all()
+        }
+
+        self.new_states = []
+        self.changed_states = {}
+        self.new_communities = []
+        self.new_people = {}
+        self.responses = []
+
+    def community(self, country, region):
+
+        key = (country.countryid, region.lower())
+        if key not in self.communities:
+            community = Community(countryid=country, region=region)
+            self.new_communities.append(community)
+            self.communities[key] = community
+        return self.communities[key]
+
+    def answer(self, question, text):
+
+        if not question.is_multiple_choice:
+            return text[:255]
+        # Options are chosen by number or text, several separated by commas
+        texts = [self.catalog.option_text.get(option_id) or '' for option_id in question.options]
+        option_ids = []
+        for part in text.split(','):
+            chosen = choose(part.strip(), texts)
+            if chosen is None:
+                return None
+            option_id = question.options[texts.index(chosen)]
+            if option_id not in option_ids:
+                option_ids.append(option_id)
+        return ','.join(str(option_id) for option_id in option_ids)
+
+    def advance(self, state, message):
+        """
+        Apply one message to its sender's state. Returns an error message
+        when the message does not answer the current stage, which then stays.
+        """
+
+        text = message.text
+
+        if state.stage == STAGE_COUNTRY:
+            country = self.countries.get(text.lower())
+            if country is None:
+                return "Unknown country"
+            state.temp_country = country.code
+            state.stage = STAGE_REGION
+
+        elif state.stage == STAGE_REGION:
+            if not text:
+                return "Region must not be empty"
+            state.temp_region = text[:100]
+            state.stage = STAGE_GENDER
+
+        elif state.stage == STAGE_GENDER:
+            gender = choose(text, GENDERS)
+            if gender is None:
+                return "Gender must be one of: %s" % ', '.join(GENDERS)
+            country = self.countries.get((state.temp_country or '').lower())
+            if country is None:
+                state.stage = STAGE_COUNTRY
+                return "Unknown country"
+            state.temp_gender = gender
+            # Saved ahead of the states and responses pointing at it, see save()
+            person = Person(
+                sender_number=str(state.sender_number),
+                gender=gender,
+                communityid=self.community(country, state.temp_region),
+            )
+            self.new_people[state.sender_number] = person
+            state.personid = person
+            state.stage = STAGE_SURVEY
+
+        elif state.stage == STAGE_SURVEY:
+            survey = self.surveys.get(int(text)) if text.isdecimal() else None
+            if survey is None or not survey.questions:
+                return "Unknown survey"
+            state.surveyid_id = survey.surveyid
+            state.surveyquestionid_id = survey.questions[0].surveyquestionid
+            state.stage = STAGE_QUESTION
+
+        elif state.stage == STAGE_QUESTION:
+            question = self.catalog.questions.get(state.surveyquestionid_id)
+            if question is None:
+                state.surveyquestionid_id = None
+                state.stage = STAGE_SURVEY
+                return "The survey has changed, please choose a survey again"
+            responsedata = self.answer(question, text)
+            if responsedata is None:
+                return "Answer must be one of the options"
+            response = Response(
+                surveyquestionid_id=question.surveyquestionid,
+                responsedata=responsedata,
+                responsetimestamp=message.timestamp or self.now,
+            )
+            if state.sender_number in self.new_people:
+                response.personid = self.new_people[state.sender_number]
+            else:
+                response.personid_id = state.personid_id
+            self.responses.append(response)
+
+            state.surveyquestionid_id = question.next_surveyquestionid
+            if state.surveyquestionid_id is None:
+                state.stage = STAGE_SURVEY
+
+        else:
+            return "Unknown conversation stage %r" % state.stage
+
+        return None
+
+    def receive(self, message):
+
+        state = self.states.get(message.sender)
+        error = None
+        if state is None:
+            # The first message of a sender only opens the conversation
+            state = self.states[message.sender] = Userstate(sender_number=message.sender, stage=STAGE_COUNTRY)
+            self.new_states.append(state)
+        else:
+            error = self.advance(state, message)
+            if state.pk is not None:
+                self.changed_states[state.pk] = state
+
+        result = {'sender': message.sender, 'stage': state.stage, 'surveyquestionid': state.surveyquestionid_id}
+        if error:
+            result['error'] = error
+        return result
+
+    def save(self):
+
+        # In dependency order: bulk_create sets the ids of new communities and
+        # people, which the rows created after them pick up from the instances
+        Community.objects.bulk_create(self.new_communities)
+        Person.objects.bulk_create(self.new_people.values())
+        Userstate.objects.bulk_create(self.new_states)
+        Userstate.objects.bulk_update(self.changed_states.values(), STATE_FIELDS)
+        Response.objects.bulk_create(self.responses)
+        # bulk_create sends no post_save, so index the option selections here
+        index_responses(self.responses)
+
+
+def ingest_messages(messages):
+    """
+    Apply a batch of messages, in order, in one transaction. Returns one
+    result per message: the sender's stage after it, their current survey
+    question and, when the message was rejected, an ``error``.
+    """
+
+    with transaction.atomic():
+        batch = Batch({message.sender for message in messages})
+        results = [batch.receive(message) for message in messages]
+        batch.save()
+        # Write-through: the conversation cache only learns committed states
+        transaction.on_commit(partial(conversations.put_many, list(batch.states.values())))
+    return results
+
+
+class IngestQueue:
+    """
+    Write-behind buffer in front of ``ingest_messages``. Queued messages are
+    written once ``batch_size`` of them are waiting, by the thread adding the
+    last one, or ``flush_interval`` seconds after the first one at the latest,
+    by a timer. Batches are written one at a time, in arrival order. A batch
+    that fails is appended to the ``dead_letters`` file, to be replayed with
+    ``replay_dead_letters``. Messages still queued when the process dies are
+    lost.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=1.0, ingest=ingest_messages, dead_letters=None):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.ingest = ingest
+        self.dead_letters = dead_letters
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.pending = []
+        self.timer = None
+        self.ingested = 0
+        self.failed = 0
+
+    def put(self, messages):
+
+        with self.lock:
+            self.pending.extend(messages)
+            full = len(self.pending) >= self.batch_size
+            if not full and self.timer is None:
+                self.timer = threading.Timer(self.flush_interval, run_and_close_connections, [self.flush])
+                self.timer.daemon = True
+                self.timer.start()
+        if full:
+            self.flush()
+        return len(messages)
+
+    def flush(self):
+
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+                if self.timer is not None:
+                    self.timer.cancel()
+                    self.timer = None
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                try:
+                    self.ingest(batch)
+                except Exception:
+                    self.failed += len(batch)
+                    logger.exception("Failed to ingest %d queued messages", len(batch))
+                    self.dead_letter(batch)
+                else:
+                    self.ingested += len(batch)
+
+    def dead_letter(self, batch):
+
+        if not self.dead_letters:
+            logger.error("No INGEST_DEAD_LETTER_PATH; %d acknowledged messages are lost", len(batch))
+            return
+        try:
+            append_dead_letters(self.dead_letters, batch)
+        except OSError:
+            logger.exception("Failed to keep %d messages in %s", len(batch), self.dead_letters)
+
+    def __len__(self):
+        with self.lock:
+            return len(self.pending)
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def ingest_queue():
+    """
+    Process-wide write-behind queue, sized by ``INGEST_BATCH_SIZE`` and
+    ``INGEST_FLUSH_INTERVAL``. Whatever is queued is flushed at exit.
+    """
+
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = IngestQueue(
+                batch_size=getattr(settings, 'INGEST_BATCH_SIZE', 500),
+                flush_interval=getattr(settings, 'INGEST_FLUSH_INTERVAL', 1.0),
+                dead_letters=getattr(settings, 'INGEST_DEAD_LETTER_PATH', None),
+            )
+            atexit.register(_queue.flush)
+    return _queue
+
+
+def append_dead_letters(path, messages):
+
+    # One JSON message per line, on disk before this returns
+    with open(path, 'a', encoding='utf-8') as dead_letters:
+        for message in messages:
+            dead_letters.write(json.dumps(message.as_dict()) + '\n')
+        dead_letters.flush()
+        os.fsync(dead_letters.fileno())
+
+
+def replay_dead_letters(path, batch_size=500, ingest=ingest_messages):
+    """
+    Ingest the messages of the dead letter file ``path`` again, in batches
+    and in their original order. The file is set aside first, so batches
+    failing again are appended to a fresh one; the messages of a batch that
+    fails, and of every batch after it, go back there to keep senders'
+    messages in order. Returns the number of messages ingested and failed.
+    """
+
+    replaying = path + '.replaying'
+    if not os.path.exists(replaying):
+        try:
+            os.replace(path, replaying)
+        except FileNotFoundError:
+            return 0, 0
+    # Otherwise an earlier replay was interrupted; finish it first
+    with open(replaying, encoding='utf-8') as dead_letters:
+        messages = parse_messages([json.loads(line) for line in dead_letters if line.strip()])
+
+    ingested = 0
+    for start in range(0, len(messages), batch_size):
+        batch = messages[start:start + batch_size]
+        try:
+            ingest(batch)
+        except Exception:
+            logger.exception("Failed to replay %d messages", len(batch))
+            append_dead_letters(path, messages[start:])
+            break
+        ingested += len(batch)
+    os.remove(replaying)
+    return ingested, len(messages) - ingested
@@ -0,0 +1,331 @@
+"""
+Community leaderboard, from counters maintained incrementally.
+
+``update_leaderboard`` reads the responses after the leaderboard's
+``Watermark`` and updates ``Leaderboardcounter``: per community, for every
+survey and for all of them, the people who responded, the distinct (person,
+survey) responses and the latest response. Whether a person or a (person,
+survey) pair is new is decided against the responses before the batch, so a
+run costs the new responses and the earlier ones of the same people.
+
+``Leaderboard`` keeps the counters of each process in memory with, per
+(country, survey, metric) asked for, a sorted list of the ranked communities:
+top N is a slice and the rank of a community a bisection. Rankings are only
+kept for surveys of the catalog and countries with counters, so there are a
+bounded number of them whatever is asked for. Counters carry the
+watermark of the run that last changed them, so a refresh loads and re-sorts
+only the communities that changed. A rebuild ends at the same watermark, so it
+also moves a generation, on which processes drop what they have and reload.
+"""
+
+import threading
+from bisect import bisect_left, insort
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max
+
+from .activity import parse_id
+from .catalog import get_catalog
+from .models import *
+
+WATERMARK = 'leaderboard'
+
+# Not a response id: the number of rebuilds so far
+GENERATION = 'leaderboard_generation'
+
+METRICS = ('responses', 'respondents', 'responseRate', 'recent')
+
+# People per IN (...) when looking up earlier responses
+LOOKUP_CHUNK = 1000
+
+
+class LeaderboardError(ValueError):
+    pass
+
+
+def leaderboard_watermark():
+
+    watermark = Watermark.objects.filter(name=WATERMARK).values_list('responseid', flat=True).first()
+    return watermark or 0
+
+
+def leaderboard_version():
+
+    # (generation, watermark): the counters only change when one of them moves
+    rows = dict(Watermark.objects.filter(name__in=[GENERATION, WATERMARK]).values_list('name', 'responseid'))
+    return rows.get(GENERATION, 0), rows.get(WATERMARK, 0)
+
+
+def earlier_responses(people, watermark):
+
+    # (person, survey) pairs answered up to response id ``watermark``
+    people = sorted(people)
+    pairs = set()
+    for start in range(0, len(people), LOOKUP_CHUNK):
+        pairs.update(
+            Response.objects.filter(responseid__lte=watermark, personid__in=people[start:start + LOOKUP_CHUNK])
+            .values_list('personid', 'surveyquestionid__surveyid')
+            .distinct()
+        )
+    return pairs
+
+
+def update_leaderboard(batch_size=50000):
+    """
+    Bring ``Leaderboardcounter`` up to date, ``batch_size`` response ids at a
+    time, each batch in its own transaction. Returns the number of responses
+    counted, i.e. those of people in a community.
+    """
+
+    latest = Response.objects.aggregate(responseid=Max('responseid'))['responseid'] or 0
+    watermark = leaderboard_watermark()
+    processed = 0
+    while watermark < latest:
+        upto = min(watermark + batch_size, latest)
+        rows = list(
+            Response.objects.filter(
+                responseid__gt=watermark, responseid__lte=upto, personid__communityid__isnull=False,
+            )
+            .order_by('responseid')
+            .values_list('personid', 'personid__communityid', 'surveyquestionid__surveyid', 'responsetimestamp')
+        )
+        seen_pairs = earlier_responses({personid for personid, _, _, _ in rows}, watermark)
+        seen_people = {personid for personid, _ in seen_pairs}
+
+        # (community, survey or None) -> [new respondents, new responses, latest response]
+        changes = defaultdict(lambda: [0, 0, None])
+        for personid, communityid, surveyid, timestamp in rows:
+            keys = [(communityid, None), (communityid, surveyid)] if surveyid is not None else [(communityid, None)]
+            if personid not in seen_people:
+                seen_people.add(personid)
+                changes[communityid, None][0] += 1
+            if (personid, surveyid) not in seen_pairs:
+                seen_pairs.add((personid, surveyid))
+                changes[communityid, None][1] += 1
+                if surveyid is not None:
+                    # A new (person, survey) pair is a new respondent of the survey
+                    changes[communityid, surveyid][0] += 1
+                    changes[communityid, surveyid][1] += 1
+            for key in keys:
+                change = changes[key]
+                if timestamp is not None and (change[2] is None or timestamp > change[2]):
+                    change[2] = timestamp
+
+        with transaction.atomic():
+            counters = {
+                (counter.communityid_id, counter.surveyid_id): counter
+                for counter in Leaderboardcounter.objects.select_for_update().filter(
+                    communityid__in={communityid for communityid, _ in changes},
+                )
+            }
+            created, updated = [], []
+            for (communityid, surveyid), (respondents, responses, timestamp) in changes.items():
+                counter = counters.get((communityid, surveyid))
+                if counter is None:
+                    created.append(Leaderboardcounter(
+                        communityid_id=communityid, surveyid_id=surveyid, respondents=respondents,
+                        responses=responses, lastresponse=timestamp, watermark=upto,
+                    ))
+                    continue
+                counter.respondents += respondents
+                counter.responses += responses
+                if timestamp is not None and (counter.lastresponse is None or timestamp > counter.lastresponse):
+                    counter.lastresponse = timestamp
+                counter.watermark = upto
+                updated.append(counter)
+            Leaderboardcounter.objects.bulk_create(created)
+            Leaderboardcounter.objects.bulk_update(updated, ['respondents', 'responses', 'lastresponse', 'watermark'])
+            Watermark.objects.update_or_create(name=WATERMARK, defaults={'responseid': upto})
+        processed += len(rows)
+        watermark = upto
+    return processed
+
+
+def rebuild_leaderboard(batch_size=50000):
+
+    with transaction.atomic():
+        Leaderboardcounter.objects.all().delete()
+        Watermark.objects.filter(name=WATERMARK).delete()
+        generation, _ = Watermark.objects.select_for_update().get_or_create(name=GENERATION, defaults={'responseid': 0})
+        generation.responseid += 1
+        generation.save(update_fields=['responseid'])
+    return update_leaderboard(batch_size)
+
+
+class Leaderboard:
+    """
+    In-process copy of the leaderboard counters with sorted rankings.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.clear()
+
+    def clear(self):
+
+        # Called with the lock held
+        self.generation = None
+        self.watermark = None
+        # community id -> {survey id or None: (respondents, responses, latest response)}
+        self.counters = defaultdict(dict)
+        # community id -> (region, country code, country name)
+        self.communities = {}
+        # Country codes of those communities
+        self.countries = set()
+        # (country code, survey id, metric) -> sorted [(sort key, community id)]
+        self.rankings = {}
+
+    def value(self, communityid, surveyid, metric):
+
+        counters = self.counters[communityid]
+        respondents, responses, timestamp = counters.get(surveyid, (0, 0, None))
+        if metric == 'responses':
+            return responses
+        if metric == 'respondents':
+            return respondents
+        if metric == 'recent':
+            return timestamp.timestamp() if timestamp else float('-inf')
+        # Share of the community's respondents who answered the survey, or of
+        # the surveys its respondents answered on average; divided by the
+        # number of surveys for display only, which keeps the order
+        total = counters.get(None, (0, 0, None))[0]
+        return (responses if surveyid is None else respondents) / total if total else 0
+
+    def entry(self, key, communityid):
+
+        # Sort key: highest value first, then lowest community id
+        return (-self.value(communityid, key[1], key[2]), communityid)
+
+    def ranked(self, key, communityid):
+
+        country, surveyid, _ = key
+        return (
+            surveyid in self.counters[communityid]
+            and (country is None or self.communities[communityid][1] == country)
+        )
+
+    def refresh(self):
+        """
+        Load the counters changed since the last refresh and re-sort their
+        communities in every ranking built so far; after a rebuild, start
+        over.
+        """
+
+        generation, watermark = leaderboard_version()
+        with self.lock:
+            if (generation, watermark) == (self.generation, self.watermark):
+                return
+            if generation != self.generation:
+                self.clear()
+            since = self.watermark or 0
+
+        rows = list(
+            Leaderboardcounter.objects.filter(watermark__gt=since).values_list(
+                'communityid', 'surveyid', 'respondents', 'responses', 'lastresponse',
+                'communityid__region', 'communityid__countryid__code', 'communityid__countryid__name',
+            )
+        )
+        with self.lock:
+            changed = {row[0] for row in rows}
+            for key, ranking in self.rankings.items():
+                for communityid in changed:
+                    if communityid in self.communities and self.ranked(key, communityid):
+                        del ranking[bisect_left(ranking, self.entry(key, communityid))]
+            for communityid, surveyid, respondents, responses, timestamp, region, code, name in rows:
+                self.counters[communityid][surveyid] = (respondents, responses, timestamp)
+                self.communities[communityid] = (region, code, name)
+                self.countries.add(code)
+            for key, ranking in self.rankings.items():
+                for communityid in changed:
+                    if self.ranked(key, communityid):
+                        insort(ranking, self.entry(key, communityid))
+            self.generation, self.watermark = generation, watermark
+
+    def ranking(self, key, survey_ids):
+
+        # Built on first use, then kept sorted by refresh(); nothing is kept for unknown countries or surveys
+        country, surveyid, _ = key
+        if country is not None and country not in self.countries:
+            return []
+        if surveyid is not None and surveyid not in survey_ids:
+            return []
+        if key not in self.rankings:
+            self.rankings[key] = sorted(
+                self.entry(key, communityid) for communityid in self.counters if self.ranked(key, communityid)
+            )
+        return self.rankings[key]
+
+    def describe(self, key, communityid, rank, surveys):
+
+        respondents, responses, timestamp = self.counters[communityid].get(key[1], (0, 0, None))
+        rate = self.value(communityid, key[1], 'responseRate')
+        region, code, name = self.communities[communityid]
+        return {
+            'rank': rank,
+            'id': communityid,
+            'region': region,
+            'country': code,
+            'countryName': name,
+            'respondents': respondents,
+            'responses': responses,
+            'responseRate': round(rate * 100 / (surveys if key[1] is None else 1), 1) if surveys else 0,
+            'lastResponseDate': timestamp,
+        }
+
+    def top(self, metric='responses', country=None, survey=None, limit=10, community=None):
+        """
+        The ``limit`` best communities by ``metric``, within a country and
+        for a survey if given, and the rank of ``community``.
+        """
+
+        self.refresh()
+        survey_ids = set(get_catalog().survey_ids())
+        surveys = len(survey_ids)
+        key = (country, survey, metric)
+        with self.lock:
+            ranking = self.ranking(key, survey_ids)
+            data = {
+                'metric': metric,
+                'country': country,
+                'survey': survey,
+                'communities': len(ranking),
+                'top': [
+                    self.describe(key, communityid, rank, surveys)
+                    for rank, (_, communityid) in enumerate(ranking[:limit], start=1)
+                ],
+            }
+            if community is not None:
+                data['community'] = None
+                if community in self.communities and self.ranked(key, community):
+                    rank = bisect_left(ranking, self.entry(key, community)) + 1
+                    data['community'] = self.describe(key, community, rank, surveys)
+        return data
+
+
+leaderboard = Leaderboard()
+
+
+def leaderboard_filters(metric=None, country=None, survey=None, community=None):
+    """
+    Translate leaderboard parameters (as strings, e.g. from a query string)
+    into ``Leaderboard.top`` arguments. Raises ``LeaderboardError`` for
+    malformed values.
+    """
+
+    metric = metric or 'responses'
+    if metric not in METRICS:
+        raise LeaderboardError("'metric' must be one of: %s" % ', '.join(METRICS))
+    try:
+        return {
+            'metric': metric,
+            'country': country or None,
+            'survey': parse_id(survey, 'survey') if survey else None,
+            'community': parse_id(community, 'community') if community else None,
+        }
+    except ValueError as error:
+        raise LeaderboardError(str(error))
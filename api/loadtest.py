@@ -0,0 +1,274 @@
+"""
+Concurrent load test of the WSGI application.
+
+``run_load_test`` replays a plan of requests, drawn by ``request_plan`` from a
+weighted mix of the ``api/urls.py`` routes, against
+``testMyApi.wsgi.application`` from a pool of threads or processes. The
+application is called directly with a WSGI environ, so no server or network
+is involved: what is measured is the middleware, views and database under
+concurrent requests, including their contention for locks and connections.
+Results are per route: requests per second, latency percentiles and queries
+per request.
+"""
+
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from urllib.parse import urlencode
+from wsgiref.util import setup_testing_defaults
+
+from django.conf import settings
+from django.db import connections
+from django.urls import reverse
+
+from testMyApi.wsgi import application
+
+from .benchmark import percentile
+from .leaderboard import METRICS
+from .models import *
+
+# Share of the requests of each route, roughly that of dashboard traffic. The
+# export streams whole survey datasets and can be weighted in with a mix;
+# ingest is left out, it writes.
+DEFAULT_MIX = {
+    'get_community': 30,
+    'get_country': 15,
+    'get_communities': 10,
+    'get_countries': 10,
+    'survey_statistics': 10,
+    'get_text_answers': 5,
+    'get_reports': 5,
+    'get_timeseries': 5,
+    'get_leaderboard': 5,
+    'get_crosstab': 3,
+    'metrics': 2,
+    'export_responses': 0,
+}
+
+# Communities per /api/reports request
+REPORTS_BATCH = 5
+
+
+def with_query(path, **params):
+
+    return '%s?%s' % (path, urlencode(params)) if params else path
+
+
+# Route name -> function of the dataset targets and a Random returning a URL to request
+ROUTES = {
+    'get_community': lambda targets, rng: reverse('get_community', args=[rng.choice(targets['communities'])]),
+    'get_country': lambda targets, rng: reverse('get_country', args=[rng.choice(targets['countries'])]),
+    'get_communities': lambda targets, rng: reverse('get_communities'),
+    'get_countries': lambda targets, rng: reverse('get_countries'),
+    'survey_statistics': lambda targets, rng: reverse('survey_statistics'),
+    'get_text_answers': lambda targets, rng: reverse(
+        'get_text_answers', args=[rng.choice(targets['communities']), rng.choice(targets['text_questions'])],
+    ),
+    'get_reports': lambda targets, rng: with_query(reverse('get_reports'), community=','.join(
+        str(communityid)
+        for communityid in rng.sample(targets['communities'], min(REPORTS_BATCH, len(targets['communities'])))
+    )),
+    'get_timeseries': lambda targets, rng: with_query(
+        reverse('get_timeseries'), granularity='week', survey=rng.choice(targets['surveys']),
+    ),
+    'get_leaderboard': lambda targets, rng: with_query(
+        reverse('get_leaderboard'), metric=rng.choice(METRICS), country=rng.choice(targets['countries']),
+    ),
+    'get_crosstab': lambda targets, rng: with_query(reverse('get_crosstab'), country=rng.choice(targets['countries'])),
+    'metrics': lambda targets, rng: reverse('metrics'),
+    'export_responses': lambda targets, rng: with_query(
+        reverse('export_responses'), survey=rng.choice(targets['surveys']),
+    ),
+}
+
+
+class LoadTestError(ValueError):
+    pass
+
+
+def parse_mix(value):
+    """
+    Route weights from ``name=weight`` pairs, comma separated, e.g.
+    ``get_community=3,get_country=1``; routes not listed get no requests.
+    """
+
+    mix = dict.fromkeys(ROUTES, 0)
+    for item in value.split(','):
+        name, _, weight = item.strip().partition('=')
+        if name not in ROUTES:
+            raise LoadTestError("Unknown route '%s'; choose from: %s" % (name, ', '.join(ROUTES)))
+        try:
+            mix[name] = int(weight)
+        except ValueError:
+            raise LoadTestError("The weight of '%s' must be an integer" % name)
+        if mix[name] < 0:
+            raise LoadTestError("The weight of '%s' must not be negative" % name)
+    if not any(mix.values()):
+        raise LoadTestError("Give at least one route a positive weight")
+    return mix
+
+
+def dataset_targets():
+
+    # What the routes can be asked about
+    return {
+        'communities': list(Community.objects.order_by('communityid').values_list('communityid', flat=True)),
+        'countries': list(
+            Country.objects.exclude(code__isnull=True).order_by('code').values_list('code', flat=True).distinct()
+        ),
+        'surveys': list(Survey.objects.order_by('surveyid').values_list('surveyid', flat=True)),
+        'text_questions': list(
+            Surveyquestion.objects.filter(questionid__type='Text Entry')
+            .order_by('surveyquestionid')
+            .values_list('surveyquestionid', flat=True)
+        ),
+    }
+
+
+def request_plan(mix, requests, seed=0):
+    """
+    ``requests`` (route, URL) pairs drawn from the routes of ``mix`` with its
+    weights, the same for the same dataset and ``seed``.
+    """
+
+    rng = random.Random(seed)
+    targets = dataset_targets()
+    names = [name for name, weight in mix.items() if weight > 0]
+    plan = []
+    for name in rng.choices(names, weights=[mix[name] for name in names], k=requests):
+        try:
+            plan.append((name, ROUTES[name](targets, rng)))
+        except IndexError:
+            raise LoadTestError("The dataset has nothing to request from '%s'" % name)
+    return plan
+
+
+def wsgi_environ(url):
+
+    path, _, query = url.partition('?')
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': query, 'SCRIPT_NAME': ''}
+    setup_testing_defaults(environ)
+    environ['HTTP_HOST'] = 'testserver'
+    if getattr(settings, 'EXPORT_TOKEN', None):
+        environ['HTTP_AUTHORIZATION'] = 'Bearer %s' % settings.EXPORT_TOKEN
+    return environ
+
+
+def load_request(item):
+    """
+    Call the WSGI application with a GET of the (route, URL) ``item`` and
+    read the whole response. Returns the route, status code, seconds taken
+    and number of queries run.
+    """
+
+    route, url = item
+    queries = 0
+    statuses = []
+
+    def count(execute, sql, params, many, context):
+        nonlocal queries
+        queries += 1
+        return execute(sql, params, many, context)
+
+    def start_response(status, headers, exc_info=None):
+        statuses.append(int(status.split()[0]))
+
+    started = time.perf_counter()
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(count))
+        body = application(wsgi_environ(url), start_response)
+        try:
+            for _ in body:
+                pass
+        finally:
+            # Ends the request: request_finished closes the connection as after a real one
+            body.close()
+    return route, statuses[0], time.perf_counter() - started, queries
+
+
+def run_load_test(plan, workers=8, processes=False, warmup=0):
+    """
+    Replay ``plan`` on a pool of ``workers`` threads or processes, the first
+    ``warmup`` requests before the clock starts, and summarize the rest.
+    """
+
+    if processes:
+        # Children must not share the parent's database connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='load')
+
+    with pool:
+        list(pool.map(load_request, plan[:warmup]))
+        started = time.perf_counter()
+        results = list(pool.map(load_request, plan[warmup:]))
+        elapsed = time.perf_counter() - started
+    return summarize(results, elapsed, workers, processes)
+
+
+def latency(timings):
+
+    return {
+        'p50_ms': round(percentile(timings, 50), 2),
+        'p95_ms': round(percentile(timings, 95), 2),
+        'p99_ms': round(percentile(timings, 99), 2),
+        'max_ms': round(max(timings), 2),
+    }
+
+
+def summarize(results, elapsed, workers, processes):
+    """
+    Requests, errors (responses other than 200), requests per second,
+    latency percentiles and queries per request, per route and in total.
+    """
+
+    by_route = {}
+    for route, status, seconds, queries in results:
+        by_route.setdefault(route, []).append((status, seconds * 1000, queries))
+
+    def statistics(requests):
+        counts = [queries for _, _, queries in requests]
+        return {
+            'requests': len(requests),
+            'errors': sum(status != 200 for status, _, _ in requests),
+            'rps': round(len(requests) / elapsed, 1) if elapsed else 0,
+            **latency([timing for _, timing, _ in requests]),
+            'queries_mean': round(sum(counts) / len(counts), 1),
+            'queries_max': max(counts),
+        }
+
+    if not results:
+        raise LoadTestError("No requests to measure")
+    return {
+        'workers': workers,
+        'processes': processes,
+        'elapsed_s': round(elapsed, 3),
+        **statistics([request for requests in by_route.values() for request in requests]),
+        'routes': {route: statistics(requests) for route, requests in sorted(by_route.items())},
+    }
+
+
+def compare_results(results, baseline):
+    """
+    Change in percent of the requests per second and p95 latency of every
+    route, and in total, from ``baseline`` (results of an earlier run).
+    """
+
+    def change(current, previous):
+        return round((current - previous) / previous * 100, 1) if previous else None
+
+    pairs = [('total', results, baseline)] + [
+        (route, result, baseline['routes'][route])
+        for route, result in results['routes'].items()
+        if route in baseline.get('routes', {})
+    ]
+    return {
+        name: {
+            'rps_change_pct': change(current['rps'], previous['rps']),
+            'p95_change_pct': change(current['p95_ms'], previous['p95_ms']),
+        }
+        for name, current, previous in pairs
+    }
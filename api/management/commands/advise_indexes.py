@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import SCALES, benchmark_urls, generate_dataset
+from api.indexes import advise, drop_secondary_indexes
+from testMyApi.test_runner import UnmanagedModelTestRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the queries of every report endpoint, flag full scans of large tables in their plans and "
+        "propose covering indexes with their expected benefit. On SQL Server the configured database is "
+        "analysed with showplan, which runs every endpoint's queries against it and needs --database to "
+        "confirm; with --settings=testMyApi.test_settings a throwaway SQLite database is seeded and every "
+        "proposal is measured."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='medium', help="Dataset to seed on SQLite.")
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--keep-indexes', action='store_true',
+            help="On SQLite, keep the indexes Django creates for foreign keys instead of starting from "
+                 "primary keys only, like the legacy schema.",
+        )
+        parser.add_argument('--min-rows', type=int, default=1000, help="Ignore scans of smaller tables.")
+        parser.add_argument('--min-benefit', type=float, default=10, help="Smallest expected benefit, in percent.")
+        parser.add_argument('--repeat', type=int, default=5, help="Timings per measurement on SQLite.")
+        parser.add_argument('--output', help="Write the advice as JSON to this file.")
+        parser.add_argument(
+            '--database',
+            help="On SQL Server, the name of the configured database, to confirm it may be analysed.",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite':
+            advice = self.advise_sqlite(options)
+        elif connection.vendor == 'microsoft':
+            name = connection.settings_dict['NAME']
+            if options['database'] != name:
+                raise CommandError(
+                    "This runs the queries of every report against the %s database; pass --database %s "
+                    "to confirm." % (name, name)
+                )
+            advice = advise(benchmark_urls(), options['min_rows'], options['min_benefit'])
+        else:
+            raise CommandError("Index advice needs SQL Server or SQLite, not %s" % connection.vendor)
+
+        for name, endpoint in advice.items():
+            self.stdout.write("%s (%s, %d queries)" % (name, endpoint['url'], endpoint['queries']))
+            for table in sorted({scan['table'] for scan in endpoint['scans']}):
+                scans = [scan for scan in endpoint['scans'] if scan['table'] == table]
+                self.stdout.write("  scan of %s (%d rows) in %d queries" % (table, scans[0]['rows'], len(scans)))
+            for proposal in endpoint['proposals']:
+                self.stdout.write("  %5.1f%%  %s" % (proposal['benefit_pct'], proposal['ddl']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(advice, output, indent=2)
+
+    def advise_sqlite(self, options):
+
+        runner = UnmanagedModelTestRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            if not options['keep_indexes']:
+                drop_secondary_indexes([model._meta.db_table for model in runner.unmanaged_models])
+            responses = generate_dataset(seed=options['seed'], **SCALES[options['scale']])
+            self.stdout.write("Generated '%s' dataset with %d responses" % (options['scale'], responses))
+            return advise(benchmark_urls(), options['min_rows'], options['min_benefit'], options['repeat'])
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
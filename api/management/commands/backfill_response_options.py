@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.models import Response, Responseoption, Watermark
+from api.tally import MULTIPLE_CHOICE, WATERMARK, index_responses, indexed_watermark
+
+
+class Command(BaseCommand):
+    help = (
+        "Index the options selected by multiple choice responses into ResponseOption. "
+        "Only responses after the last backfilled one are processed unless --rebuild is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--rebuild', action='store_true', help="Drop the index and rebuild it from scratch.")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        if options['rebuild']:
+            with transaction.atomic():
+                Responseoption.objects.all().delete()
+                Watermark.objects.filter(name=WATERMARK).delete()
+        watermark = indexed_watermark()
+
+        responses = Response.objects.filter(surveyquestionid__questionid__type=MULTIPLE_CHOICE).order_by('responseid')
+        indexed = processed = 0
+        while True:
+            batch = list(
+                responses.filter(responseid__gt=watermark)
+                .only('responseid', 'surveyquestionid', 'personid', 'responsedata')[:batch_size]
+            )
+            if not batch:
+                break
+            watermark = batch[-1].responseid
+            with transaction.atomic():
+                indexed += index_responses(batch)
+                Watermark.objects.update_or_create(name=WATERMARK, defaults={'responseid': watermark})
+            processed += len(batch)
+            self.stdout.write("Indexed up to response %d" % watermark)
+
+        self.stdout.write(self.style.SUCCESS("Processed %d responses, %d option selections" % (processed, indexed)))
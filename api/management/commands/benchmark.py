@@ -0,0 +1,71 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.benchmark import (
+    BUDGETS_PATH, SCALES, check_budgets, generate_dataset, load_budgets, run_benchmark, run_connection_benchmark,
+    run_crosstab_benchmark,
+)
+from testMyApi.test_runner import UnmanagedModelTestRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every report endpoint against a seeded synthetic dataset in a throwaway SQLite "
+        "database, and fail when a query count or p95 latency exceeds its stored budget. "
+        "Run with --settings=testMyApi.test_settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--iterations', type=int, default=10)
+        parser.add_argument('--cached', action='store_true', help="Keep the report cache between requests.")
+        parser.add_argument('--budgets', default=BUDGETS_PATH, help="JSON file of budgets per scale and endpoint.")
+        parser.add_argument('--no-check', action='store_true', help="Report results without checking budgets.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument(
+            '--crosstab', action='store_true',
+            help="Also compare the NumPy cross-tab with the ORM one (not budgeted).",
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The benchmark builds its own SQLite database; run it with --settings=testMyApi.test_settings.")
+
+        runner = UnmanagedModelTestRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        old_config = runner.setup_databases()
+        try:
+            responses = generate_dataset(seed=options['seed'], **SCALES[options['scale']])
+            self.stdout.write("Generated '%s' dataset with %d responses" % (options['scale'], responses))
+            results = run_benchmark(iterations=options['iterations'], cached=options['cached'])
+            connect = run_connection_benchmark(iterations=options['iterations'])
+            comparison = run_crosstab_benchmark(iterations=options['iterations']) if options['crosstab'] else {}
+        finally:
+            runner.teardown_databases(old_config)
+            runner.teardown_test_environment()
+
+        for name, result in results.items():
+            self.stdout.write("%-20s %4d queries  p50 %8.2fms  p95 %8.2fms" % (
+                name, result['queries'], result['p50_ms'], result['p95_ms'],
+            ))
+        self.stdout.write("%-20s               p50 %8.2fms  p95 %8.2fms  (per request with CONN_MAX_AGE=0)" % (
+            'new connection', connect['p50_ms'], connect['p95_ms'],
+        ))
+        for name, result in comparison.items():
+            self.stdout.write("%-20s               p50 %8.2fms  p95 %8.2fms" % (name, result['p50_ms'], result['p95_ms']))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump({
+                    'scale': options['scale'], 'results': results, 'connection': connect, 'comparison': comparison,
+                }, output, indent=2)
+
+        if not options['no_check']:
+            budgets = load_budgets(options['budgets']).get(options['scale'], {})
+            violations = check_budgets(results, budgets)
+            if violations:
+                raise CommandError("Over budget:\n" + "\n".join(violations))
+            self.stdout.write(self.style.SUCCESS("All endpoints within budget"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.export import FORMATS, ExportError, export_filters, export_lines, export_rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream responses joined with person, community, country and question details as NDJSON or CSV. "
+        "Use --after with the last exported responseId to resume an interrupted export."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--output', help="File to write to. Defaults to stdout.")
+        parser.add_argument('--survey', help="Survey id.")
+        parser.add_argument('--country', help="Country code.")
+        parser.add_argument('--community', help="Community id.")
+        parser.add_argument('--since', help="Only responses at or after this ISO 8601 date/datetime.")
+        parser.add_argument('--until', help="Only responses before this ISO 8601 date/datetime.")
+        parser.add_argument('--after', help="Only responses with a responseId greater than this.")
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            filters = export_filters(
+                survey=options['survey'],
+                country=options['country'],
+                community=options['community'],
+                since=options['since'],
+                until=options['until'],
+                after=options['after'],
+            )
+        except ExportError as error:
+            raise CommandError(error)
+
+        lines = export_lines(export_rows(filters, chunk_size=options['chunk_size']), options['format'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
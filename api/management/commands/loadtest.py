@@ -0,0 +1,107 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test.utils import override_settings
+
+from api.activity import update_rollup
+from api.benchmark import SCALES, generate_dataset
+from api.leaderboard import update_leaderboard
+from api.loadtest import DEFAULT_MIX, LoadTestError, compare_results, parse_mix, request_plan, run_load_test
+from testMyApi.test_runner import UnmanagedModelTestRunner
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test testMyApi.wsgi.application in-process: replay a weighted mix of the API routes against a "
+        "seeded synthetic dataset in a throwaway SQLite database from a pool of threads or processes, and report "
+        "requests per second, p50/p95/p99 latency and queries per request for each route. "
+        "Run with --settings=testMyApi.test_settings."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', choices=SCALES, default='small')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--requests', type=int, default=500, help="Requests measured, after the warm-up.")
+        parser.add_argument('--warmup', type=int, default=50, help="Requests made before measuring.")
+        parser.add_argument('--workers', type=int, default=8, help="Concurrent requests.")
+        parser.add_argument('--processes', action='store_true', help="Use processes instead of threads.")
+        parser.add_argument(
+            '--mix',
+            help="Route weights as name=weight pairs, comma separated; default: %s." % ','.join(
+                '%s=%d' % item for item in DEFAULT_MIX.items() if item[1]
+            ),
+        )
+        parser.add_argument('--uncached', action='store_true', help="Compute every report; no report cache.")
+        parser.add_argument('--output', help="Write the results as JSON to this file.")
+        parser.add_argument('--compare', help="JSON results of an earlier run to compare with.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("The load test builds its own SQLite database; run it with --settings=testMyApi.test_settings.")
+        try:
+            mix = parse_mix(options['mix']) if options['mix'] else DEFAULT_MIX
+        except LoadTestError as error:
+            raise CommandError(str(error))
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as previous:
+                baseline = json.load(previous)
+
+        overrides = {'CATALOG_CHECK_INTERVAL': 3600}
+        if options['uncached']:
+            alias = getattr(settings, 'REPORT_CACHE_ALIAS', 'default')
+            overrides['CACHES'] = {**settings.CACHES, alias: {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+        runner = UnmanagedModelTestRunner(verbosity=0, interactive=False)
+        runner.setup_test_environment()
+        with tempfile.TemporaryDirectory() as directory:
+            # A database file rather than in memory, so worker processes can open it too
+            for name in connections:
+                connections[name].settings_dict['TEST']['NAME'] = os.path.join(directory, '%s.sqlite3' % name)
+            old_config = runner.setup_databases()
+            try:
+                responses = generate_dataset(seed=options['seed'], **SCALES[options['scale']])
+                update_rollup()
+                update_leaderboard()
+                self.stdout.write("Generated '%s' dataset with %d responses" % (options['scale'], responses))
+                plan = request_plan(mix, options['warmup'] + options['requests'], seed=options['seed'])
+                with override_settings(**overrides):
+                    results = run_load_test(plan, options['workers'], options['processes'], options['warmup'])
+            except LoadTestError as error:
+                raise CommandError(str(error))
+            finally:
+                runner.teardown_databases(old_config)
+                runner.teardown_test_environment()
+
+        results['scale'] = options['scale']
+        for route, result in results['routes'].items():
+            self.stdout.write(self.format(route, result))
+        self.stdout.write(self.format('total', results))
+        self.stdout.write("%d workers (%s), %.2fs" % (
+            results['workers'], 'processes' if results['processes'] else 'threads', results['elapsed_s'],
+        ))
+
+        if baseline:
+            for name, change in compare_results(results, baseline).items():
+                self.stdout.write("%-20s req/s %+7.1f%%  p95 %+7.1f%%" % (
+                    name, change['rps_change_pct'] or 0, change['p95_change_pct'] or 0,
+                ))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+        if results['errors']:
+            raise CommandError("%d requests failed" % results['errors'])
+        self.stdout.write(self.style.SUCCESS("Load test finished"))
+
+    def format(self, name, result):
+
+        return "%-20s %6d req  %8.1f req/s  p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %6.1f queries" % (
+            name, result['requests'], result['rps'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['queries_mean'],
+        )
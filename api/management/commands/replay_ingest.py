@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.ingest import replay_dead_letters
+
+
+class Command(BaseCommand):
+    help = (
+        "Ingest again the write-behind batches that failed and were kept in the dead letter file "
+        "(INGEST_DEAD_LETTER_PATH unless --path is given). Messages failing again stay in the file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Dead letter file. Defaults to INGEST_DEAD_LETTER_PATH.")
+        parser.add_argument('--batch-size', type=int, default=500, help="Messages per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'INGEST_DEAD_LETTER_PATH', None)
+        if not path:
+            raise CommandError("Set INGEST_DEAD_LETTER_PATH or pass --path.")
+        ingested, failed = replay_dead_letters(path, batch_size=options['batch_size'])
+        if failed:
+            raise CommandError("Replayed %d messages; %d failed again and were kept in %s" % (ingested, failed, path))
+        self.stdout.write(self.style.SUCCESS("Replayed %d messages" % ingested))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.activity import rebuild_rollup, update_rollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Roll responses up into DailyActivity (responses and respondents per day, community and survey), "
+        "processing only responses after the last rolled up one unless --rebuild is given. "
+        "Run it periodically, e.g. every few minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help="Response ids per transaction.")
+        parser.add_argument('--rebuild', action='store_true', help="Drop the rollup and rebuild it from scratch.")
+
+    def handle(self, *args, **options):
+        rollup = rebuild_rollup if options['rebuild'] else update_rollup
+        responses, days = rollup(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Rolled up %d responses over %d days" % (responses, days)))
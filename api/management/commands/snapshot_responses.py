@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.snapshot import Snapshot, snapshot_dir, update_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        "Append the responses added since the last run to the local columnar response snapshot "
+        "(REPORT_SNAPSHOT_DIR unless --path is given), creating it on the first run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help="Snapshot directory. Defaults to REPORT_SNAPSHOT_DIR.")
+        parser.add_argument('--chunk-size', type=int, default=20000)
+        parser.add_argument('--rebuild', action='store_true', help="Drop the snapshot and rebuild it from scratch.")
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_dir()
+        if not path:
+            raise CommandError("Set REPORT_SNAPSHOT_DIR or pass --path.")
+
+        appended = update_snapshot(path, chunk_size=options['chunk_size'], rebuild=options['rebuild'])
+        snapshot = Snapshot.open(path)
+        self.stdout.write(self.style.SUCCESS(
+            "Appended %d responses; %d rows up to response %d" % (appended, snapshot.rows, snapshot.watermark)
+        ))
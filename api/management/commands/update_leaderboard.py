@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.leaderboard import rebuild_leaderboard, update_leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        "Add new responses to the per-community counters behind /api/leaderboard, "
+        "processing only responses after the last counted one unless --rebuild is given. "
+        "Run it periodically, e.g. every few minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help="Response ids per transaction.")
+        parser.add_argument('--rebuild', action='store_true', help="Drop the counters and rebuild them from scratch.")
+
+    def handle(self, *args, **options):
+        update = rebuild_leaderboard if options['rebuild'] else update_leaderboard
+        responses = update(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Counted %d responses" % responses))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from api.sketches import rebuild_sketches, update_sketches
+
+
+class Command(BaseCommand):
+    help = (
+        "Add the people of new responses to the HyperLogLog respondent sketches used by ?approximate=1 reports, "
+        "processing only responses after the last sketched one unless --rebuild is given. "
+        "Run it periodically, e.g. every few minutes from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50000, help="Response ids per transaction.")
+        parser.add_argument('--rebuild', action='store_true', help="Drop the sketches and rebuild them from scratch.")
+
+    def handle(self, *args, **options):
+        update = rebuild_sketches if options['rebuild'] else update_sketches
+        responses = update(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS("Sketched %d responses" % responses))
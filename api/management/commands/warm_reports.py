@@ -0,0 +1,68 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import percentile
+from api.warming import WarmingError, warm_paths, warm_reports
+
+
+class Command(BaseCommand):
+    help = (
+        "Compute and cache the report of every community and country, e.g. after a deploy or a cache flush, "
+        "on a pool of workers with their own database connections. Reports already cached are left as they are. "
+        "The report cache must be shared with the web workers, e.g. Redis or memcached."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--processes', action='store_true',
+            help="Use processes instead of threads.",
+        )
+        parser.add_argument(
+            '--recent-first', action='store_true',
+            help="Warm the communities and countries with the latest responses first.",
+        )
+        parser.add_argument('--only', choices=['communities', 'countries'])
+        parser.add_argument('--limit', type=int, help="Warm at most this many reports of each kind.")
+
+    def handle(self, *args, **options):
+        paths = []
+        for kind in ('communities', 'countries'):
+            if options['only'] in (None, kind):
+                kinds = {'communities': kind == 'communities', 'countries': kind == 'countries'}
+                paths += warm_paths(options['recent_first'], **kinds)[:options['limit']]
+        if not paths:
+            self.stdout.write("No reports to warm")
+            return
+
+        timings = []
+        slowest = []
+        computed = failed = 0
+        start = time.perf_counter()
+        try:
+            for path, status, cache, seconds in warm_reports(paths, options['workers'], options['processes']):
+                timings.append(seconds * 1000)
+                slowest.append((seconds, path))
+                if status != 200:
+                    failed += 1
+                    self.stderr.write("%s: status %d" % (path, status))
+                elif cache == 'MISS':
+                    computed += 1
+                if options['verbosity'] >= 2:
+                    self.stdout.write("%-40s %-4s %8.2fms" % (path, cache, seconds * 1000))
+        except WarmingError as error:
+            raise CommandError(str(error))
+        elapsed = time.perf_counter() - start
+
+        self.stdout.write(
+            "Warmed %d reports (%d computed, %d already cached) in %.2fs, %.1f reports/s; p50 %.2fms  p95 %.2fms" % (
+                len(timings), computed, len(timings) - computed - failed, elapsed,
+                len(timings) / elapsed if elapsed else 0, percentile(timings, 50), percentile(timings, 95),
+            )
+        )
+        for seconds, path in sorted(slowest, reverse=True)[:5]:
+            self.stdout.write("  slowest: %-40s %8.2fms" % (path, seconds * 1000))
+        if failed:
+            raise CommandError("%d reports failed" % failed)
+        self.stdout.write(self.style.SUCCESS("Report cache warmed"))
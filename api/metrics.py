@@ -0,0 +1,172 @@
+import threading
+import time
+from contextvars import ContextVar
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .cache import stats as cache_stats
+from .conversations import conversations
+
+# Upper bounds of the histogram buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+current_request = ContextVar('current_request', default=None)
+
+
+class RequestMetrics:
+    """
+    Timings collected while serving one sampled request.
+    """
+
+    __slots__ = ('started', 'total', 'queries', 'db_time', 'serialize_time', 'statements', 'slow_queries', 'lock')
+
+    def __init__(self, slow_queries=3):
+        self.started = time.perf_counter()
+        self.total = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.statements = []
+        self.slow_queries = slow_queries
+        # Report sections record their queries from the threads of the pool
+        self.lock = threading.Lock()
+
+    def record_query(self, sql, duration):
+        with self.lock:
+            self.queries += 1
+            self.db_time += duration
+            # Only the slowest few statements are kept
+            if len(self.statements) < self.slow_queries or duration > self.statements[-1][0]:
+                self.statements.append((duration, sql))
+                self.statements.sort(key=lambda statement: -statement[0])
+                del self.statements[self.slow_queries:]
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper, see connection.execute_wrapper()
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.record_query(sql, time.perf_counter() - started)
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started
+
+    @property
+    def view_time(self):
+        # Time spent in Python outside the database and JSON encoding
+        return max(self.total - self.db_time - self.serialize_time, 0.0)
+
+    def server_timing(self):
+        return ', '.join([
+            'db;dur=%.2f;desc="%d queries"' % (self.db_time * 1000, self.queries),
+            'view;dur=%.2f' % (self.view_time * 1000),
+            'serialize;dur=%.2f' % (self.serialize_time * 1000),
+            'total;dur=%.2f' % (self.total * 1000),
+        ])
+
+
+class TimedJSONEncoder(DjangoJSONEncoder):
+    """
+    JSON encoder adding the time spent encoding to the metrics of the
+    current request, if it is being sampled.
+    """
+
+    def encode(self, o):
+        metrics = current_request.get()
+        if metrics is None:
+            return super().encode(o)
+        started = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            metrics.serialize_time += time.perf_counter() - started
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+                break
+
+
+class MetricsRegistry:
+    """
+    Per-route histograms of request duration, database time and query count,
+    exposed in the Prometheus text format. Histograms are cumulative since
+    process start, as Prometheus expects; use ``rate()`` for rolling windows.
+    """
+
+    HISTOGRAMS = [
+        ('api_request_duration_seconds', 'Time spent serving the request.', DURATION_BUCKETS),
+        ('api_request_db_seconds', 'Time spent in database queries.', DURATION_BUCKETS),
+        ('api_request_serialize_seconds', 'Time spent encoding the JSON payload.', DURATION_BUCKETS),
+        ('api_request_queries', 'Number of database queries.', QUERY_BUCKETS),
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+
+    def observe(self, route, metrics):
+        values = [metrics.total, metrics.db_time, metrics.serialize_time, metrics.queries]
+        with self.lock:
+            histograms = self.routes.get(route)
+            if histograms is None:
+                histograms = self.routes[route] = [Histogram(buckets) for _, _, buckets in self.HISTOGRAMS]
+            for histogram, value in zip(histograms, values):
+                histogram.observe(value)
+
+    def reset(self):
+        with self.lock:
+            self.routes.clear()
+
+    def render(self):
+        lines = []
+        with self.lock:
+            routes = sorted(self.routes.items())
+            for index, (name, help_text, buckets) in enumerate(self.HISTOGRAMS):
+                lines.append('# HELP %s %s' % (name, help_text))
+                lines.append('# TYPE %s histogram' % name)
+                for route, histograms in routes:
+                    histogram = histograms[index]
+                    cumulative = 0
+                    for bound, count in zip(buckets, histogram.counts):
+                        cumulative += count
+                        lines.append('%s_bucket{route="%s",le="%s"} %d' % (name, route, bound, cumulative))
+                    lines.append('%s_bucket{route="%s",le="+Inf"} %d' % (name, route, histogram.count))
+                    lines.append('%s_sum{route="%s"} %s' % (name, route, repr(float(histogram.sum))))
+                    lines.append('%s_count{route="%s"} %d' % (name, route, histogram.count))
+
+        for name, kind in [('api_report_cache_hits_total', 'hits'), ('api_report_cache_misses_total', 'misses')]:
+            lines.append('# HELP %s Report cache %s.' % (name, kind))
+            lines.append('# TYPE %s counter' % name)
+            for view, counters in cache_stats.snapshot().items():
+                lines.append('%s{view="%s"} %d' % (name, view, counters[kind]))
+
+        counters = conversations.snapshot()
+        for name, kind, counter, help_text in [
+            ('api_conversation_cache_hits_total', 'counter', 'hits', 'Conversation states found in the cache.'),
+            ('api_conversation_cache_misses_total', 'counter', 'misses', 'Conversation states looked up in the database.'),
+            ('api_conversation_cache_evictions_total', 'counter', 'evictions', 'Conversation states evicted to make room.'),
+            ('api_conversation_cache_size', 'gauge', 'size', 'Conversation states in the cache.'),
+        ]:
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s %s' % (name, kind))
+            lines.append('%s %d' % (name, counters[counter]))
+
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
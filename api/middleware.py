@@ -0,0 +1,72 @@
+import logging
+import random
+from functools import partial
+
+from django.conf import settings
+
+from .concurrency import execute_wrappers, wrapped_queries
+from .metrics import RequestMetrics, current_request, registry
+
+logger = logging.getLogger('api.performance')
+
+
+def counted(content, metrics):
+
+    # Chunks of a streaming response are produced, and queried for, as they are sent
+    iterator = iter(content)
+    while True:
+        with execute_wrappers([metrics]):
+            chunk = next(iterator, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+class PerformanceMiddleware:
+    """
+    Record query count, database time, view time and JSON encoding time for a
+    sample of requests (``PERFORMANCE_SAMPLE_RATE``), including the queries
+    run for them on the report pool and, for streaming responses, while the
+    body is sent. The timings are sent in a ``Server-Timing`` header (except
+    for streaming responses, whose headers go first), added to the per-route
+    histograms served by ``/api/metrics`` and the slowest statements are
+    logged.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'PERFORMANCE_SAMPLE_RATE', 1.0)
+        self.slow_queries = getattr(settings, 'PERFORMANCE_SLOW_QUERIES', 3)
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        metrics = RequestMetrics(self.slow_queries)
+        token = current_request.set(metrics)
+        try:
+            with wrapped_queries(metrics):
+                response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+
+        match = getattr(request, 'resolver_match', None)
+        route = match.url_name if match and match.url_name else 'unmatched'
+
+        if response.streaming:
+            response.streaming_content = counted(response.streaming_content, metrics)
+            # Runs when the server closes the response, after the last chunk
+            response._resource_closers.append(partial(self.record, route, metrics))
+            return response
+
+        self.record(route, metrics)
+        response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def record(self, route, metrics):
+
+        metrics.finish()
+        registry.observe(route, metrics)
+        if metrics.statements and logger.isEnabledFor(logging.DEBUG):
+            for duration, sql in metrics.statements:
+                logger.debug('%s %.1fms %s', route, duration * 1000, sql)
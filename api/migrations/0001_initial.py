@@ -0,0 +1,157 @@
+# Generated by Django 5.0.3 on 2026-10-17 11:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Community',
+            fields=[
+                ('communityid', models.AutoField(db_column='communityId', primary_key=True, serialize=False)),
+                ('region', models.CharField(blank=True, max_length=100, null=True)),
+            ],
+            options={
+                'db_table': 'Community',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Country',
+            fields=[
+                ('countryid', models.AutoField(db_column='countryId', primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=512, null=True)),
+                ('code', models.CharField(blank=True, max_length=512, null=True)),
+                ('latitude', models.FloatField(blank=True, null=True)),
+                ('longitude', models.FloatField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'Country',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Option',
+            fields=[
+                ('optionid', models.AutoField(db_column='optionId', primary_key=True, serialize=False)),
+                ('optiontext', models.CharField(blank=True, db_column='optionText', max_length=255, null=True)),
+            ],
+            options={
+                'db_table': 'Option',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('personid', models.AutoField(db_column='personId', primary_key=True, serialize=False)),
+                ('name', models.CharField(blank=True, max_length=50, null=True)),
+                ('sender_number', models.CharField(blank=True, max_length=50, null=True)),
+                ('date_of_birth', models.DateField(blank=True, null=True)),
+                ('gender', models.CharField(blank=True, max_length=50, null=True)),
+            ],
+            options={
+                'db_table': 'Person',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('questionid', models.AutoField(db_column='questionId', primary_key=True, serialize=False)),
+                ('contentsid', models.CharField(blank=True, db_column='contentSid', max_length=50, null=True)),
+                ('type', models.CharField(blank=True, max_length=50, null=True)),
+                ('question', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'Question',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Questionoption',
+            fields=[
+                ('questionoptionid', models.AutoField(db_column='questionOptionId', primary_key=True, serialize=False)),
+            ],
+            options={
+                'db_table': 'QuestionOption',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Response',
+            fields=[
+                ('responseid', models.AutoField(db_column='responseId', primary_key=True, serialize=False)),
+                ('responsedata', models.CharField(blank=True, db_column='responseData', max_length=255, null=True)),
+                ('responsetimestamp', models.DateTimeField(blank=True, db_column='responseTimestamp', null=True)),
+            ],
+            options={
+                'db_table': 'Response',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Survey',
+            fields=[
+                ('surveyid', models.AutoField(db_column='surveyId', primary_key=True, serialize=False)),
+                ('title', models.CharField(blank=True, max_length=100, null=True)),
+                ('description', models.TextField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'Survey',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Surveyquestion',
+            fields=[
+                ('surveyquestionid', models.AutoField(db_column='surveyQuestionId', primary_key=True, serialize=False)),
+                ('order_number', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'SurveyQuestion',
+                'ordering': ['order_number'],
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Userstate',
+            fields=[
+                ('userid', models.AutoField(db_column='userId', primary_key=True, serialize=False)),
+                ('sender_number', models.IntegerField(blank=True, null=True)),
+                ('stage', models.CharField(max_length=100)),
+                ('temp_country', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_region', models.CharField(blank=True, max_length=100, null=True)),
+                ('temp_gender', models.CharField(blank=True, max_length=50, null=True)),
+            ],
+            options={
+                'db_table': 'UserState',
+                'managed': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='Responseoption',
+            fields=[
+                ('responseoptionid', models.AutoField(db_column='responseOptionId', primary_key=True, serialize=False)),
+                ('optionid', models.ForeignKey(db_column='optionId', on_delete=django.db.models.deletion.DO_NOTHING, to='api.option')),
+                ('personid', models.ForeignKey(blank=True, db_column='personId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.person')),
+                ('responseid', models.ForeignKey(db_column='responseId', on_delete=django.db.models.deletion.DO_NOTHING, to='api.response')),
+                ('surveyquestionid', models.ForeignKey(db_column='surveyQuestionId', on_delete=django.db.models.deletion.DO_NOTHING, to='api.surveyquestion')),
+            ],
+            options={
+                'db_table': 'ResponseOption',
+                'indexes': [models.Index(fields=['surveyquestionid', 'optionid'], name='responseoption_question_option')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='responseoption',
+            constraint=models.UniqueConstraint(fields=('responseid', 'optionid'), name='responseoption_response_option'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.0.3 on 2026-10-17 11:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Watermark',
+            fields=[
+                ('name', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('responseid', models.IntegerField(db_column='responseId')),
+            ],
+            options={
+                'db_table': 'Watermark',
+            },
+        ),
+        migrations.CreateModel(
+            name='Dailyactivity',
+            fields=[
+                ('dailyactivityid', models.AutoField(db_column='dailyActivityId', primary_key=True, serialize=False)),
+                ('day', models.DateField()),
+                ('responses', models.IntegerField()),
+                ('respondents', models.IntegerField()),
+                ('communityid', models.ForeignKey(blank=True, db_column='communityId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.community')),
+                ('surveyid', models.ForeignKey(blank=True, db_column='surveyId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.survey')),
+            ],
+            options={
+                'db_table': 'DailyActivity',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='dailyactivity',
+            constraint=models.UniqueConstraint(fields=('day', 'communityid', 'surveyid'), name='dailyactivity_day_community_survey'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.0.3 on 2026-10-17 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_activity_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Respondentsketch',
+            fields=[
+                ('respondentsketchid', models.AutoField(db_column='respondentSketchId', primary_key=True, serialize=False)),
+                ('registers', models.BinaryField()),
+                ('communityid', models.ForeignKey(blank=True, db_column='communityId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.community')),
+                ('surveyid', models.ForeignKey(blank=True, db_column='surveyId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.survey')),
+            ],
+            options={
+                'db_table': 'RespondentSketch',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='respondentsketch',
+            constraint=models.UniqueConstraint(fields=('communityid', 'surveyid'), name='respondentsketch_community_survey'),
+        ),
+    ]
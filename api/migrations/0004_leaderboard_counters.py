@@ -0,0 +1,34 @@
+# Generated by Django 5.0.3 on 2026-10-17 12:19
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_respondent_sketches'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Leaderboardcounter',
+            fields=[
+                ('leaderboardcounterid', models.AutoField(db_column='leaderboardCounterId', primary_key=True, serialize=False)),
+                ('respondents', models.IntegerField()),
+                ('responses', models.IntegerField()),
+                ('lastresponse', models.DateTimeField(blank=True, db_column='lastResponse', null=True)),
+                ('watermark', models.IntegerField()),
+                ('communityid', models.ForeignKey(db_column='communityId', on_delete=django.db.models.deletion.DO_NOTHING, to='api.community')),
+                ('surveyid', models.ForeignKey(blank=True, db_column='surveyId', null=True, on_delete=django.db.models.deletion.DO_NOTHING, to='api.survey')),
+            ],
+            options={
+                'db_table': 'LeaderboardCounter',
+                'indexes': [models.Index(fields=['watermark'], name='leaderboardcounter_watermark')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='leaderboardcounter',
+            constraint=models.UniqueConstraint(fields=('communityid', 'surveyid'), name='leaderboardcounter_community_survey'),
+        ),
+    ]
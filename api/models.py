@@ -77,6 +77,82 @@ class Response(models.Model):
         db_table = 'Response'
 
 
+class Responseoption(models.Model):
+    # Derived from Response.responsedata for 'Multiple Choice' questions: one row per selected option
+    responseoptionid = models.AutoField(db_column='responseOptionId', primary_key=True)
+    responseid = models.ForeignKey(Response, models.DO_NOTHING, db_column='responseId')
+    surveyquestionid = models.ForeignKey('Surveyquestion', models.DO_NOTHING, db_column='surveyQuestionId')
+    optionid = models.ForeignKey(Option, models.DO_NOTHING, db_column='optionId')
+    personid = models.ForeignKey(Person, models.DO_NOTHING, db_column='personId', blank=True, null=True)
+
+    class Meta:
+        db_table = 'ResponseOption'
+        constraints = [
+            models.UniqueConstraint(fields=['responseid', 'optionid'], name='responseoption_response_option'),
+        ]
+        indexes = [
+            models.Index(fields=['surveyquestionid', 'optionid'], name='responseoption_question_option'),
+        ]
+
+
+class Dailyactivity(models.Model):
+    # Rollup of Response by day, community and survey, kept current by the rollup_activity command
+    dailyactivityid = models.AutoField(db_column='dailyActivityId', primary_key=True)
+    day = models.DateField()
+    communityid = models.ForeignKey(Community, models.DO_NOTHING, db_column='communityId', blank=True, null=True)
+    surveyid = models.ForeignKey('Survey', models.DO_NOTHING, db_column='surveyId', blank=True, null=True)
+    responses = models.IntegerField()
+    respondents = models.IntegerField()
+
+    class Meta:
+        db_table = 'DailyActivity'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'communityid', 'surveyid'], name='dailyactivity_day_community_survey'),
+        ]
+
+
+class Respondentsketch(models.Model):
+    # HyperLogLog registers of the people who answered a survey in a community, kept current by update_sketches
+    respondentsketchid = models.AutoField(db_column='respondentSketchId', primary_key=True)
+    communityid = models.ForeignKey(Community, models.DO_NOTHING, db_column='communityId', blank=True, null=True)
+    surveyid = models.ForeignKey('Survey', models.DO_NOTHING, db_column='surveyId', blank=True, null=True)
+    registers = models.BinaryField()
+
+    class Meta:
+        db_table = 'RespondentSketch'
+        constraints = [
+            models.UniqueConstraint(fields=['communityid', 'surveyid'], name='respondentsketch_community_survey'),
+        ]
+
+
+class Leaderboardcounter(models.Model):
+    # Respondents, (person, survey) responses and latest response of a community, for one survey or all of them
+    # (surveyid null); kept current by update_leaderboard. watermark is the responseId of the run that last changed it.
+    leaderboardcounterid = models.AutoField(db_column='leaderboardCounterId', primary_key=True)
+    communityid = models.ForeignKey(Community, models.DO_NOTHING, db_column='communityId')
+    surveyid = models.ForeignKey('Survey', models.DO_NOTHING, db_column='surveyId', blank=True, null=True)
+    respondents = models.IntegerField()
+    responses = models.IntegerField()
+    lastresponse = models.DateTimeField(db_column='lastResponse', blank=True, null=True)
+    watermark = models.IntegerField()
+
+    class Meta:
+        db_table = 'LeaderboardCounter'
+        constraints = [
+            models.UniqueConstraint(fields=['communityid', 'surveyid'], name='leaderboardcounter_community_survey'),
+        ]
+        indexes = [models.Index(fields=['watermark'], name='leaderboardcounter_watermark')]
+
+
+class Watermark(models.Model):
+    # Highest responseId a derived table (e.g. DailyActivity) has processed
+    name = models.CharField(max_length=100, primary_key=True)
+    responseid = models.IntegerField(db_column='responseId')
+
+    class Meta:
+        db_table = 'Watermark'
+
+
 class Survey(models.Model):
     surveyid = models.AutoField(db_column='surveyId', primary_key=True)
     title = models.CharField(max_length=100, blank=True, null=True)
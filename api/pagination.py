@@ -0,0 +1,66 @@
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+
+class PaginationError(ValueError):
+    pass
+
+
+def page_size(request, default, maximum=None, name='limit'):
+    """
+    Page size requested with ``?limit=`` (or ``name``), defaulting to
+    ``default`` and capped at ``maximum`` (``REPORT_MAX_PAGE_SIZE`` by default).
+    """
+
+    maximum = maximum or getattr(settings, 'REPORT_MAX_PAGE_SIZE', 1000)
+    value = request.GET.get(name)
+    if value is None:
+        return default
+    try:
+        limit = int(value)
+    except ValueError:
+        raise PaginationError("'%s' must be an integer" % name)
+    if limit < 1:
+        raise PaginationError("'%s' must be positive" % name)
+    return min(limit, maximum)
+
+
+def cursor(request, name='after'):
+
+    value = request.GET.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise PaginationError("'%s' must be an integer" % name)
+
+
+def keyset_page(queryset, key, after, limit):
+    """
+    Rows of ``queryset`` ordered by the integer column ``key`` that come
+    after the cursor ``after``, at most ``limit`` of them. Returns the rows
+    and the cursor of the next page, or None on the last page.
+    """
+
+    if after is not None:
+        queryset = queryset.filter(**{'%s__gt' % key: after})
+    rows = list(queryset.order_by(key)[:limit + 1])
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, last[key] if isinstance(last, dict) else getattr(last, key)
+
+
+def page_url(path, after, **params):
+
+    params = {name: value for name, value in params.items() if value is not None}
+    params['after'] = after
+    return '%s?%s' % (path, urlencode(params))
+
+
+def flag(request, name):
+
+    return request.GET.get(name, '').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,548 @@
+from collections import defaultdict
+from functools import partial
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Min, Window
+from django.db.models.functions import RowNumber, Upper
+from django.urls import reverse
+
+from .demographics import age_distribution, calculate_demographics, empty_demographics
+from .catalog import get_catalog
+from .fields import Fields
+from .models import *
+from .pagination import keyset_page, page_url
+from .sketches import approximation, community_respondent_counts, current_sketches, survey_respondent_counts
+from .snapshot import Snapshot, survey_respondents
+
+
+def run_sections(sections):
+
+    return [section() for section in sections]
+
+
+def run_selected(run, sections):
+    """
+    Hand the sections of ``(wanted, section, default)`` that are wanted to
+    ``run``; the others are not computed and come back as their default.
+    """
+
+    results = iter(run([section for wanted, section, _ in sections if wanted]))
+    return [next(results) if wanted else default for wanted, _, default in sections]
+
+
+def text_answer_limit():
+
+    return getattr(settings, 'TEXT_ANSWER_PAGE_SIZE', 20)
+
+
+def first_text_answers(communityids, surveyquestion_ids, limit, group_text=False):
+    """
+    The first ``limit`` text answers of each survey question in each of
+    ``communityids`` in one query, numbering the answers per community and
+    question with a window function. Returns the answers and, for questions
+    with more, the URL of their next page, keyed by (community id, survey
+    question id).
+
+    With ``group_text`` identical answers are counted together and the
+    ``limit`` most frequent ones are returned instead; there is no next page.
+    """
+
+    responses = Response.objects.filter(personid__communityid__in=communityids, surveyquestionid__in=surveyquestion_ids)
+    partition = [F('personid__communityid'), F('surveyquestionid')]
+    answers = defaultdict(list)
+    next_answers = {}
+
+    if group_text:
+        rows = (
+            responses.values('personid__communityid', 'surveyquestionid', 'responsedata')
+            .annotate(total=Count('responseid'))
+            .annotate(row=Window(
+                RowNumber(),
+                partition_by=partition,
+                order_by=[F('total').desc(), F('responsedata').asc()],
+            ))
+            .filter(row__lte=limit)
+            .order_by('personid__communityid', 'surveyquestionid', 'row')
+            .values_list('personid__communityid', 'surveyquestionid', 'responsedata', 'total')
+        )
+        for communityid, surveyquestionid, responsedata, total in rows:
+            answers[communityid, surveyquestionid].append({'answer': responsedata, 'total': total})
+        return answers, next_answers
+
+    # One row more than the page size tells whether there is a next page
+    rows = (
+        responses.annotate(row=Window(RowNumber(), partition_by=partition, order_by=F('responseid').asc()))
+        .filter(row__lte=limit + 1)
+        .order_by('personid__communityid', 'surveyquestionid', 'responseid')
+        .values_list('personid__communityid', 'surveyquestionid', 'responseid', 'responsedata')
+    )
+    last_responseid = {}
+    for communityid, surveyquestionid, responseid, responsedata in rows:
+        key = communityid, surveyquestionid
+        if len(answers[key]) == limit:
+            next_answers[key] = page_url(
+                reverse('get_text_answers', args=[communityid, surveyquestionid]),
+                last_responseid[key],
+                limit=limit,
+            )
+            continue
+        answers[key].append({'answer': responsedata, 'total': 1})
+        last_responseid[key] = responseid
+    return answers, next_answers
+
+
+def text_answers_page(communityid, surveyquestionid, after=None, limit=None):
+    """
+    A page of the text answers to one survey question, following
+    ``nextAnswers`` from the community report.
+    """
+
+    limit = limit or text_answer_limit()
+    responses = Response.objects.filter(
+        personid__communityid=communityid, surveyquestionid=surveyquestionid,
+    ).values('responseid', 'responsedata')
+    rows, next_cursor = keyset_page(responses, 'responseid', after, limit)
+    return {
+        'answers': [{'answer': row['responsedata'], 'total': 1} for row in rows],
+        'nextAnswers': page_url(
+            reverse('get_text_answers', args=[communityid, surveyquestionid]), next_cursor, limit=limit,
+        ) if next_cursor is not None else None,
+    }
+
+
+def build_survey_info(respondents, text_limit=None, group_text=False, approximate=False, fields=None):
+    """
+    Build the ``surveyInfo`` section of the community report of every
+    community in ``respondents``, a dict of community id to number of
+    respondents. Returns the sections by community id.
+
+    Everything is loaded in a fixed number of grouped queries and assembled in
+    memory, so the query count does not depend on how many communities,
+    surveys, questions or responses there are. Text questions carry at most
+    ``text_limit`` answers. With ``approximate`` the responses to each survey
+    are estimated from the respondent sketches. Response rates and answers
+    not wanted by ``fields`` are left out of the queries.
+    """
+
+    text_limit = text_limit or text_answer_limit()
+    fields = fields or Fields()
+
+    catalog = get_catalog()
+    communityids = list(respondents)
+
+    # A person answering any question of a survey counts as one response to that survey
+    if not fields.wants('surveyInfo.responseRate'):
+        survey_responses = {}
+    elif approximate:
+        survey_responses = {key: sketch.count() for key, sketch in current_sketches(communityids=communityids).items()}
+    else:
+        survey_responses = {
+            (communityid, surveyid): total
+            for communityid, surveyid, total in (
+                Response.objects.filter(personid__communityid__in=communityids)
+                .values('personid__communityid', 'surveyquestionid__surveyid')
+                .annotate(total=Count('personid', distinct=True))
+                .values_list('personid__communityid', 'surveyquestionid__surveyid', 'total')
+            )
+        }
+
+    # Option frequencies for every multiple choice question, in order of first selection
+    choice_answers = defaultdict(list)
+    selections = [] if not fields.wants('surveyInfo.responses.answers') else (
+        Responseoption.objects.filter(
+            personid__communityid__in=communityids, surveyquestionid__in=catalog.questions.keys(),
+        )
+        .values('personid__communityid', 'surveyquestionid', 'optionid')
+        .annotate(total=Count('responseoptionid'), first=Min('responseoptionid'))
+        .order_by('first')
+        .values_list('personid__communityid', 'surveyquestionid', 'optionid', 'total')
+    )
+    for communityid, surveyquestionid, optionid, total in selections:
+        if optionid in catalog.option_text:
+            choice_answers[communityid, surveyquestionid].append({'answer': catalog.option_text[optionid], 'total': total})
+
+    text_questions = [
+        surveyquestionid for surveyquestionid, question in catalog.questions.items()
+        if not question.is_multiple_choice
+    ]
+    if fields.wants('surveyInfo.responses.answers') or fields.wants('surveyInfo.responses.nextAnswers'):
+        text_answers, next_answers = first_text_answers(communityids, text_questions, text_limit, group_text)
+    else:
+        text_answers, next_answers = defaultdict(list), {}
+
+    survey_info = {}
+    for communityid in communityids:
+        survey_data = []
+        for survey in catalog.surveys:
+            questiondict = []
+            for question in survey.questions:
+                key = communityid, question.surveyquestionid
+                question_dict = {
+                    'questionid': question.questionid,
+                    'question': question.question,
+                    'chartType': question.chart_type,
+                }
+                if question.is_multiple_choice:
+                    question_dict['answers'] = choice_answers[key]
+                else:
+                    question_dict['answers'] = text_answers[key]
+                    question_dict['nextAnswers'] = next_answers.get(key)
+                questiondict.append(question_dict)
+
+            number_of_responses = survey_responses.get((communityid, survey.surveyid), 0)
+            community_respondents = respondents[communityid]
+            survey_data.append({
+                'surveyid': survey.surveyid,
+                'title': survey.title,
+                'description': survey.description,
+                'responseRate': (
+                    round((number_of_responses/community_respondents)*100, 1) if community_respondents else 0
+                ),
+                'responses': questiondict,
+            })
+        survey_info[communityid] = survey_data
+
+    return survey_info
+
+
+def latest_response_timestamps(field, **filters):
+
+    # Latest response timestamp per value of ``field``, in one grouped query
+    return dict(
+        Response.objects.filter(**filters)
+        .values(field)
+        .annotate(response_timestamp=Max('responsetimestamp'))
+        .order_by()
+        .values_list(field, 'response_timestamp')
+    )
+
+
+def count_survey_responses(**filters):
+
+    # A person answering any question of a survey counts as one response to that survey
+    return Response.objects.filter(personid__isnull=False, **filters).values(
+        'personid', 'surveyquestionid__surveyid'
+    ).distinct().count()
+
+
+def snapshot_survey_responses(snapshot, survey_ids):
+
+    try:
+        return survey_respondents(snapshot)
+    except (OSError, ValueError):
+        # Rebuilt since it was opened: its files no longer match its meta
+        return {surveyid: count_survey_responses(surveyquestionid__surveyid=surveyid) for surveyid in survey_ids}
+
+
+def survey_responses_by_community(**filters):
+    """
+    Number of distinct (person, survey) response pairs per community, as a
+    dict keyed by community id, in one grouped query.
+    """
+
+    # Distinct people per (community, survey), summed over surveys
+    rows = (
+        Response.objects.filter(personid__isnull=False, **filters)
+        .values('personid__communityid', 'surveyquestionid__surveyid')
+        .annotate(total=Count('personid', distinct=True))
+        .values_list('personid__communityid', 'total')
+    )
+    responses = defaultdict(int)
+    for communityid, total in rows:
+        responses[communityid] += total
+    return responses
+
+
+class BatchError(ValueError):
+    pass
+
+
+def batch_values(values):
+
+    # Repeated parameters and comma separated lists, in order, without duplicates
+    return list(dict.fromkeys(value for item in values for value in item.split(',') if value))
+
+
+def batch_filters(communities=(), countries=()):
+    """
+    Translate the ``community`` or ``country`` parameters of a batch report
+    request (lists of strings, e.g. from ``request.GET.getlist``) into the
+    scope and the community ids or country codes to report on. Raises
+    ``BatchError`` for malformed values.
+    """
+
+    communities, countries = batch_values(communities), batch_values(countries)
+    if bool(communities) == bool(countries):
+        raise BatchError("Give either 'community' or 'country'")
+    values = communities or countries
+    maximum = getattr(settings, 'REPORT_BATCH_SIZE', 50)
+    if len(values) > maximum:
+        raise BatchError("At most %d reports can be requested at once" % maximum)
+    if communities:
+        if not all(value.isdecimal() for value in communities):
+            raise BatchError("'community' must be a list of integers")
+        return 'community', [int(value) for value in communities]
+    return 'country', countries
+
+
+def community_reports(communityids, run=run_sections, text_limit=None, group_text=False, approximate=False,
+                      fields=None):
+    """
+    Payloads of ``/api/community/<id>/`` for each of ``communityids``, by
+    community id, computed together: the catalog is read once and every
+    section is one grouped query over all the communities. Communities that
+    do not exist are left out. Independent sections are handed to ``run``
+    together so they can be computed concurrently; sections not wanted by
+    ``fields`` are not computed at all.
+    """
+
+    fields = fields or Fields()
+
+    communities = {
+        community.communityid: community
+        for community in Community.objects.select_related('countryid').filter(communityid__in=communityids)
+    }
+    if not communities:
+        return {}
+    demographics = {}
+    if any(fields.wants(path) for path in (
+        'communityInfo.responders', 'communityInfo.genderRatio', 'communityInfo.ageDistribution',
+        'surveyInfo.responseRate',
+    )):
+        demographics = calculate_demographics(Person.objects.filter(communityid__in=list(communities)), by='communityid')
+    demographics = {communityid: demographics.get(communityid) or empty_demographics() for communityid in communities}
+    respondents = {communityid: demographics[communityid]['respondents'] for communityid in communities}
+
+    most_recent_responses, survey_info = run_selected(run, [
+        (
+            fields.wants('communityInfo.lastResponseDate'),
+            partial(latest_response_timestamps, 'personid__communityid', personid__communityid__in=list(communities)),
+            {},
+        ),
+        (
+            fields.wants('surveyInfo'),
+            partial(build_survey_info, respondents, text_limit, group_text, approximate, fields),
+            defaultdict(list),
+        ),
+    ])
+
+    reports = {}
+    for communityid, community in communities.items():
+        gender_composition = demographics[communityid]['gender']
+        reports[communityid] = fields.apply({
+            'communityInfo': {
+                'id': communityid,
+                'region': community.region,
+                'country': community.countryid.name,
+                'responders': respondents[communityid],
+                'lastResponseDate': most_recent_responses.get(communityid),
+                'genderRatio': {
+                    'male': gender_composition['Male'],
+                    'female': gender_composition['Female'],
+                },
+                'ageDistribution': age_distribution(demographics[communityid]['age']),
+            },
+            'surveyInfo': survey_info[communityid],
+        })
+        if approximate:
+            reports[communityid]['approximation'] = approximation()
+    return reports
+
+
+def community_report(communityid, run=run_sections, text_limit=None, group_text=False, approximate=False,
+                     fields=None):
+    """
+    Payload of ``/api/community/<id>/``. Raises ``Community.DoesNotExist``
+    for an unknown community.
+    """
+
+    reports = community_reports([communityid], run, text_limit, group_text, approximate, fields)
+    if communityid not in reports:
+        raise Community.DoesNotExist('Community %s does not exist' % communityid)
+    return reports[communityid]
+
+
+def statistics_report(run=run_sections, approximate=False, fields=None):
+    """
+    Payload of ``/api/surveys``; each survey's responses are counted as a
+    separate section, or all at once from the response snapshot when
+    ``REPORT_SNAPSHOT_DIR`` holds one. With ``approximate`` they are
+    estimated from the respondent sketches instead. Sections not wanted by
+    ``fields`` are not computed.
+    """
+
+    fields = fields or Fields()
+    count_responses = fields.wants('totalResponses')
+    survey_ids = get_catalog().survey_ids() if count_responses else []
+    snapshot = None if approximate else Snapshot.open()
+    if not count_responses:
+        survey_sections = []
+    elif approximate:
+        survey_sections = [survey_respondent_counts]
+    elif snapshot is not None:
+        # From the local snapshot plus the responses added since it was taken
+        survey_sections = [partial(snapshot_survey_responses, snapshot, survey_ids)]
+    else:
+        survey_sections = [partial(count_survey_responses, surveyquestionid__surveyid=surveyid) for surveyid in survey_ids]
+
+    demographics, number_of_countries, *survey_responses = run_selected(run, [
+        (
+            fields.wants('totalRespondants') or fields.wants('ageDistribution'),
+            partial(calculate_demographics, Person.objects.all()),
+            empty_demographics(),
+        ),
+        (
+            fields.wants('numberofCountries'),
+            lambda: Person.objects.values_list('communityid__countryid', flat=True).distinct().count(),
+            0,
+        ),
+        *[(True, section, None) for section in survey_sections],
+    ])
+    if count_responses and (approximate or snapshot is not None):
+        survey_responses = [survey_responses[0].get(surveyid, 0) for surveyid in survey_ids]
+
+    report = fields.apply({
+        'totalResponses': sum(survey_responses),
+        'totalRespondants': demographics['respondents'],
+        'numberofCountries': number_of_countries,
+        'ageDistribution': age_distribution(demographics['age']),
+    })
+    if approximate:
+        report['approximation'] = approximation()
+    return report
+
+
+def country_reports(countrycodes, run=run_sections, approximate=False, fields=None):
+    """
+    Payloads of ``/api/country/<code>/`` for each of ``countrycodes``, by
+    code, computed together in one grouped query per section. Countries that
+    do not exist are left out. The query count does not depend on the number
+    of countries, regions or surveys. With ``approximate`` the responses of
+    each region are estimated from the respondent sketches. Sections not
+    wanted by ``fields`` are not computed.
+    """
+
+    fields = fields or Fields()
+
+    # Codes match whatever their case, in the database and in the URL alike
+    countries = Country.objects.annotate(upper_code=Upper('code')).filter(
+        upper_code__in=[countrycode.upper() for countrycode in countrycodes],
+    )
+    countries = {country.upper_code: country for country in countries}
+    countries = {
+        countrycode: countries[countrycode.upper()] for countrycode in countrycodes if countrycode.upper() in countries
+    }
+    if not countries:
+        return {}
+    country_ids = [country.countryid for country in countries.values()]
+    communities = defaultdict(list)
+    if fields.wants('countryInfo.regions') or fields.wants('countryRegions'):
+        for community in Community.objects.filter(countryid__in=country_ids):
+            communities[community.countryid_id].append(community)
+
+    demographics, most_recent_responses, region_responses = run_selected(run, [
+        (
+            any(fields.wants(path) for path in (
+                'countryInfo.respondents', 'countryInfo.genderRatio', 'countryInfo.ageDistribution',
+            )),
+            partial(calculate_demographics, Person.objects.filter(communityid__countryid__in=country_ids), by='communityid__countryid'),
+            {},
+        ),
+        (
+            fields.wants('countryInfo.lastResponseDate'),
+            partial(latest_response_timestamps, 'personid__communityid__countryid', personid__communityid__countryid__in=country_ids),
+            {},
+        ),
+        (
+            fields.wants('countryRegions.responses'),
+            (lambda: community_respondent_counts(current_sketches(countryids=country_ids))) if approximate
+            else partial(survey_responses_by_community, personid__communityid__countryid__in=country_ids),
+            {},
+        ),
+    ])
+
+    reports = {}
+    for countrycode, country in countries.items():
+        country_demographics = demographics.get(country.countryid) or empty_demographics()
+        most_recent_response = most_recent_responses.get(country.countryid)
+        countryRegions = [
+            {
+                'id': community.communityid,
+                'region': community.region,
+                'responses': region_responses.get(community.communityid, 0),
+            }
+            for community in communities[country.countryid]
+        ]
+
+        gender_composition = country_demographics['gender']
+        reports[countrycode] = fields.apply({
+            'countryInfo': {
+                'code': countrycode,
+                'countryName': country.name,
+                'respondents': country_demographics['respondents'],
+                'regions': len(countryRegions),
+                'lastResponseDate': most_recent_response.strftime("%B %d, %Y") if most_recent_response else 'No responses',
+                'genderRatio': {
+                    'male': gender_composition['Male'],
+                    'female': gender_composition['Female'],
+                },
+                'ageDistribution': age_distribution(country_demographics['age']),
+            },
+            'countryRegions': countryRegions,
+        })
+        if approximate:
+            reports[countrycode]['approximation'] = approximation()
+    return reports
+
+
+def country_report(countrycode, run=run_sections, approximate=False, fields=None):
+    """
+    Payload of ``/api/country/<code>/``. Raises ``Country.DoesNotExist`` for
+    an unknown country code.
+    """
+
+    reports = country_reports([countrycode], run, approximate, fields)
+    if countrycode not in reports:
+        raise Country.DoesNotExist('Country %s does not exist' % countrycode)
+    return reports[countrycode]
+
+
+def countries_report(fields=None):
+    """
+    Payload of ``/api/countries``: every country with at least one region,
+    with its respondents counted in a single annotated query unless
+    ``fields`` leaves them out.
+    """
+
+    fields = fields or Fields()
+    countries = Country.objects.filter(community__isnull=False)
+    if fields.wants('respondants'):
+        countries = countries.annotate(respondents=Count('community__person'))
+    else:
+        countries = countries.distinct()
+    return fields.apply([
+        {
+            'code': country.code,
+            'country': country.name,
+            'latitude': country.latitude,
+            'longitude': country.longitude,
+            'regionNumber': country.countryid,
+            'respondants': getattr(country, 'respondents', None),
+        }
+        for country in countries.order_by('countryid')
+    ])
+
+
+def communities_page(after=None, limit=None):
+    """
+    A page of ``/api/communities`` in ``communityid`` order, and the cursor
+    of the next page.
+    """
+
+    communities = Community.objects.select_related('countryid')
+    rows, next_cursor = keyset_page(communities, 'communityid', after, limit)
+    data = [
+        {"id": community.communityid, "region": community.region, "country": community.countryid.name}
+        for community in rows
+    ]
+    return data, next_cursor
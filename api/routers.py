@@ -0,0 +1,164 @@
+"""
+Database router sending the read-only report views to replicas.
+
+Views decorated with ``replica_reads`` read from one of the aliases in
+``REPORT_REPLICAS``, picked round-robin or by lowest health-check latency
+(``REPORT_REPLICA_STRATEGY``). A replica whose health check fails or whose
+replication lag exceeds ``REPORT_REPLICA_MAX_LAG`` seconds is skipped until
+its next check; when none is usable, reads go to the primary. Everything
+else, and every write, uses ``default``.
+"""
+
+import threading
+import time
+from asyncio import iscoroutinefunction
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from django.db.models import Max
+
+from .models import Response
+
+# Replica alias the current report reads from, None for the primary
+report_replica = ContextVar('report_replica', default=None)
+
+
+def replica_reads(view):
+    """
+    Route the reads made while serving ``view`` (sync or async) to a replica.
+    The replica is picked once per request so the whole report, cache
+    version included, comes from one consistent copy of the data.
+    """
+
+    if iscoroutinefunction(view):
+
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            token = report_replica.set(await sync_to_async(replicas.choose, thread_sensitive=False)())
+            try:
+                return await view(request, *args, **kwargs)
+            finally:
+                report_replica.reset(token)
+
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        token = report_replica.set(replicas.choose())
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            report_replica.reset(token)
+
+    return wrapper
+
+
+def replication_lag(alias):
+    """
+    Seconds the replica ``alias`` is behind the primary, judged by the latest
+    response each has. ``REPORT_REPLICA_LAG_SQL`` can instead name a query
+    run on the replica returning its lag in seconds (e.g. from
+    ``sys.dm_database_replica_states`` on SQL Server).
+    """
+
+    lag_sql = getattr(settings, 'REPORT_REPLICA_LAG_SQL', None)
+    if lag_sql:
+        with connections[alias].cursor() as cursor:
+            cursor.execute(lag_sql)
+            row = cursor.fetchone()
+        return float(row[0] or 0) if row else 0.0
+
+    latest = {'responseid': Max('responseid'), 'timestamp': Max('responsetimestamp')}
+    primary = Response.objects.using(DEFAULT_DB_ALIAS).aggregate(**latest)
+    replica = Response.objects.using(alias).aggregate(**latest)
+    if (replica['responseid'] or 0) >= (primary['responseid'] or 0):
+        return 0.0
+    if replica['timestamp'] is None or primary['timestamp'] is None:
+        return float('inf')
+    return max((primary['timestamp'] - replica['timestamp']).total_seconds(), 0.0)
+
+
+class ReplicaState:
+
+    __slots__ = ('healthy', 'lag', 'latency', 'checked')
+
+    def __init__(self):
+        self.healthy = False
+        self.lag = None
+        self.latency = None
+        self.checked = None
+
+
+class ReplicaPool:
+    """
+    Health and latency of the report replicas, checked at most every
+    ``REPORT_REPLICA_CHECK_INTERVAL`` seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.states = {}
+        self.turn = 0
+
+    def reset(self):
+        with self.lock:
+            self.states.clear()
+            self.turn = 0
+
+    def check(self, alias, state):
+        started = time.perf_counter()
+        try:
+            with connections[alias].cursor() as cursor:
+                cursor.execute('SELECT 1')
+                cursor.fetchone()
+            latency = time.perf_counter() - started
+            state.lag = replication_lag(alias)
+        except DatabaseError:
+            state.healthy = False
+        else:
+            # Smooth the latency so one slow check does not flip the choice
+            state.latency = latency if state.latency is None else 0.7 * state.latency + 0.3 * latency
+            state.healthy = state.lag <= getattr(settings, 'REPORT_REPLICA_MAX_LAG', 30)
+        state.checked = time.monotonic()
+
+    def healthy_replicas(self):
+        interval = getattr(settings, 'REPORT_REPLICA_CHECK_INTERVAL', 10)
+        healthy = []
+        with self.lock:
+            for alias in getattr(settings, 'REPORT_REPLICAS', []):
+                state = self.states.setdefault(alias, ReplicaState())
+                if state.checked is None or time.monotonic() - state.checked >= interval:
+                    self.check(alias, state)
+                if state.healthy:
+                    healthy.append((alias, state))
+        return healthy
+
+    def choose(self):
+        healthy = self.healthy_replicas()
+        if not healthy:
+            return None
+        if getattr(settings, 'REPORT_REPLICA_STRATEGY', 'round_robin') == 'least_latency':
+            return min(healthy, key=lambda replica: replica[1].latency)[0]
+        with self.lock:
+            self.turn += 1
+            return healthy[self.turn % len(healthy)][0]
+
+
+replicas = ReplicaPool()
+
+
+class ReportReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == 'api':
+            return report_replica.get()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
@@ -0,0 +1,12 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from .models import Response
+from .tally import index_responses
+
+
+@receiver(post_save, sender=Response)
+def index_response_options(sender, instance, created, raw=False, **kwargs):
+
+    if created and not raw:
+        index_responses([instance])
@@ -0,0 +1,280 @@
+"""
+Approximate distinct respondent counts from HyperLogLog sketches.
+
+``Respondentsketch`` holds one sketch of the people who answered each survey
+in each community. ``update_sketches`` adds the people of the responses after
+its ``Watermark``; adding a person twice changes nothing, so runs only ever
+read new responses. Sketches of several communities merge into the sketch of
+their union, which is how country and global counts are answered without a
+distinct scan. Reports read the sketches plus the responses after the
+watermark, so approximate counts are as current as exact ones. The global
+sketch of each survey is merged once per watermark and kept in the process.
+
+With ``RESPONDENT_SKETCH_PRECISION`` p, a sketch is 2**p bytes and its
+relative standard error 1.04 / sqrt(2**p); changing p needs a rebuild.
+"""
+
+import threading
+from collections import defaultdict
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+
+from .models import *
+
+WATERMARK = 'respondent_sketches'
+
+
+def sketch_precision():
+
+    return getattr(settings, 'RESPONDENT_SKETCH_PRECISION', 12)
+
+
+def standard_error(precision=None):
+
+    return 1.04 / np.sqrt(2 ** (precision or sketch_precision()))
+
+
+def hash_ids(ids):
+
+    # splitmix64 finalizer; multiplications wrap around modulo 2**64
+    values = np.asarray(ids, dtype=np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+    values = (values ^ (values >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    values = (values ^ (values >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return values ^ (values >> np.uint64(31))
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch of a set of ids with 2**``precision`` registers.
+    """
+
+    def __init__(self, precision=None, registers=None):
+        if registers is not None:
+            precision = int(np.log2(len(registers)))
+        self.precision = precision or sketch_precision()
+        if registers is None:
+            registers = np.zeros(2 ** self.precision, dtype=np.uint8)
+        self.registers = registers
+
+    @classmethod
+    def from_bytes(cls, data):
+
+        return cls(registers=np.frombuffer(bytes(data), dtype=np.uint8).copy())
+
+    def to_bytes(self):
+
+        return self.registers.tobytes()
+
+    def add_many(self, ids):
+
+        hashes = hash_ids(ids)
+        width = 64 - self.precision
+        buckets = (hashes >> np.uint64(width)).astype(np.int64)
+        rest = hashes & np.uint64((1 << width) - 1)
+        # Position of the first 1 bit of the rest, counting from its top; width + 1 when it is all zeros.
+        # Rounding to float can only overstate the bit length by one, at 2**width.
+        _, bit_length = np.frexp(rest.astype(np.float64))
+        ranks = np.maximum(width - bit_length + 1, 1).astype(np.uint8)
+        np.maximum.at(self.registers, buckets, ranks)
+        return self
+
+    def merge(self, other):
+
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of precision %d and %d" % (self.precision, other.precision))
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def copy(self):
+
+        return HyperLogLog(registers=self.registers.copy())
+
+    def count(self):
+
+        size = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / size)
+        estimate = alpha * size * size / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * size and zeros:
+            # Linear counting is more accurate for small sets
+            estimate = size * np.log(size / zeros)
+        return int(round(estimate))
+
+
+def sketch_watermark():
+
+    watermark = Watermark.objects.filter(name=WATERMARK).values_list('responseid', flat=True).first()
+    return watermark or 0
+
+
+def respondents(responses):
+
+    # (community, survey) -> ids of the people who answered
+    people = defaultdict(list)
+    rows = (
+        responses.filter(personid__isnull=False)
+        .values_list('personid__communityid', 'surveyquestionid__surveyid', 'personid')
+        .distinct()
+    )
+    for communityid, surveyid, personid in rows:
+        people[communityid, surveyid].append(personid)
+    return people
+
+
+def update_sketches(batch_size=50000):
+    """
+    Add the responses after the watermark to the sketches, ``batch_size``
+    response ids at a time, each batch in its own transaction. Returns the
+    number of responses processed.
+    """
+
+    latest = Response.objects.aggregate(responseid=Max('responseid'))['responseid'] or 0
+    watermark = sketch_watermark()
+    processed = 0
+    while watermark < latest:
+        upto = min(watermark + batch_size, latest)
+        new_responses = Response.objects.filter(responseid__gt=watermark, responseid__lte=upto)
+        people = respondents(new_responses)
+        with transaction.atomic():
+            existing = {
+                (sketch.communityid_id, sketch.surveyid_id): sketch
+                for sketch in Respondentsketch.objects.select_for_update().filter(
+                    communityid__in={communityid for communityid, _ in people if communityid is not None},
+                )
+            }
+            if any(communityid is None for communityid, _ in people):
+                for sketch in Respondentsketch.objects.select_for_update().filter(communityid__isnull=True):
+                    existing[None, sketch.surveyid_id] = sketch
+
+            created, updated = [], []
+            for (communityid, surveyid), ids in people.items():
+                sketch = existing.get((communityid, surveyid))
+                if sketch is None:
+                    created.append(Respondentsketch(
+                        communityid_id=communityid, surveyid_id=surveyid,
+                        registers=HyperLogLog().add_many(ids).to_bytes(),
+                    ))
+                else:
+                    sketch.registers = HyperLogLog.from_bytes(sketch.registers).add_many(ids).to_bytes()
+                    updated.append(sketch)
+            Respondentsketch.objects.bulk_create(created)
+            Respondentsketch.objects.bulk_update(updated, ['registers'])
+            Watermark.objects.update_or_create(name=WATERMARK, defaults={'responseid': upto})
+        processed += new_responses.count()
+        watermark = upto
+    return processed
+
+
+def rebuild_sketches(batch_size=50000):
+
+    with transaction.atomic():
+        Respondentsketch.objects.all().delete()
+        Watermark.objects.filter(name=WATERMARK).delete()
+    return update_sketches(batch_size)
+
+
+def current_sketches(communityids=None, countryids=None):
+    """
+    Sketches by (community id, survey id), of the given communities or
+    countries or of everyone, including the responses after the watermark.
+    """
+
+    sketch_filters, response_filters = {}, {}
+    if communityids is not None:
+        sketch_filters['communityid__in'] = response_filters['personid__communityid__in'] = list(communityids)
+    if countryids is not None:
+        sketch_filters['communityid__countryid__in'] = list(countryids)
+        response_filters['personid__communityid__countryid__in'] = list(countryids)
+
+    # Read the watermark first: responses it has not reached yet are added from the table
+    watermark = sketch_watermark()
+    sketches = {
+        (communityid, surveyid): HyperLogLog.from_bytes(registers)
+        for communityid, surveyid, registers in Respondentsketch.objects.filter(**sketch_filters).values_list(
+            'communityid', 'surveyid', 'registers',
+        )
+    }
+    new_people = respondents(Response.objects.filter(responseid__gt=watermark, **response_filters))
+    for key, ids in new_people.items():
+        if key not in sketches:
+            sketches[key] = HyperLogLog()
+        sketches[key].add_many(ids)
+    return sketches
+
+
+class MergedSketches:
+    """
+    Sketch of everyone who answered each survey, merged from the sketches of
+    all communities. Merging reads every sketch, so it is done once per
+    watermark and the result shared by every request in the process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (watermark, precision, sketches by survey id), replaced as a whole
+        self.state = None
+
+    def get(self, watermark):
+        """
+        Copies of the merged sketches, by survey id, as of ``watermark``.
+        """
+
+        key = (watermark, sketch_precision())
+        state = self.state
+        if state is None or state[:2] != key:
+            with self.lock:
+                state = self.state
+                if state is None or state[:2] != key:
+                    merged = {}
+                    for surveyid, registers in Respondentsketch.objects.values_list('surveyid', 'registers'):
+                        sketch = HyperLogLog.from_bytes(registers)
+                        if surveyid in merged:
+                            merged[surveyid].merge(sketch)
+                        else:
+                            merged[surveyid] = sketch
+                    state = self.state = (*key, merged)
+        return {surveyid: sketch.copy() for surveyid, sketch in state[2].items()}
+
+    def reset(self):
+        with self.lock:
+            self.state = None
+
+
+merged_sketches = MergedSketches()
+
+
+def survey_respondent_counts():
+    """
+    Estimated number of distinct people per survey, from the merged sketches
+    plus the responses after the watermark.
+    """
+
+    # Sketches committed after the watermark was read only add people counted below anyway
+    watermark = sketch_watermark()
+    sketches = merged_sketches.get(watermark)
+    for (_, surveyid), ids in respondents(Response.objects.filter(responseid__gt=watermark)).items():
+        if surveyid not in sketches:
+            sketches[surveyid] = HyperLogLog()
+        sketches[surveyid].add_many(ids)
+    return {surveyid: sketch.count() for surveyid, sketch in sketches.items()}
+
+
+def community_respondent_counts(sketches):
+    """
+    Estimated (person, survey) pairs per community: its sketches' counts
+    added up over surveys.
+    """
+
+    counts = defaultdict(int)
+    for (communityid, _), sketch in sketches.items():
+        counts[communityid] += sketch.count()
+    return counts
+
+
+def approximation():
+
+    # Part of the payloads of approximate reports
+    return {'approximate': True, 'standardError': round(float(standard_error()), 4)}
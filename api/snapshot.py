@@ -0,0 +1,327 @@
+"""
+Local columnar snapshot of ``Response``, joined with the person, community,
+country, survey and question it belongs to.
+
+Every column is a flat file of fixed-width values that is opened with
+``np.memmap``, so reading a column maps the file instead of copying it.
+Strings with few distinct values (gender, country code, region) are
+dictionary encoded: the column holds int32 codes into a list of distinct
+values, -1 for null. Free text (response data) is appended as UTF-8 to a text
+file, the column holding the int64 offset where each value ends, -1 - that
+offset for null. Null ids are stored as 0 and null dates as NaT.
+
+``update_snapshot`` appends the responses after the snapshot's ``responseid``
+watermark, so its cost grows with new responses only. ``meta.json`` is
+rewritten last and is what readers trust: data appended by an interrupted
+update beyond its row count, or its text files' sizes, is ignored and
+overwritten by the next one. A rebuild is written to a sibling directory and
+swapped in whole, so it never truncates files readers have open.
+Changes to rows already in the snapshot (e.g. a person's gender) are only
+picked up by a rebuild.
+"""
+
+import json
+import os
+import shutil
+from datetime import timezone
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Max
+
+from .models import *
+
+# (column, Response lookup, dtype)
+COLUMNS = [
+    ('responseid', 'responseid', 'int64'),
+    ('timestamp', 'responsetimestamp', 'datetime64[s]'),
+    ('personid', 'personid', 'int32'),
+    ('communityid', 'personid__communityid', 'int32'),
+    ('countryid', 'personid__communityid__countryid', 'int32'),
+    ('surveyid', 'surveyquestionid__surveyid', 'int32'),
+    ('surveyquestionid', 'surveyquestionid', 'int32'),
+    ('questionid', 'surveyquestionid__questionid', 'int32'),
+    ('date_of_birth', 'personid__date_of_birth', 'datetime64[D]'),
+]
+
+# (column, Response lookup), stored as int32 codes
+DICTIONARY_COLUMNS = [
+    ('gender', 'personid__gender'),
+    ('countrycode', 'personid__communityid__countryid__code'),
+    ('region', 'personid__communityid__region'),
+]
+
+# (column, Response lookup), stored as int64 end offsets into a text file
+TEXT_COLUMNS = [
+    ('responsedata', 'responsedata'),
+]
+
+
+def snapshot_dir():
+
+    return getattr(settings, 'REPORT_SNAPSHOT_DIR', None)
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot directory. Columns are memory-mapped on
+    first access; ``values(name)`` decodes a dictionary encoded or text
+    column.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta:
+            self.meta = json.load(meta)
+        self.rows = self.meta['rows']
+        self.watermark = self.meta['watermark']
+        self.columns = {}
+
+    @classmethod
+    def open(cls, path=None):
+        """
+        The snapshot in ``path`` (``REPORT_SNAPSHOT_DIR`` by default), or
+        None when there is none.
+        """
+
+        path = path or snapshot_dir()
+        if not path:
+            return None
+        try:
+            return cls(path)
+        except FileNotFoundError:
+            # None taken yet, or a rebuild is being swapped in
+            return None
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            dtype = self.meta['columns'][name]
+            if self.rows == 0:
+                self.columns[name] = np.zeros(0, dtype=dtype)
+            else:
+                self.columns[name] = np.memmap(column_path(self.path, name), dtype=dtype, mode='r', shape=(self.rows,))
+        return self.columns[name]
+
+    def dictionary(self, name):
+
+        with open(dictionary_path(self.path, name)) as values:
+            return json.load(values)
+
+    def values(self, name):
+
+        if name in self.meta['text']:
+            return self.text(name)
+        dictionary = np.array(self.dictionary(name) + [None], dtype=object)
+        # Code -1 picks the trailing None
+        return dictionary[self[name]]
+
+    def text(self, name):
+
+        ends = np.asarray(self[name])
+        null = ends < 0
+        ends = np.where(null, -1 - ends, ends)
+        starts = np.concatenate([[0], ends[:-1]])
+        with open(text_path(self.path, name), 'rb') as text:
+            data = text.read(self.meta['text'][name])
+        return np.array([
+            None if is_null else data[start:end].decode()
+            for start, end, is_null in zip(starts.tolist(), ends.tolist(), null.tolist())
+        ], dtype=object)
+
+
+def column_path(path, name):
+
+    return os.path.join(path, '%s.bin' % name)
+
+
+def dictionary_path(path, name):
+
+    return os.path.join(path, '%s.dict.json' % name)
+
+
+def text_path(path, name):
+
+    return os.path.join(path, '%s.txt' % name)
+
+
+def write_json(filename, data):
+
+    # Write to a temporary file first so readers never see a partial file
+    with open(filename + '.tmp', 'w') as output:
+        json.dump(data, output)
+    os.replace(filename + '.tmp', filename)
+
+
+def empty_meta():
+
+    columns = {name: dtype for name, _, dtype in COLUMNS}
+    columns.update({name: 'int32' for name, _ in DICTIONARY_COLUMNS})
+    columns.update({name: 'int64' for name, _ in TEXT_COLUMNS})
+    # Bytes of each text file
+    return {'rows': 0, 'watermark': 0, 'columns': columns, 'text': {name: 0 for name, _ in TEXT_COLUMNS}}
+
+
+def encode(values, dictionary, index):
+
+    codes = np.empty(len(values), dtype='int32')
+    for position, value in enumerate(values):
+        if value is None:
+            codes[position] = -1
+            continue
+        code = index.get(value)
+        if code is None:
+            code = index[value] = len(dictionary)
+            dictionary.append(value)
+        codes[position] = code
+    return codes
+
+
+def encode_text(values, output, offset):
+
+    ends = np.empty(len(values), dtype='int64')
+    for position, value in enumerate(values):
+        if value is None:
+            ends[position] = -1 - offset
+            continue
+        data = value.encode()
+        output.write(data)
+        offset += len(data)
+        ends[position] = offset
+    return ends, offset
+
+
+def update_snapshot(path=None, chunk_size=20000, rebuild=False):
+    """
+    Append the responses after the snapshot's watermark, ``chunk_size`` at a
+    time, creating the snapshot first if needed. Returns the number of rows
+    appended. A snapshot taken before response data was kept as text is
+    rebuilt.
+    """
+
+    path = path or snapshot_dir()
+    meta_path = os.path.join(path, 'meta.json')
+    meta = None
+    if not rebuild and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+    if meta is not None and 'text' not in meta:
+        meta = None
+        rebuild = True
+    if rebuild and os.path.exists(path):
+        building = path.rstrip(os.sep) + '.rebuild'
+        if os.path.exists(building):
+            shutil.rmtree(building)
+        appended = update_snapshot(building, chunk_size)
+        replace_directory(building, path)
+        return appended
+    os.makedirs(path, exist_ok=True)
+    meta = meta or empty_meta()
+
+    dictionaries = {}
+    for name, _ in DICTIONARY_COLUMNS:
+        if os.path.exists(dictionary_path(path, name)):
+            with open(dictionary_path(path, name)) as values:
+                dictionaries[name] = json.load(values)
+        else:
+            dictionaries[name] = []
+    indexes = {name: {value: code for code, value in enumerate(values)} for name, values in dictionaries.items()}
+    sizes = {name: len(values) for name, values in dictionaries.items()}
+
+    # Drop whatever an interrupted update appended past the recorded rows and text
+    files = {}
+    for name, dtype in meta['columns'].items():
+        files[name] = open(column_path(path, name), 'ab')
+        files[name].truncate(meta['rows'] * np.dtype(dtype).itemsize)
+    texts = {}
+    for name, size in meta['text'].items():
+        texts[name] = open(text_path(path, name), 'ab')
+        texts[name].truncate(size)
+
+    latest = Response.objects.aggregate(responseid=Max('responseid'))['responseid'] or 0
+    lookups = [lookup for _, lookup, _ in COLUMNS] + [lookup for _, lookup in DICTIONARY_COLUMNS + TEXT_COLUMNS]
+    responses = (
+        Response.objects.filter(responseid__gt=meta['watermark'], responseid__lte=latest)
+        .order_by('responseid')
+        .values_list(*lookups)
+    )
+
+    appended = 0
+    try:
+        chunk = []
+        for row in responses.iterator(chunk_size=chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                append_chunk(files, texts, meta['text'], chunk, dictionaries, indexes)
+                appended += len(chunk)
+                chunk = []
+        if chunk:
+            append_chunk(files, texts, meta['text'], chunk, dictionaries, indexes)
+            appended += len(chunk)
+    finally:
+        for output in [*files.values(), *texts.values()]:
+            output.close()
+
+    for name, values in dictionaries.items():
+        # Rewritten only when new values came in; these stay small
+        if len(values) != sizes[name] or not os.path.exists(dictionary_path(path, name)):
+            write_json(dictionary_path(path, name), values)
+    meta['rows'] += appended
+    meta['watermark'] = max(meta['watermark'], latest)
+    write_json(meta_path, meta)
+    return appended
+
+
+def replace_directory(source, target):
+
+    # A directory cannot be renamed over a non-empty one, so the old one is moved
+    # aside first; readers that mapped its files keep them until they let go
+    retired = target.rstrip(os.sep) + '.old'
+    if os.path.exists(retired):
+        shutil.rmtree(retired)
+    os.replace(target, retired)
+    os.replace(source, target)
+    shutil.rmtree(retired)
+
+
+def append_chunk(files, texts, text_sizes, chunk, dictionaries, indexes):
+
+    columns = list(zip(*chunk))
+    for position, (name, _, dtype) in enumerate(COLUMNS):
+        values = columns[position]
+        if dtype.startswith('int'):
+            values = [value or 0 for value in values]
+        elif dtype == 'datetime64[s]':
+            # Timestamps are stored in UTC, without a time zone
+            values = [value.astimezone(timezone.utc).replace(tzinfo=None) if value else None for value in values]
+        files[name].write(np.array(values, dtype=dtype).tobytes())
+    for position, (name, _) in enumerate(DICTIONARY_COLUMNS, start=len(COLUMNS)):
+        files[name].write(encode(columns[position], dictionaries[name], indexes[name]).tobytes())
+    for position, (name, _) in enumerate(TEXT_COLUMNS, start=len(COLUMNS) + len(DICTIONARY_COLUMNS)):
+        ends, text_sizes[name] = encode_text(columns[position], texts[name], text_sizes[name])
+        files[name].write(ends.tobytes())
+
+
+def survey_respondents(snapshot):
+    """
+    Distinct people who answered each survey, by survey id: the snapshot's
+    (survey, person) pairs plus those of the responses added since its
+    watermark, which are read from the database.
+    """
+
+    tail = np.array(
+        list(
+            Response.objects.filter(
+                responseid__gt=snapshot.watermark, personid__isnull=False, surveyquestionid__surveyid__isnull=False,
+            ).values_list('surveyquestionid__surveyid', 'personid')
+        ),
+        dtype=np.int64,
+    ).reshape(-1, 2)
+    survey_ids, person_ids = snapshot['surveyid'], snapshot['personid']
+    known = (survey_ids > 0) & (person_ids > 0)
+    survey_ids = np.concatenate([survey_ids[known].astype(np.int64), tail[:, 0]])
+    person_ids = np.concatenate([person_ids[known].astype(np.int64), tail[:, 1]])
+
+    width = int(person_ids.max(initial=0)) + 1
+    pairs = np.unique(survey_ids * width + person_ids)
+    surveys, counts = np.unique(pairs // width, return_counts=True)
+    return dict(zip(surveys.tolist(), counts.tolist()))
@@ -0,0 +1,67 @@
+from .catalog import MULTIPLE_CHOICE, get_catalog
+from .models import *
+
+# Set by the backfill only: new responses are indexed as they are saved, so the
+# highest indexed response says nothing about the ones before it
+WATERMARK = 'response_options'
+
+
+def parse_option_ids(responsedata):
+
+    # Multiple choice answers are stored as a comma separated list of option ids
+    option_ids = []
+    for value in (responsedata or '').split(','):
+        value = value.strip()
+        if value.isdecimal() and int(value) not in option_ids:
+            option_ids.append(int(value))
+    return option_ids
+
+
+def build_response_options(responses, option_ids):
+    """
+    Turn ``Response`` rows for multiple choice questions into the
+    ``Responseoption`` rows selecting each of their options. Option ids that
+    do not exist in ``option_ids`` are dropped.
+    """
+
+    return [
+        Responseoption(
+            responseid_id=response.responseid,
+            surveyquestionid_id=response.surveyquestionid_id,
+            optionid_id=option_id,
+            personid_id=response.personid_id,
+        )
+        for response in responses
+        for option_id in parse_option_ids(response.responsedata)
+        if option_id in option_ids
+    ]
+
+
+def index_responses(responses):
+    """
+    Add the option selections of ``responses`` to the ``Responseoption``
+    index. Responses to other question types are ignored and responses that
+    were already indexed are left alone, so this is safe to repeat.
+    """
+
+    catalog = get_catalog()
+    selected = {option_id for response in responses for option_id in parse_option_ids(response.responsedata)}
+    if any(response.surveyquestionid_id not in catalog.questions for response in responses) or selected - catalog.option_text.keys():
+        # Questions or options added since the catalog was last checked
+        catalog = get_catalog(check=True)
+
+    responses = [
+        response for response in responses
+        if response.surveyquestionid_id in catalog.questions
+        and catalog.questions[response.surveyquestionid_id].is_multiple_choice
+    ]
+
+    rows = build_response_options(responses, catalog.option_text)
+    Responseoption.objects.bulk_create(rows, ignore_conflicts=True)
+    return len(rows)
+
+
+def indexed_watermark():
+
+    watermark = Watermark.objects.filter(name=WATERMARK).values_list('responseid', flat=True).first()
+    return watermark or 0
@@ -1,3 +1,2029 @@
-from django.test import TestCase
+import csv
+import os
+import shutil
+import json
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timezone
+from functools import partial
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import AsyncRequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import ResolverMatch, resolve, reverse
+
+from . import async_views
+from .benchmark import SCALES, benchmark_urls, check_budgets, generate_dataset, load_budgets, run_benchmark, run_crosstab_benchmark
+from .cache import report_cache, stats
+from .catalog import catalog_version_sql, get_catalog, holder as catalog
+from .concurrency import run_concurrently, run_in_connection, wrapped_queries
+from .conversations import ConversationCache, conversations
+from .crosstab import crosstab, orm_crosstab
+from .demographics import calculate_demographics
+from .fields import Fields
+from .indexes import advise, drop_secondary_indexes, index_ddl, showplan_scans, sqlite_scans
+from .ingest import IngestQueue, Message, ingest_messages, replay_dead_letters
+from .leaderboard import leaderboard, rebuild_leaderboard, update_leaderboard
+from .loadtest import DEFAULT_MIX, LoadTestError, compare_results, parse_mix, request_plan, run_load_test
+from .metrics import RequestMetrics, registry
+from .models import *
+from .routers import replicas
+from .sketches import HyperLogLog, merged_sketches, sketch_watermark, standard_error, survey_respondent_counts, update_sketches
+from .snapshot import Snapshot, update_snapshot, write_json
+from .reports import community_report, countries_report, country_report, statistics_report
+from .tally import parse_option_ids
+from .warming import warm_paths, warm_report
+
+
+def create_survey(title, questions):
+    """
+    Create a survey whose questions are given as ``(type, [option texts])``
+    pairs. Returns the survey and its survey questions in order.
+    """
+
+    survey = Survey.objects.create(title=title, description='%s description' % title)
+    surveyquestions = []
+    for order_number, (question_type, option_texts) in enumerate(questions, start=1):
+        question = Question.objects.create(type=question_type, question='%s question %d' % (title, order_number))
+        for option_text in option_texts:
+            option = Option.objects.create(optiontext=option_text)
+            Questionoption.objects.create(questionid=question, optionid=option)
+        surveyquestions.append(Surveyquestion.objects.create(
+            surveyid=survey, questionid=question, order_number=order_number,
+        ))
+    return survey, surveyquestions
+
+
+def option_ids(surveyquestion):
+    return list(
+        Questionoption.objects.filter(questionid=surveyquestion.questionid)
+        .order_by('questionoptionid')
+        .values_list('optionid', flat=True)
+    )
+
+
+class ReportTestCase(TestCase):
+
+    def setUp(self):
+        # Ids are reused between tests, so cached payloads could look current
+        report_cache().clear()
+        stats.reset()
+        catalog.reset()
+        conversations.reset()
+        leaderboard.reset()
+        merged_sketches.reset()
+
+
+class CommunityReportTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.country = Country.objects.create(name='Kenya', code='KE', latitude=0.0, longitude=37.9)
+        cls.community = Community.objects.create(countryid=cls.country, region='Nairobi')
+        cls.people = [
+            Person.objects.create(name='A', gender='Male', date_of_birth=date(1990, 1, 1), communityid=cls.community),
+            Person.objects.create(name='B', gender='Female', date_of_birth=date(2015, 6, 1), communityid=cls.community),
+        ]
+        cls.survey, (cls.choice, cls.text) = create_survey('Water', [
+            ('Multiple Choice', ['Well', 'River', 'Tap']),
+            ('Text Entry', []),
+        ])
+        well, river, tap = option_ids(cls.choice)
+        cls.add_response(cls.choice, cls.people[0], '%d,%d' % (well, river))
+        cls.add_response(cls.choice, cls.people[1], '%d' % river)
+        cls.add_response(cls.text, cls.people[0], 'Too far away')
+
+    @classmethod
+    def add_response(cls, surveyquestion, person, responsedata):
+        return Response.objects.create(
+            surveyquestionid=surveyquestion,
+            personid=person,
+            responsedata=responsedata,
+            responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc),
+        )
+
+    def get_report(self, communityid):
+        return self.client.get(reverse('get_community', args=[communityid]))
+
+    def test_survey_info(self):
+        data = self.get_report(self.community.communityid).json()
+
+        self.assertEqual(data['communityInfo']['responders'], 2)
+        self.assertEqual(data['communityInfo']['genderRatio'], {'male': 50.0, 'female': 50.0})
+        survey = data['surveyInfo'][0]
+        self.assertEqual(survey['responseRate'], 100.0)
+        choice, text = survey['responses']
+        self.assertEqual(choice['chartType'], 'bar')
+        self.assertEqual(choice['answers'], [{'answer': 'Well', 'total': 1}, {'answer': 'River', 'total': 2}])
+        self.assertEqual(text['chartType'], 'text')
+        self.assertEqual(text['answers'], [{'answer': 'Too far away', 'total': 1}])
+
+    def test_unknown_community(self):
+        response = self.get_report(0)
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_query_count_is_constant(self):
+        get_catalog()
+        with CaptureQueriesContext(connection) as before:
+            self.get_report(self.community.communityid)
+
+        for title in ('Health', 'Education'):
+            survey, surveyquestions = create_survey(title, [
+                ('Multiple Choice', ['Yes', 'No', 'Maybe', 'Later', 'Never']),
+                ('Text Entry', []),
+                ('Multiple Choice', ['Good', 'Bad']),
+            ])
+            for surveyquestion in surveyquestions:
+                options = option_ids(surveyquestion)
+                for person in self.people:
+                    self.add_response(surveyquestion, person, str(options[0]) if options else 'Fine')
+
+        get_catalog()
+        with CaptureQueriesContext(connection) as after:
+            data = self.get_report(self.community.communityid).json()
+
+        self.assertEqual(len(data['surveyInfo']), 3)
+        self.assertEqual(len(after), len(before))
+
+
+class CountryReportTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE', latitude=0.0, longitude=37.9)
+        uganda = Country.objects.create(name='Uganda', code='UG', latitude=1.4, longitude=32.3)
+        Country.objects.create(name='Chad', code='TD')
+        cls.nairobi = Community.objects.create(countryid=kenya, region='Nairobi')
+        cls.mombasa = Community.objects.create(countryid=kenya, region='Mombasa')
+        kampala = Community.objects.create(countryid=uganda, region='Kampala')
+        _, (first, second) = create_survey('Water', [('Text Entry', []), ('Text Entry', [])])
+        _, (other,) = create_survey('Health', [('Text Entry', [])])
+
+        people = [
+            Person.objects.create(gender='Male', date_of_birth=date(1990, 1, 1), communityid=cls.nairobi),
+            Person.objects.create(gender='Female', date_of_birth=date(1990, 1, 1), communityid=cls.nairobi),
+            Person.objects.create(gender='Female', date_of_birth=date(1950, 1, 1), communityid=cls.mombasa),
+            Person.objects.create(gender='Female', date_of_birth=date(1950, 1, 1), communityid=kampala),
+        ]
+        for surveyquestion, person, day in [
+            (first, people[0], 1), (second, people[0], 1), (other, people[0], 2),
+            (first, people[1], 3), (first, people[2], 4), (first, people[3], 9),
+        ]:
+            Response.objects.create(
+                surveyquestionid=surveyquestion, personid=person, responsedata='ok',
+                responsetimestamp=datetime(2024, 3, day, tzinfo=timezone.utc),
+            )
+
+    def test_country(self):
+        data = self.client.get(reverse('get_country', args=['KE'])).json()
+
+        info = data['countryInfo']
+        self.assertEqual(info['respondents'], 3)
+        self.assertEqual(info['regions'], 2)
+        self.assertEqual(info['lastResponseDate'], 'March 04, 2024')
+        self.assertEqual(info['genderRatio'], {'male': 33.3, 'female': 66.7})
+        self.assertEqual(data['countryRegions'], [
+            {'id': self.nairobi.communityid, 'region': 'Nairobi', 'responses': 3},
+            {'id': self.mombasa.communityid, 'region': 'Mombasa', 'responses': 1},
+        ])
+
+    def test_unknown_country(self):
+        self.assertEqual(self.client.get(reverse('get_country', args=['XX'])).status_code, 404)
+
+    def test_countries(self):
+        data = self.client.get(reverse('get_countries')).json()
+
+        self.assertEqual(
+            [(country['code'], country['respondants']) for country in data],
+            [('KE', 3), ('UG', 1)],
+        )
+
+    def test_survey_statistics(self):
+        data = self.client.get(reverse('survey_statistics')).json()
+
+        self.assertEqual(data['totalResponses'], 5)
+        self.assertEqual(data['totalRespondants'], 4)
+        self.assertEqual(data['numberofCountries'], 2)
+
+    def count_queries(self, url):
+        report_cache().clear()
+        get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_query_count_is_constant(self):
+        urls = [reverse('get_country', args=['KE']), reverse('get_countries')]
+        before = [self.count_queries(url) for url in urls]
+
+        kenya = Country.objects.get(code='KE')
+        _, (surveyquestion,) = create_survey('Education', [('Text Entry', [])])
+        for number in range(3):
+            community = Community.objects.create(countryid=kenya, region='Region %d' % number)
+            other = Community.objects.create(
+                countryid=Country.objects.create(name='Country %d' % number, code='C%d' % number),
+                region='Capital',
+            )
+            for person in [Person.objects.create(communityid=community), Person.objects.create(communityid=other)]:
+                Response.objects.create(surveyquestionid=surveyquestion, personid=person, responsedata='ok')
+
+        self.assertEqual([self.count_queries(url) for url in urls], before)
+        self.assertEqual(len(self.client.get(urls[0]).json()['countryRegions']), 5)
+
+
+class BatchReportTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        uganda = Country.objects.create(name='Uganda', code='UG')
+        Country.objects.create(name='Chad', code='TD')
+        cls.communities = [
+            Community.objects.create(countryid=kenya, region='Nairobi'),
+            Community.objects.create(countryid=kenya, region='Mombasa'),
+            Community.objects.create(countryid=uganda, region='Kampala'),
+            Community.objects.create(countryid=uganda, region='Gulu'),
+        ]
+        _, (choice, text) = create_survey('Water', [('Multiple Choice', ['Well', 'River']), ('Text Entry', [])])
+        _, (other,) = create_survey('Health', [('Text Entry', [])])
+        well, river = option_ids(choice)
+        for number, community in enumerate(cls.communities[:3]):
+            people = [
+                Person.objects.create(gender='Female', date_of_birth=date(1990, 1, 1), communityid=community),
+                Person.objects.create(gender='Male', communityid=community),
+            ]
+            for surveyquestion, person, responsedata in [
+                (choice, people[0], str(well)), (choice, people[1], '%d,%d' % (well, river)),
+                (text, people[0], 'Far'), (text, people[1], 'Near'), (text, people[1], 'Far'),
+                (other, people[number % 2], 'Fine'),
+            ]:
+                Response.objects.create(
+                    surveyquestionid=surveyquestion, personid=person, responsedata=responsedata,
+                    responsetimestamp=datetime(2024, 3, number + 1, tzinfo=timezone.utc),
+                )
+
+    def get_reports(self, **params):
+        return self.client.get(reverse('get_reports'), params)
+
+    def test_communities(self):
+        ids = [community.communityid for community in self.communities] + [0]
+        data = self.get_reports(community=','.join(map(str, ids)), answers=1).json()
+
+        self.assertEqual(list(data['communities']), [str(communityid) for communityid in ids])
+        for communityid in ids[:-1]:
+            expected = self.client.get(reverse('get_community', args=[communityid]), {'answers': 1}).json()
+            self.assertEqual(data['communities'][str(communityid)], expected)
+        self.assertEqual(data['communities']['0'], {'error': 'Community not found'})
+
+    def test_countries(self):
+        data = self.get_reports(country=['UG', 'KE,TD', 'XX']).json()
+
+        self.assertEqual(list(data['countries']), ['UG', 'KE', 'TD', 'XX'])
+        for code in ('UG', 'KE', 'TD'):
+            expected = self.client.get(reverse('get_country', args=[code])).json()
+            self.assertEqual(data['countries'][code], expected)
+        self.assertEqual(data['countries']['XX'], {'error': 'Country not found'})
+
+    def test_query_count_does_not_depend_on_the_batch_size(self):
+        get_catalog()
+        counts = []
+        for params in [
+            {'community': self.communities[0].communityid},
+            {'community': ','.join(str(community.communityid) for community in self.communities)},
+            {'country': 'KE'},
+            {'country': 'KE,UG,TD'},
+        ]:
+            report_cache().clear()
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.get_reports(**params).status_code, 200)
+            counts.append(len(queries))
+
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(counts[2], counts[3])
+
+    @override_settings(REPORT_BATCH_SIZE=2)
+    def test_invalid_parameters(self):
+        for params in [{}, {'community': '1', 'country': 'KE'}, {'community': '1,x'}, {'community': '1,²'},
+                       {'country': 'KE,UG,TD'}]:
+            response = self.get_reports(**params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class FieldSelectionTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        cls.community = Community.objects.create(countryid=kenya, region='Nairobi')
+        person = Person.objects.create(gender='Female', date_of_birth=date(1990, 1, 1), communityid=cls.community)
+        _, (choice, text) = create_survey('Water', [('Multiple Choice', ['Well', 'River']), ('Text Entry', [])])
+        for surveyquestion, responsedata in [(choice, str(option_ids(choice)[0])), (text, 'Far')]:
+            Response.objects.create(
+                surveyquestionid=surveyquestion, personid=person, responsedata=responsedata,
+                responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc),
+            )
+
+    def test_fields(self):
+        fields = Fields(['communityInfo.responders', 'surveyInfo.responses.answers', 'surveyInfo'])
+
+        self.assertTrue(fields.wants('communityInfo'))
+        self.assertFalse(fields.wants('communityInfo.genderRatio'))
+        self.assertTrue(fields.wants('surveyInfo.responseRate'))
+        self.assertTrue(Fields().wants('anything.at.all'))
+        self.assertEqual(
+            fields.apply({'communityInfo': {'id': 1, 'responders': 2}, 'surveyInfo': [{'title': 'Water'}], 'other': 3}),
+            {'communityInfo': {'responders': 2}, 'surveyInfo': [{'title': 'Water'}]},
+        )
+
+    @override_settings(CATALOG_CHECK_INTERVAL=3600)
+    def test_unrequested_sections_cost_no_queries(self):
+        get_catalog()
+        # Only the community or country itself is read
+        with self.assertNumQueries(1):
+            data = community_report(self.community.communityid, fields=Fields(['communityInfo.region']))
+        self.assertEqual(data, {'communityInfo': {'region': 'Nairobi'}})
+        with self.assertNumQueries(1):
+            data = country_report('KE', fields=Fields(['countryInfo.countryName']))
+        self.assertEqual(data, {'countryInfo': {'countryName': 'Kenya'}})
+
+        with self.assertNumQueries(1):
+            self.assertEqual(statistics_report(fields=Fields(['numberofCountries'])), {'numberofCountries': 1})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(countries_report(Fields(['code'])), [{'code': 'KE'}])
+        self.assertNotIn('COUNT', queries[0]['sql'])
+
+        # Demographics are needed for response rates, but answers are not
+        with self.assertNumQueries(3):
+            data = community_report(self.community.communityid, fields=Fields(['surveyInfo.responseRate']))
+        self.assertEqual(data, {'surveyInfo': [{'responseRate': 100.0}]})
+
+    def test_views(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        full = self.client.get(url).json()
+
+        self.assertEqual(self.client.get(url, {'fields': 'communityInfo'}).json(), {'communityInfo': full['communityInfo']})
+        data = self.client.get(url, {'fields': 'communityInfo.responders', 'include': 'surveyInfo.title'}).json()
+        self.assertEqual(data, {'communityInfo': {'responders': 1}, 'surveyInfo': [{'title': 'Water'}]})
+        self.assertEqual(
+            self.client.get(reverse('get_countries'), {'fields': 'code,respondants'}).json(),
+            [{'code': 'KE', 'respondants': 1}],
+        )
+        self.assertEqual(
+            self.client.get(reverse('get_country', args=['KE']), {'fields': 'countryRegions.responses'}).json(),
+            {'countryRegions': [{'responses': 1}]},
+        )
+        self.assertEqual(self.client.get(url, {'fields': 'communityInfo..id'}).status_code, 400)
+
+
+class PaginationTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Kenya', code='KE')
+        cls.communities = [Community.objects.create(countryid=country, region='Region %d' % number) for number in range(5)]
+        cls.community = cls.communities[0]
+        person = Person.objects.create(gender='Male', date_of_birth=date(1990, 1, 1), communityid=cls.community)
+        _, (cls.first, cls.second) = create_survey('Water', [('Text Entry', []), ('Text Entry', [])])
+        for answer in ['Yes', 'No', 'Yes', 'Maybe', 'Yes']:
+            Response.objects.create(surveyquestionid=cls.first, personid=person, responsedata=answer)
+        Response.objects.create(surveyquestionid=cls.second, personid=person, responsedata='Later')
+
+    def get_questions(self, **params):
+        url = reverse('get_community', args=[self.community.communityid])
+        return self.client.get(url, params).json()['surveyInfo'][0]['responses']
+
+    def test_text_answers_are_paged(self):
+        first, second = self.get_questions(answers=2)
+
+        self.assertEqual([answer['answer'] for answer in first['answers']], ['Yes', 'No'])
+        self.assertEqual(second['answers'], [{'answer': 'Later', 'total': 1}])
+        self.assertIsNone(second['nextAnswers'])
+
+        answers = []
+        url = first['nextAnswers']
+        while url:
+            page = self.client.get(url).json()
+            answers += [answer['answer'] for answer in page['answers']]
+            url = page['nextAnswers']
+        self.assertEqual(answers, ['Yes', 'Maybe', 'Yes'])
+
+    def test_grouped_text_answers(self):
+        first, _ = self.get_questions(answers=2, group_text='1')
+
+        self.assertEqual(first['answers'], [{'answer': 'Yes', 'total': 3}, {'answer': 'Maybe', 'total': 1}])
+
+    def test_text_answer_pages_are_cached_per_question(self):
+        first = self.client.get(reverse('get_text_answers', args=[self.community.communityid, self.first.surveyquestionid]))
+        second = self.client.get(reverse('get_text_answers', args=[self.community.communityid, self.second.surveyquestionid]))
+
+        self.assertEqual(len(first.json()['answers']), 5)
+        self.assertEqual(second.json()['answers'], [{'answer': 'Later', 'total': 1}])
+
+    def test_communities_are_paged(self):
+        ids = []
+        url = reverse('get_communities') + '?limit=2'
+        while url:
+            response = self.client.get(url)
+            ids += [community['id'] for community in response.json()]
+            url = response.get('Link', '').partition('>')[0][1:]
+
+        self.assertEqual(ids, [community.communityid for community in self.communities])
+
+    def test_next_link_is_cached(self):
+        url = reverse('get_communities') + '?limit=2'
+        self.client.get(url)
+        response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertIn('rel="next"', response['Link'])
+
+    def test_invalid_page_size(self):
+        self.assertEqual(self.client.get(reverse('get_communities'), {'limit': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('get_communities'), {'after': 'x'}).status_code, 400)
+
+
+@override_settings(REPORT_REPLICAS=['replica1', 'replica2'], REPORT_REPLICA_MAX_LAG=60)
+class ReplicaRouterTests(ReportTestCase):
+    databases = {'default', 'replica1', 'replica2'}
+
+    @classmethod
+    def setUpTestData(cls):
+        for alias in cls.databases:
+            country = Country.objects.using(alias).create(name='Kenya (%s)' % alias, code='KE')
+            Community.objects.using(alias).create(countryid=country, region='Nairobi')
+            Response.objects.using(alias).create(responsedata='ok', responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc))
+
+    def setUp(self):
+        super().setUp()
+        replicas.reset()
+
+    def country_name(self):
+        report_cache().clear()
+        return self.client.get(reverse('get_countries')).json()[0]['country']
+
+    def test_round_robin(self):
+        names = {self.country_name() for _ in range(4)}
+
+        self.assertEqual(names, {'Kenya (replica1)', 'Kenya (replica2)'})
+
+    def test_lagging_replica_is_skipped(self):
+        Response.objects.create(responsedata='late', responsetimestamp=datetime(2024, 3, 1, 0, 5, tzinfo=timezone.utc))
+        Response.objects.using('replica2').create(responsedata='late', responsetimestamp=datetime(2024, 3, 1, 0, 5, tzinfo=timezone.utc))
+
+        self.assertEqual({self.country_name() for _ in range(3)}, {'Kenya (replica2)'})
+
+    def test_falls_back_to_primary(self):
+        with mock.patch('api.routers.replication_lag', side_effect=DatabaseError):
+            self.assertEqual(self.country_name(), 'Kenya (default)')
+
+    @override_settings(REPORT_REPLICA_STRATEGY='least_latency')
+    def test_least_latency(self):
+        replicas.healthy_replicas()
+        replicas.states['replica1'].latency = 0.5
+        replicas.states['replica2'].latency = 0.001
+
+        self.assertEqual({self.country_name() for _ in range(3)}, {'Kenya (replica2)'})
+
+    def test_other_views_use_primary(self):
+        self.assertEqual(self.client.get(reverse('get_communities')).json()[0]['country'], 'Kenya (default)')
+
+
+class DemographicsTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.community = Community.objects.create(region='Kisumu')
+        for gender, date_of_birth in [
+            ('Male', date(2010, 3, 2)),    # 14
+            ('Female', date(2009, 3, 1)),  # 15 today
+            ('Female', date(1995, 1, 1)),  # 29
+            ('Other', date(1964, 3, 1)),   # 60 today
+            ('Male', date(1964, 3, 2)),    # 59
+        ]:
+            Person.objects.create(gender=gender, date_of_birth=date_of_birth, communityid=cls.community)
+
+    def test_single_grouped_query(self):
+        with self.assertNumQueries(1):
+            demographics = calculate_demographics(Person.objects.all(), today=date(2024, 3, 1))
+
+        self.assertEqual(demographics['respondents'], 5)
+        self.assertEqual(demographics['gender'], {'Male': 40.0, 'Female': 40.0, 'Other': 20.0, 'I prefer not to say': 0.0})
+        self.assertEqual(demographics['age'], {
+            '0-14': 20.0, '15-21': 20.0, '22-29': 20.0, '30-39': 0.0, '40-59': 20.0, 'Over 60': 20.0,
+        })
+
+    def test_empty_scope(self):
+        demographics = calculate_demographics(Person.objects.none())
+
+        self.assertEqual(demographics['respondents'], 0)
+        self.assertEqual(set(demographics['age'].values()), {0})
+
+
+class ReportCacheTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Ghana', code='GH')
+        cls.community = Community.objects.create(countryid=country, region='Accra')
+        cls.person = Person.objects.create(gender='Female', date_of_birth=date(1980, 1, 1), communityid=cls.community)
+        _, (cls.surveyquestion,) = create_survey('Energy', [('Text Entry', [])])
+
+    def add_response(self, person):
+        Response.objects.create(
+            surveyquestionid=self.surveyquestion,
+            personid=person,
+            responsedata='Solar',
+            responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc),
+        )
+
+    def test_served_from_cache_until_version_moves(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        first = self.client.get(url)
+        second = self.client.get(url)
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.json(), second.json())
+
+        self.add_response(self.person)
+        third = self.client.get(url)
+
+        self.assertEqual(third['X-Cache'], 'MISS')
+        self.assertEqual(third.json()['surveyInfo'][0]['responses'][0]['answers'], [{'answer': 'Solar', 'total': 1}])
+        self.assertEqual(stats.snapshot()['get_community'], {'hits': 1, 'misses': 2})
+
+    def test_other_scopes_keep_their_entries(self):
+        other = Community.objects.create(region='Kumasi')
+        url = reverse('get_community', args=[self.community.communityid])
+        self.client.get(url)
+
+        self.add_response(Person.objects.create(communityid=other))
+
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('survey_statistics'))['X-Cache'], 'MISS')
+
+    def test_views_sharing_a_scope_are_cached_separately(self):
+        self.client.get(reverse('survey_statistics'))
+        response = self.client.get(reverse('get_countries'))
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIsInstance(response.json(), list)
+
+    def test_errors_are_not_cached(self):
+        url = reverse('get_country', args=['XX'])
+        self.client.get(url)
+
+        self.assertEqual(self.client.get(url)['X-Cache'], 'MISS')
+
+    def test_country_codes_match_whatever_their_case(self):
+        lower = reverse('get_country', args=['gh'])
+        first = self.client.get(lower)
+        upper = self.client.get(reverse('get_country', args=['GH']))
+
+        self.assertEqual((first.status_code, upper.status_code), (200, 200))
+        self.assertEqual(first.json()['countryInfo']['code'], 'gh')
+        self.assertEqual(upper.json()['countryInfo']['code'], 'GH')
+
+        # Codes stored in lower case are found too
+        Country.objects.create(name='Lowland', code='lw')
+        for code in ('lw', 'LW'):
+            response = self.client.get(reverse('get_country', args=[code]))
+            self.assertEqual((response.status_code, response.json()['countryInfo']['code']), (200, code))
+
+        # The lower case scope sees new data
+        self.add_response(self.person)
+        self.assertEqual(self.client.get(lower)['X-Cache'], 'MISS')
+
+
+class ConditionalGetTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Zambia', code='ZM')
+        cls.community = Community.objects.create(countryid=country, region='Lusaka')
+        cls.person = Person.objects.create(gender='Male', date_of_birth=date(1985, 1, 1), communityid=cls.community)
+        _, (cls.surveyquestion,) = create_survey('Roads', [('Text Entry', [])])
+        cls.add_response(cls.person, datetime(2024, 3, 1, 12, 0, tzinfo=timezone.utc))
+
+    @classmethod
+    def add_response(cls, person, timestamp):
+        Response.objects.create(
+            surveyquestionid=cls.surveyquestion, personid=person, responsedata='Paved', responsetimestamp=timestamp,
+        )
+
+    def test_validators_are_sent(self):
+        response = self.client.get(reverse('get_community', args=[self.community.communityid]))
+
+        self.assertTrue(response['ETag'].startswith('"'))
+        # The latest response time does not move with everything the report depends on
+        self.assertEqual(response.has_header('Last-Modified'), False)
+
+    def test_matching_etag_is_not_modified_before_any_aggregation(self):
+        for url in [reverse('get_community', args=[self.community.communityid]), reverse('get_countries')]:
+            etag = self.client.get(url)['ETag']
+            # Data version checks only; the report is neither built nor read from the cache
+            with CaptureQueriesContext(connection) as queries, mock.patch('api.cache.report_cache') as cache:
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.content, b'')
+            self.assertEqual(response['ETag'], etag)
+            self.assertLessEqual(len(queries), 4)
+            cache.assert_not_called()
+
+    def test_etag_changes_with_the_data(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        etag = self.client.get(url)['ETag']
+
+        Person.objects.create(communityid=self.community)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['communityInfo']['responders'], 2)
+
+    def test_etag_depends_on_the_query(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        etag = self.client.get(url)['ETag']
+
+        self.assertNotEqual(self.client.get(url, {'answers': 5})['ETag'], etag)
+        self.assertEqual(self.client.get(url, {'answers': 5}, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since_is_ignored(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        self.client.get(url)
+        since = 'Sat, 02 Mar 2024 00:00:00 GMT'
+
+        # A new respondent, and a response older than the latest one, change the report
+        Person.objects.create(communityid=self.community)
+        self.add_response(self.person, datetime(2024, 2, 1, tzinfo=timezone.utc))
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['communityInfo']['responders'], 2)
+
+    def test_errors_carry_no_validators(self):
+        response = self.client.get(reverse('get_country', args=['XX']))
+
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class ResponseOptionIndexTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Tanzania', code='TZ')
+        cls.community = Community.objects.create(countryid=country, region='Arusha')
+        cls.person = Person.objects.create(gender='Male', date_of_birth=date(1999, 1, 1), communityid=cls.community)
+        _, (cls.choice, cls.text) = create_survey('Transport', [
+            ('Multiple Choice', ['Bus', 'Bike', 'Walk']),
+            ('Text Entry', []),
+        ])
+        cls.options = option_ids(cls.choice)
+
+    def test_parse_option_ids(self):
+        self.assertEqual(parse_option_ids('3, 1,3,x,'), [3, 1])
+        self.assertEqual(parse_option_ids(None), [])
+        self.assertEqual(parse_option_ids('²,1'), [1])
+
+    def test_responses_saved_through_django_are_indexed(self):
+        bus, bike, walk = self.options
+        Response.objects.create(surveyquestionid=self.choice, personid=self.person, responsedata='%d,%d' % (bus, walk))
+        Response.objects.create(surveyquestionid=self.text, personid=self.person, responsedata='12')
+
+        self.assertEqual(
+            sorted(Responseoption.objects.values_list('optionid', flat=True)),
+            [bus, walk],
+        )
+
+    def test_backfill_command_indexes_external_responses(self):
+        bus, bike, walk = self.options
+        # bulk_create skips post_save, like rows written outside Django
+        Response.objects.bulk_create([
+            Response(surveyquestionid=self.choice, personid=self.person, responsedata='%d' % bike),
+            Response(surveyquestionid=self.choice, personid=self.person, responsedata='%d,%d' % (bike, bus)),
+            Response(surveyquestionid=self.choice, personid=self.person, responsedata='999'),
+        ])
+        self.assertFalse(Responseoption.objects.exists())
+
+        call_command('backfill_response_options', batch_size=2, stdout=StringIO())
+        call_command('backfill_response_options', stdout=StringIO())
+
+        data = self.client.get(reverse('get_community', args=[self.community.communityid])).json()
+        answers = data['surveyInfo'][0]['responses'][0]['answers']
+        self.assertEqual(answers, [{'answer': 'Bike', 'total': 2}, {'answer': 'Bus', 'total': 1}])
+
+    def test_backfill_is_not_skipped_by_responses_indexed_on_save(self):
+        bus, bike, walk = self.options
+        Response.objects.bulk_create([
+            Response(surveyquestionid=self.choice, personid=self.person, responsedata='%d' % bike),
+            Response(surveyquestionid=self.choice, personid=self.person, responsedata='%d' % bike),
+        ])
+        url = reverse('get_community', args=[self.community.communityid])
+        self.client.get(url)
+        # A later response is indexed straight away, ahead of the older ones
+        Response.objects.create(surveyquestionid=self.choice, personid=self.person, responsedata='%d' % walk)
+        stale = self.client.get(url).json()['surveyInfo'][0]['responses'][0]['answers']
+        self.assertEqual(stale, [{'answer': 'Walk', 'total': 1}])
+
+        output = StringIO()
+        call_command('backfill_response_options', stdout=output)
+        self.assertIn('Processed 3 responses', output.getvalue())
+
+        # The report cached before the backfill is not served any more
+        response = self.client.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        answers = response.json()['surveyInfo'][0]['responses'][0]['answers']
+        self.assertCountEqual(answers, [{'answer': 'Bike', 'total': 2}, {'answer': 'Walk', 'total': 1}])
+
+
+class SurveyCatalogTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Malawi', code='MW')
+        cls.community = Community.objects.create(countryid=country, region='Lilongwe')
+        cls.survey, cls.surveyquestions = create_survey('Farming', [
+            ('Multiple Choice', ['Maize', 'Rice']),
+            ('Multiple Choice', ['A', 'B', 'C', 'D', 'E']),
+            ('Text Entry', []),
+        ])
+
+    def test_loaded_in_a_few_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            current = get_catalog()
+
+        self.assertLessEqual(len(queries), 5)
+        questions = current.surveys[0].questions
+        self.assertEqual([question.surveyquestionid for question in questions], [sq.surveyquestionid for sq in self.surveyquestions])
+        self.assertEqual([question.chart_type for question in questions], ['bar', 'pie', 'text'])
+        self.assertEqual(current.option_text[option_ids(self.surveyquestions[0])[0]], 'Maize')
+
+    def test_shared_until_definitions_change(self):
+        first = get_catalog()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertIs(get_catalog(), first)
+        # Only the version check
+        self.assertEqual(len(queries), 1)
+
+        create_survey('Fishing', [('Text Entry', [])])
+        second = get_catalog()
+
+        self.assertIsNot(second, first)
+        self.assertEqual(second.survey_ids(), [self.survey.surveyid, self.survey.surveyid + 1])
+
+    @override_settings(CATALOG_MAX_AGE=3600)
+    def test_edits_in_place_are_loaded_after_the_maximum_age(self):
+        first = get_catalog()
+        question = self.surveyquestions[0].questionid
+        Question.objects.filter(pk=question.pk).update(question='Which crop?')
+
+        # Counts and ids did not move
+        self.assertIs(get_catalog(), first)
+        with override_settings(CATALOG_MAX_AGE=0):
+            second = get_catalog()
+
+        self.assertEqual(second.questions[self.surveyquestions[0].surveyquestionid].question, 'Which crop?')
+        self.assertNotEqual(second.key(), first.key())
+
+    def test_checksums_on_sql_server(self):
+        sql_server = mock.Mock(vendor='microsoft', ops=connection.ops)
+
+        self.assertIn('CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM "Question"', catalog_version_sql(sql_server))
+        self.assertNotIn('CHECKSUM', catalog_version_sql(connection))
+
+    @override_settings(CATALOG_CHECK_INTERVAL=60)
+    def test_version_checked_at_most_every_interval(self):
+        first = get_catalog()
+        create_survey('Fishing', [('Text Entry', [])])
+
+        with self.assertNumQueries(0):
+            self.assertIs(get_catalog(), first)
+        self.assertEqual(len(get_catalog(check=True).surveys), 2)
+
+    @override_settings(CATALOG_CHECK_INTERVAL=60)
+    def test_new_questions_are_indexed_before_the_interval(self):
+        get_catalog()
+        _, (surveyquestion,) = create_survey('Fishing', [('Multiple Choice', ['Net', 'Line'])])
+        person = Person.objects.create(communityid=self.community)
+        net, line = option_ids(surveyquestion)
+        Response.objects.create(surveyquestionid=surveyquestion, personid=person, responsedata=str(line))
+
+        self.assertEqual(list(Responseoption.objects.values_list('optionid', flat=True)), [line])
+
+    def test_report_refreshes_when_a_question_is_added(self):
+        url = reverse('get_community', args=[self.community.communityid])
+        self.client.get(url)
+        Surveyquestion.objects.create(
+            surveyid=self.survey, order_number=4,
+            questionid=Question.objects.create(type='Text Entry', question='Farming question 4'),
+        )
+
+        response = self.client.get(url)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()['surveyInfo'][0]['responses']), 4)
+
+
+class IngestTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Country.objects.create(name='Uganda', code='UG')
+        cls.survey, (cls.choice, cls.text) = create_survey('Sanitation', [
+            ('Multiple Choice', ['Latrine', 'Flush', 'None']),
+            ('Text Entry', []),
+        ])
+
+    def setUp(self):
+        super().setUp()
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % settings.INGEST_TOKEN
+
+    def post(self, messages, **extra):
+        return self.client.post(reverse('ingest'), {'messages': messages}, content_type='application/json', **extra)
+
+    def conversation(self, sender, *texts):
+        return [{'sender': sender, 'text': text} for text in ('Hi', 'ug', 'Gulu', '2', str(self.survey.surveyid), *texts)]
+
+    def test_conversation(self):
+        response = self.post(self.conversation('+256700000001', 'latrine, 3', 'Too far'))
+
+        self.assertEqual(response.status_code, 200)
+        stages = [result['stage'] for result in response.json()['results']]
+        self.assertEqual(stages, ['country', 'region', 'gender', 'survey', 'question', 'question', 'survey'])
+
+        person = Person.objects.get(sender_number='256700000001')
+        self.assertEqual((person.gender, person.communityid.region, person.communityid.countryid.code), ('Female', 'Gulu', 'UG'))
+        state = Userstate.objects.get(sender_number=256700000001)
+        self.assertEqual((state.personid_id, state.stage, state.surveyquestionid_id), (person.personid, 'survey', None))
+
+        latrine, flush, none = option_ids(self.choice)
+        self.assertEqual(
+            list(Response.objects.order_by('responseid').values_list('surveyquestionid', 'responsedata')),
+            [(self.choice.surveyquestionid, '%d,%d' % (latrine, none)), (self.text.surveyquestionid, 'Too far')],
+        )
+        self.assertEqual(sorted(Responseoption.objects.values_list('optionid', flat=True)), [latrine, none])
+
+    def test_conversation_spanning_batches(self):
+        messages = self.conversation(256700000002, '1')
+        self.post(messages[:3])
+        results = self.post(messages[3:]).json()['results']
+
+        self.assertEqual(results[-1]['surveyquestionid'], self.text.surveyquestionid)
+        self.assertEqual(Userstate.objects.count(), 1)
+        self.assertEqual(Person.objects.get().communityid.region, 'Gulu')
+
+    def test_invalid_answers_keep_the_stage(self):
+        results = self.post(self.conversation(256700000003, 'Bucket'))
+        result = results.json()['results'][-1]
+
+        self.assertEqual(result['stage'], 'question')
+        self.assertEqual(result['surveyquestionid'], self.choice.surveyquestionid)
+        self.assertIn('error', result)
+        self.assertFalse(Response.objects.exists())
+
+    def test_digits_int_cannot_read_are_rejected(self):
+        texts = ['Hi', 'ug', 'Gulu', '²', '2', '²', str(self.survey.surveyid), '²']
+        response = self.post([{'sender': 256700000006, 'text': text} for text in texts])
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([result['stage'] for result in results if 'error' in result], ['gender', 'survey', 'question'])
+        self.assertEqual(self.post([{'sender': '²', 'text': 'Hi'}]).status_code, 400)
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def queries(senders):
+            messages = [
+                Message(sender, text, None)
+                for sender in senders
+                for text in ('Hi', 'UG', 'Region %d' % (sender % 3), 'Male', str(self.survey.surveyid), '1', 'Fine')
+            ]
+            with CaptureQueriesContext(connection) as captured:
+                ingest_messages(messages)
+            return len(captured)
+
+        get_catalog()
+        small = queries(range(1, 3))
+        large = queries(range(100, 400))
+
+        # 2100 messages; only the database's limit on parameters splits statements
+        self.assertLess(large, small + 10)
+        self.assertEqual(Response.objects.count(), 2 * 302)
+
+    def test_malformed_batches(self):
+        self.assertEqual(self.post([{'sender': 'abc', 'text': 'Hi'}]).status_code, 400)
+        self.assertEqual(self.post([{'sender': '1'}]).status_code, 400)
+        response = self.client.post(reverse('ingest'), 'not json', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.client.get(reverse('ingest')).status_code, 405)
+
+    @override_settings(INGEST_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.post([]).status_code, 401)
+        self.assertEqual(self.post([], HTTP_AUTHORIZATION='').status_code, 401)
+        self.assertEqual(self.post([], HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(INGEST_TOKEN=None)
+    def test_disabled_without_a_token(self):
+        self.assertEqual(self.post(self.conversation(256700000005)).status_code, 403)
+        self.assertFalse(Userstate.objects.exists())
+
+    def test_write_behind_queue_flushes_by_size(self):
+        batches = []
+        queue = IngestQueue(batch_size=3, flush_interval=60, ingest=batches.append)
+
+        queue.put([Message(1, 'a', None), Message(1, 'b', None)])
+        self.assertEqual((len(queue), batches), (2, []))
+
+        queue.put([Message(1, 'c', None), Message(1, 'd', None)])
+        self.assertEqual([[message.text for message in batch] for batch in batches], [['a', 'b', 'c'], ['d']])
+        self.assertEqual((len(queue), queue.ingested), (0, 4))
+
+    def test_write_behind_queue_flushes_by_time(self):
+        flushed = threading.Event()
+        queue = IngestQueue(batch_size=100, flush_interval=0.01, ingest=lambda batch: flushed.set())
+
+        queue.put([Message(1, 'a', None)])
+
+        self.assertTrue(flushed.wait(5))
+        self.assertEqual(queue.ingested, 1)
+
+    def test_failed_batches_are_kept_and_replayed(self):
+        def fail(batch):
+            raise DatabaseError('unavailable')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'dead_letters.jsonl')
+            queue = IngestQueue(batch_size=100, flush_interval=60, ingest=fail, dead_letters=path)
+            queue.put([Message(256700000004, text, None) for text in ('Hi', 'UG', 'Gulu', 'Male')])
+            with self.assertLogs('api.ingest', 'ERROR'):
+                queue.flush()
+            self.assertEqual(queue.failed, 4)
+
+            with self.assertLogs('api.ingest', 'ERROR'):
+                self.assertEqual(replay_dead_letters(path, ingest=fail), (0, 4))
+            self.assertEqual(replay_dead_letters(path), (4, 0))
+
+            self.assertEqual(Person.objects.get().communityid.region, 'Gulu')
+            self.assertFalse(os.listdir(directory))
+
+
+class ConversationCacheTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Country.objects.create(name='Rwanda', code='RW')
+        cls.survey, cls.surveyquestions = create_survey('Health', [
+            ('Text Entry', []), ('Text Entry', []), ('Text Entry', []),
+        ])
+
+    def ingest(self, sender, *texts):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ingest_messages([Message(sender, text, None) for text in texts])
+
+    def test_next_question_pointers_follow_order_number(self):
+        # Created out of order
+        last = self.surveyquestions[0]
+        last.order_number = 9
+        last.save()
+        questions = get_catalog().surveys[0].questions
+
+        self.assertEqual([question.surveyquestionid for question in questions], [
+            self.surveyquestions[1].surveyquestionid, self.surveyquestions[2].surveyquestionid, last.surveyquestionid,
+        ])
+        self.assertEqual(
+            [question.next_surveyquestionid for question in questions],
+            [self.surveyquestions[2].surveyquestionid, last.surveyquestionid, None],
+        )
+
+    def test_active_conversations_skip_the_state_lookup(self):
+        self.ingest(250700000001, 'Hi', 'RW', 'Kigali', 'Male', str(self.survey.surveyid))
+        self.assertEqual(conversations.snapshot()['size'], 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.ingest(250700000001, 'Fine')
+
+        self.assertFalse([query for query in queries if 'FROM "UserState"' in query['sql']])
+        self.assertEqual(Userstate.objects.get().surveyquestionid_id, self.surveyquestions[1].surveyquestionid)
+        self.assertEqual(Response.objects.get().responsedata, 'Fine')
+        self.assertEqual(conversations.snapshot()['hits'], 1)
+
+    def test_failed_batches_leave_the_cache_alone(self):
+        self.ingest(250700000002, 'Hi', 'RW')
+
+        with mock.patch('api.ingest.index_responses', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+            self.ingest(250700000002, 'Kigali', 'Female', str(self.survey.surveyid), 'Fine')
+
+        states, missing = conversations.get_many([250700000002])
+        self.assertEqual(states[250700000002].stage, 'region')
+
+    def test_lru_and_ttl(self):
+        cache = ConversationCache(size=2, ttl=60)
+        cache.put_many([Userstate(userid=number, sender_number=number, stage='country') for number in (1, 2)])
+        cache.get_many([1])
+        cache.put_many([Userstate(userid=3, sender_number=3, stage='country')])
+
+        states, missing = cache.get_many([1, 2, 3])
+        self.assertEqual((sorted(states), missing), ([1, 3], [2]))
+        self.assertEqual(cache.snapshot(), {'size': 2, 'hits': 3, 'misses': 1, 'evictions': 1})
+        self.assertEqual(cache.hit_rate(), 0.75)
+
+        with mock.patch('api.conversations.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertEqual(cache.get_many([1])[1], [1])
+
+    def test_counters_are_exported(self):
+        self.assertIn('api_conversation_cache_hits_total 0', self.client.get(reverse('metrics')).content.decode())
+
+
+class ActivityRollupTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        cls.nairobi = Community.objects.create(countryid=kenya, region='Nairobi')
+        cls.kampala = Community.objects.create(countryid=Country.objects.create(name='Uganda', code='UG'), region='Kampala')
+        cls.people = [Person.objects.create(communityid=cls.nairobi) for _ in range(2)] + [Person.objects.create(communityid=cls.kampala)]
+        cls.water, (cls.question,) = create_survey('Water', [('Text Entry', [])])
+        cls.health, (cls.other,) = create_survey('Health', [('Text Entry', [])])
+
+    def respond(self, person, day, surveyquestion=None):
+        Response.objects.create(
+            surveyquestionid=surveyquestion or self.question, personid=person, responsedata='ok',
+            responsetimestamp=datetime(2024, 3, day, 9, tzinfo=timezone.utc),
+        )
+
+    def rollup(self):
+        call_command('rollup_activity', batch_size=2, stdout=StringIO())
+
+    def series(self, **params):
+        response = self.client.get(reverse('get_timeseries'), params)
+        self.assertEqual(response.status_code, 200)
+        # The distinct respondents of a day of one survey, or else respondent days
+        return [tuple(row.values()) for row in response.json()]
+
+    def test_incremental_rollup(self):
+        nairobi_a, nairobi_b, kampala = self.people
+        self.respond(nairobi_a, 4)
+        self.respond(nairobi_a, 4, self.other)
+        self.respond(kampala, 5)
+        self.rollup()
+
+        self.assertEqual(self.series(), [('2024-03-04', 2, 2), ('2024-03-05', 1, 1)])
+
+        # Later responses on a day already rolled up, one by a repeat respondent
+        self.respond(nairobi_a, 4)
+        self.respond(nairobi_b, 4)
+        self.rollup()
+
+        self.assertEqual(self.series(), [('2024-03-04', 4, 3), ('2024-03-05', 1, 1)])
+        self.assertEqual(self.series(survey=self.water.surveyid), [('2024-03-04', 3, 2), ('2024-03-05', 1, 1)])
+        # nairobi_a answered both surveys on the 4th: counted once per survey
+        day = self.client.get(reverse('get_timeseries')).json()[0]
+        self.assertEqual((day['respondentDays'], 'respondents' in day), (3, False))
+        day = self.client.get(reverse('get_timeseries'), {'survey': self.water.surveyid}).json()[0]
+        self.assertEqual((day['respondents'], 'respondentDays' in day), (2, False))
+        self.assertEqual(self.series(country='KE'), [('2024-03-04', 4, 3)])
+        self.assertEqual(self.series(community=self.kampala.communityid), [('2024-03-05', 1, 1)])
+        self.assertEqual(
+            Dailyactivity.objects.get(day=date(2024, 3, 4), communityid=self.nairobi, surveyid=self.water).respondents, 2,
+        )
+
+    def test_granularity_and_range(self):
+        for day in (4, 10, 11, 29):
+            self.respond(self.people[0], day)
+        self.rollup()
+
+        self.assertEqual(self.series(granularity='week'), [('2024-03-04', 2, 2), ('2024-03-11', 1, 1), ('2024-03-25', 1, 1)])
+        self.assertEqual(self.series(granularity='month'), [('2024-03-01', 4, 4)])
+        # One person, active on four days
+        month = self.client.get(reverse('get_timeseries'), {'granularity': 'month'}).json()[0]
+        self.assertEqual((month['respondentDays'], 'respondents' in month), (4, False))
+        self.assertEqual(self.series(since='2024-03-10', until='2024-03-29'), [('2024-03-10', 1, 1), ('2024-03-11', 1, 1)])
+
+    def test_rollup_selects_days_by_timestamp_range(self):
+        for day in (4, 5, 9):
+            self.respond(self.people[0], day)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.rollup()
+
+        # The days are found by response id, their responses by timestamp
+        grouped = [query['sql'] for query in queries if 'GROUP BY' in query['sql'] and 'COUNT(DISTINCT' in query['sql']]
+        self.assertTrue(grouped)
+        for sql in grouped:
+            where = sql.split(' WHERE ', 1)[1].split(' GROUP BY ')[0]
+            self.assertIn('"responseTimestamp" >=', where)
+            self.assertNotIn('cast_date', where)
+        self.assertEqual(self.series(), [('2024-03-04', 1, 1), ('2024-03-05', 1, 1), ('2024-03-09', 1, 1)])
+
+    def test_series_never_touch_responses(self):
+        self.respond(self.people[0], 4)
+        self.rollup()
+
+        with CaptureQueriesContext(connection) as queries:
+            self.series(granularity='week', country='KE')
+
+        self.assertFalse([query for query in queries if 'FROM "Response"' in query['sql']])
+
+    def test_cached_series_follow_the_rollup(self):
+        self.respond(self.people[0], 4)
+        self.rollup()
+        self.series()
+        self.respond(self.people[1], 4)
+
+        self.assertEqual(self.series(), [('2024-03-04', 1, 1)])
+        self.rollup()
+        self.assertEqual(self.series(), [('2024-03-04', 2, 2)])
+
+    def test_rebuild(self):
+        self.respond(self.people[0], 4)
+        self.rollup()
+        Dailyactivity.objects.update(responses=99)
+
+        call_command('rollup_activity', rebuild=True, stdout=StringIO())
+
+        self.assertEqual(self.series(), [('2024-03-04', 1, 1)])
+
+    def test_invalid_parameters(self):
+        for params in [{'granularity': 'year'}, {'since': 'March'}, {'community': 'x'}]:
+            self.assertEqual(self.client.get(reverse('get_timeseries'), params).status_code, 400)
+
+
+class CrosstabTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        cls.nairobi = Community.objects.create(countryid=kenya, region='Nairobi')
+        other = Community.objects.create(countryid=Country.objects.create(name='Uganda', code='UG'), region='Gulu')
+        _, (cls.choice, cls.text) = create_survey('Water', [('Multiple Choice', ['Well', 'River']), ('Text Entry', [])])
+        well, river = option_ids(cls.choice)
+        people = [
+            # Turns 15 on the day the tables are computed
+            (cls.nairobi, 'Female', date(2009, 6, 1), '%d,%d' % (well, river)),
+            (cls.nairobi, 'Male', date(2009, 6, 2), '%d' % river),
+            (cls.nairobi, None, None, '%d' % river),
+            (other, 'Other', date(1950, 1, 1), '%d' % well),
+        ]
+        for community, gender, date_of_birth, responsedata in people:
+            person = Person.objects.create(communityid=community, gender=gender, date_of_birth=date_of_birth)
+            Response.objects.create(surveyquestionid=cls.choice, personid=person, responsedata=responsedata)
+            Response.objects.create(surveyquestionid=cls.text, personid=person, responsedata='ok')
+
+    def test_tables(self):
+        (question,) = crosstab('community', self.nairobi.communityid, today=date(2024, 6, 1))
+        well, river = question['answers']
+
+        self.assertEqual((well['answer'], well['total']), ('Well', 1))
+        self.assertEqual(well['gender']['Female'], 1)
+        self.assertEqual(well['age'], {'0-14': 0, '15-21': 1, '22-29': 0, '30-39': 0, '40-59': 0, 'Over 60': 0})
+        self.assertEqual(river['total'], 3)
+        self.assertEqual((river['gender']['Female'], river['gender']['Male'], river['gender']['Other']), (1, 1, 0))
+        self.assertEqual((river['age']['0-14'], river['age']['15-21']), (1, 1))
+
+    def test_same_as_the_orm(self):
+        for scope, value in [('global', None), ('community', self.nairobi.communityid), ('country', 'UG'), ('country', 'XX')]:
+            self.assertEqual(crosstab(scope, value, today=date(2024, 6, 1)), orm_crosstab(scope, value, today=date(2024, 6, 1)))
+
+    def test_arrays_do_not_grow_with_the_person_ids(self):
+        # Arrays over the whole id range would take terabytes
+        person = Person.objects.create(personid=2 ** 40, communityid=self.nairobi, gender='Male', date_of_birth=date(1980, 1, 1))
+        Response.objects.create(surveyquestionid=self.choice, personid=person, responsedata=str(option_ids(self.choice)[0]))
+
+        for scope, value in [('global', None), ('community', self.nairobi.communityid)]:
+            tables = crosstab(scope, value, today=date(2024, 6, 1))
+            self.assertEqual(tables, orm_crosstab(scope, value, today=date(2024, 6, 1)))
+        self.assertEqual((tables[0]['answers'][0]['gender']['Male'], tables[0]['answers'][0]['age']['40-59']), (1, 1))
+
+    def test_endpoint(self):
+        url = reverse('get_crosstab')
+        everyone = self.client.get(url).json()
+        uganda = self.client.get(url, {'country': 'UG'}).json()
+
+        self.assertEqual([answer['total'] for answer in everyone[0]['answers']], [2, 3])
+        self.assertEqual([answer['total'] for answer in uganda[0]['answers']], [1, 0])
+        self.assertEqual(self.client.get(url, {'community': 'x'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'community': '²'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'community': 1, 'country': 'UG'}).status_code, 400)
+
+
+class SnapshotTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Kenya', code='KE')
+        cls.community = Community.objects.create(countryid=country, region='Nairobi')
+        cls.people = [
+            Person.objects.create(communityid=cls.community, gender='Female', date_of_birth=date(1990, 5, 1)),
+            Person.objects.create(communityid=cls.community),
+        ]
+        cls.water, (cls.question, cls.other) = create_survey('Water', [('Text Entry', []), ('Text Entry', [])])
+        cls.health, (cls.health_question,) = create_survey('Health', [('Text Entry', [])])
+
+    def setUp(self):
+        super().setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def respond(self, person, surveyquestion, responsedata='ok'):
+        return Response.objects.create(
+            surveyquestionid=surveyquestion, personid=person, responsedata=responsedata,
+            responsetimestamp=datetime(2024, 3, 1, 12, tzinfo=timezone.utc),
+        )
+
+    def test_columns(self):
+        first = self.respond(self.people[0], self.question, 'Borehole')
+        self.respond(None, self.other, None)
+        update_snapshot(self.path)
+        snapshot = Snapshot.open(self.path)
+
+        self.assertEqual(snapshot.rows, 2)
+        self.assertIsInstance(snapshot['responseid'], np.memmap)
+        self.assertEqual(snapshot['responseid'].tolist(), [first.responseid, first.responseid + 1])
+        self.assertEqual(snapshot['personid'].tolist(), [self.people[0].personid, 0])
+        self.assertEqual(snapshot['surveyid'].tolist(), [self.water.surveyid] * 2)
+        self.assertEqual(snapshot.values('gender').tolist(), ['Female', None])
+        self.assertEqual(snapshot.values('countrycode').tolist(), ['KE', None])
+        self.assertEqual(snapshot.values('responsedata').tolist(), ['Borehole', None])
+        self.assertEqual(str(snapshot['timestamp'][0]), '2024-03-01T12:00:00')
+        self.assertTrue(np.isnat(snapshot['date_of_birth'][1]))
+
+    def test_appends_from_the_watermark(self):
+        self.respond(self.people[0], self.question)
+        self.assertEqual(update_snapshot(self.path), 1)
+        self.respond(self.people[1], self.question)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(update_snapshot(self.path), 1)
+        self.assertEqual(update_snapshot(self.path), 0)
+
+        snapshot = Snapshot.open(self.path)
+        self.assertEqual(snapshot['personid'].tolist(), [person.personid for person in self.people])
+        self.assertEqual(snapshot.watermark, Response.objects.latest('responseid').responseid)
+        self.assertIn('"responseId" > %d' % (snapshot.watermark - 1), queries[-1]['sql'])
+
+    def test_interrupted_updates_are_discarded(self):
+        self.respond(self.people[0], self.question)
+        update_snapshot(self.path)
+        for name in ('personid.bin', 'responsedata.txt'):
+            with open(os.path.join(self.path, name), 'ab') as column:
+                column.write(b'garbage!')
+        self.respond(self.people[1], self.question, 'Tap')
+
+        update_snapshot(self.path)
+
+        snapshot = Snapshot.open(self.path)
+        self.assertEqual(snapshot['personid'].tolist(), [person.personid for person in self.people])
+        self.assertEqual(snapshot.values('responsedata').tolist(), ['ok', 'Tap'])
+
+    def test_response_data_is_appended_as_text(self):
+        self.respond(self.people[0], self.question, 'Borehole')
+        self.respond(self.people[1], self.question, None)
+        update_snapshot(self.path)
+        self.respond(self.people[1], self.other, 'Rain, “harvested”')
+
+        # Only the new text is written; there is no dictionary to load or rewrite
+        with mock.patch('api.snapshot.write_json', wraps=write_json) as written:
+            update_snapshot(self.path)
+
+        self.assertEqual([os.path.basename(call.args[0]) for call in written.call_args_list], ['meta.json'])
+        self.assertFalse(os.path.exists(os.path.join(self.path, 'responsedata.dict.json')))
+        self.assertEqual(Snapshot.open(self.path).values('responsedata').tolist(), ['Borehole', None, 'Rain, “harvested”'])
+
+    def test_rebuilds_are_swapped_in(self):
+        self.respond(self.people[0], self.question, 'Borehole')
+        update_snapshot(self.path)
+        reader = Snapshot.open(self.path)
+        personids = reader['personid']
+        self.respond(self.people[1], self.question, 'Tap')
+
+        self.assertEqual(update_snapshot(self.path, rebuild=True), 2)
+
+        # Files mapped before the rebuild stay readable
+        self.assertEqual(personids.tolist(), [self.people[0].personid])
+        self.assertEqual(Snapshot.open(self.path).values('responsedata').tolist(), ['Borehole', 'Tap'])
+        parent, name = os.path.split(self.path)
+        self.assertEqual([entry for entry in os.listdir(parent) if entry.startswith(name)], [name])
+
+    def test_survey_statistics_fall_back_when_the_snapshot_changes_underneath(self):
+        self.respond(self.people[0], self.question)
+        update_snapshot(self.path)
+        expected = self.client.get(reverse('survey_statistics')).json()
+        os.remove(os.path.join(self.path, 'personid.bin'))
+
+        with override_settings(REPORT_SNAPSHOT_DIR=self.path):
+            report_cache().clear()
+            response = self.client.get(reverse('survey_statistics'))
+
+        self.assertEqual((response.status_code, response.json()), (200, expected))
+
+    def test_survey_statistics_from_the_snapshot(self):
+        self.respond(self.people[0], self.question)
+        self.respond(self.people[0], self.other)
+        self.respond(self.people[1], self.health_question)
+        expected = self.client.get(reverse('survey_statistics')).json()
+        call_command('snapshot_responses', path=self.path, stdout=StringIO())
+        # Responses after the snapshot are read from the database
+        self.respond(self.people[1], self.question)
+        expected_after = self.client.get(reverse('survey_statistics')).json()
+
+        with override_settings(REPORT_SNAPSHOT_DIR=self.path):
+            report_cache().clear()
+            data = self.client.get(reverse('survey_statistics')).json()
+
+        self.assertEqual(expected['totalResponses'], 2)
+        self.assertEqual(data, expected_after)
+        self.assertEqual(data['totalResponses'], 3)
+
+
+class RespondentSketchTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        cls.communities = [
+            Community.objects.create(countryid=kenya, region='Nairobi'),
+            Community.objects.create(countryid=kenya, region='Mombasa'),
+        ]
+        cls.people = [
+            Person.objects.create(gender='Female', communityid=cls.communities[number % 2]) for number in range(6)
+        ] + [Person.objects.create(gender='Male')]
+        cls.water, cls.water_questions = create_survey('Water', [('Text Entry', []), ('Text Entry', [])])
+        cls.health, cls.health_questions = create_survey('Health', [('Text Entry', [])])
+
+    def respond(self, people, surveyquestions):
+        for person in people:
+            for surveyquestion in surveyquestions:
+                Response.objects.create(
+                    surveyquestionid=surveyquestion, personid=person, responsedata='ok',
+                    responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc),
+                )
+
+    def test_estimates(self):
+        first = HyperLogLog(precision=12).add_many(np.arange(1, 60001))
+        second = HyperLogLog(precision=12).add_many(np.arange(30001, 100001))
+        error = standard_error(12)
+
+        self.assertLess(abs(first.count() - 60000), 3 * error * 60000)
+        self.assertEqual(HyperLogLog.from_bytes(first.to_bytes()).add_many(np.arange(1, 60001)).count(), first.count())
+        self.assertLess(abs(first.copy().merge(second).count() - 100000), 3 * error * 100000)
+        self.assertEqual(HyperLogLog(precision=12).add_many([1, 2, 3, 2]).count(), 3)
+        with self.assertRaises(ValueError):
+            first.merge(HyperLogLog(precision=10))
+
+    def test_update_from_the_watermark(self):
+        self.respond(self.people[:4], self.water_questions)
+        self.assertEqual(update_sketches(batch_size=3), 8)
+        self.assertEqual(sketch_watermark(), Response.objects.latest('responseid').responseid)
+        self.assertEqual(Respondentsketch.objects.count(), 2)
+
+        self.respond(self.people[4:], self.health_questions)
+        self.assertEqual(update_sketches(), 3)
+        self.assertEqual(update_sketches(), 0)
+        self.assertEqual(Respondentsketch.objects.filter(communityid__isnull=True).count(), 1)
+
+        call_command('update_sketches', rebuild=True, stdout=StringIO())
+        self.assertEqual(Respondentsketch.objects.count(), 5)
+
+    def assertApproximatesExact(self, url):
+        exact = self.client.get(url).json()
+        approximate = self.client.get(url, {'approximate': 1}).json()
+
+        self.assertNotIn('approximation', exact)
+        self.assertEqual(approximate.pop('approximation'), {'approximate': True, 'standardError': 0.0163})
+        # Small sets are counted exactly
+        self.assertEqual(approximate, exact)
+
+    def test_reports(self):
+        self.respond(self.people[:5], self.water_questions)
+        update_sketches()
+        # Responses after the watermark are read from the table
+        self.respond(self.people[2:], self.health_questions)
+
+        self.assertApproximatesExact(reverse('survey_statistics'))
+        self.assertApproximatesExact(reverse('get_country', args=['KE']))
+        for community in self.communities:
+            self.assertApproximatesExact(reverse('get_community', args=[community.communityid]))
+
+    def test_global_sketches_are_merged_once_per_watermark(self):
+        self.respond(self.people[:5], self.water_questions)
+        update_sketches()
+
+        def counts():
+            with CaptureQueriesContext(connection) as queries:
+                result = survey_respondent_counts()
+            return result, len([query for query in queries if 'FROM "RespondentSketch"' in query['sql']])
+
+        self.assertEqual(counts(), ({self.water.surveyid: 5}, 1))
+        self.respond(self.people[5:], self.health_questions)
+        self.assertEqual(counts(), ({self.water.surveyid: 5, self.health.surveyid: 2}, 0))
+        update_sketches()
+        self.assertEqual(counts(), ({self.water.surveyid: 5, self.health.surveyid: 2}, 1))
+
+
+class LeaderboardTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        cls.nairobi = Community.objects.create(countryid=kenya, region='Nairobi')
+        cls.mombasa = Community.objects.create(countryid=kenya, region='Mombasa')
+        cls.kampala = Community.objects.create(countryid=Country.objects.create(name='Uganda', code='UG'), region='Kampala')
+        cls.people = {
+            community.region: [Person.objects.create(communityid=community) for _ in range(3)]
+            for community in (cls.nairobi, cls.mombasa, cls.kampala)
+        }
+        cls.water, cls.water_questions = create_survey('Water', [('Text Entry', []), ('Text Entry', [])])
+        cls.health, (cls.health_question,) = create_survey('Health', [('Text Entry', [])])
+
+    def respond(self, people, surveyquestions, day=1):
+        for person in people:
+            for surveyquestion in surveyquestions:
+                Response.objects.create(
+                    surveyquestionid=surveyquestion, personid=person, responsedata='ok',
+                    responsetimestamp=datetime(2024, 3, day, tzinfo=timezone.utc),
+                )
+
+    def counters(self):
+        return sorted(Leaderboardcounter.objects.values_list(
+            'communityid', 'surveyid', 'respondents', 'responses', 'lastresponse',
+        ), key=str)
+
+    def ranking(self, **params):
+        response = self.client.get(reverse('get_leaderboard'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_incremental_counters_match_a_rebuild(self):
+        nairobi, mombasa = self.people['Nairobi'], self.people['Mombasa']
+        self.respond(nairobi[:2], self.water_questions)
+        self.respond(mombasa[:1], [self.health_question])
+        self.assertEqual(update_leaderboard(batch_size=2), 5)
+
+        # Repeat answers to a survey, a second survey and a new respondent
+        self.respond(nairobi[:1], self.water_questions + [self.health_question], day=3)
+        self.respond(nairobi[2:], [self.health_question], day=2)
+        update_leaderboard(batch_size=3)
+
+        incremental = self.counters()
+        rebuild_leaderboard()
+        self.assertEqual(self.counters(), incremental)
+        counters = {(communityid, surveyid): values for communityid, surveyid, *values in incremental}
+        self.assertEqual(counters[self.nairobi.communityid, None][:2], [3, 4])
+        self.assertEqual(counters[self.nairobi.communityid, self.water.surveyid][:2], [2, 2])
+        self.assertEqual(counters[self.nairobi.communityid, self.health.surveyid][:2], [2, 2])
+        self.assertEqual(counters[self.nairobi.communityid, None][2], datetime(2024, 3, 3, tzinfo=timezone.utc))
+
+    def test_top_and_rank(self):
+        self.respond(self.people['Nairobi'][:1], [self.health_question], day=5)
+        self.respond(self.people['Mombasa'], self.water_questions[:1])
+        self.respond(self.people['Kampala'][:2], self.water_questions[:1] + [self.health_question])
+        update_leaderboard()
+
+        data = self.ranking(limit=2)
+        self.assertEqual(data['communities'], 3)
+        self.assertEqual(
+            [(entry['rank'], entry['region'], entry['responses']) for entry in data['top']],
+            [(1, 'Kampala', 4), (2, 'Mombasa', 3)],
+        )
+        self.assertEqual(data['top'][0]['responseRate'], 100.0)
+
+        data = self.ranking(metric='recent', limit=1, community=self.kampala.communityid)
+        self.assertEqual([entry['region'] for entry in data['top']], ['Nairobi'])
+        # Ties go to the lower community id
+        self.assertEqual(data['community']['rank'], 3)
+
+        data = self.ranking(country='KE', survey=self.water.surveyid)
+        self.assertEqual([entry['region'] for entry in data['top']], ['Mombasa'])
+        data = self.ranking(metric='responseRate', survey=self.health.surveyid, community=self.mombasa.communityid)
+        self.assertEqual([entry['region'] for entry in data['top']], ['Nairobi', 'Kampala'])
+        self.assertIsNone(data['community'])
+
+    def test_refresh_reloads_changed_communities(self):
+        self.respond(self.people['Nairobi'][:2], [self.health_question])
+        self.respond(self.people['Mombasa'][:1], [self.health_question])
+        update_leaderboard()
+        self.assertEqual(leaderboard.top(metric='respondents')['top'][0]['region'], 'Nairobi')
+
+        self.respond(self.people['Mombasa'][1:], [self.health_question])
+        update_leaderboard()
+        with CaptureQueriesContext(connection) as queries:
+            data = leaderboard.top(metric='respondents', community=self.nairobi.communityid)
+        counters = [query['sql'] for query in queries.captured_queries if 'LeaderboardCounter' in query['sql']]
+        self.assertEqual(len(counters), 1)
+        self.assertEqual(Leaderboardcounter.objects.filter(communityid=self.mombasa).count(), 2)
+        self.assertEqual(
+            [(entry['region'], entry['respondents']) for entry in data['top']],
+            [('Mombasa', 3), ('Nairobi', 2)],
+        )
+        self.assertEqual(data['community']['rank'], 2)
+
+    def test_cached_until_the_counters_move(self):
+        self.respond(self.people['Nairobi'][:1], [self.health_question])
+        update_leaderboard()
+        self.assertEqual(self.client.get(reverse('get_leaderboard'))['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(reverse('get_leaderboard'))['X-Cache'], 'HIT')
+
+        self.respond(self.people['Mombasa'][:2], [self.health_question])
+        self.assertEqual(self.client.get(reverse('get_leaderboard'))['X-Cache'], 'HIT')
+        call_command('update_leaderboard', stdout=StringIO())
+        response = self.client.get(reverse('get_leaderboard'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['top'][0]['region'], 'Mombasa')
+
+    def test_rebuilds_reach_running_processes_and_the_cache(self):
+        person = self.people['Nairobi'][0]
+        self.respond([person], [self.health_question])
+        update_leaderboard()
+        self.assertEqual(self.ranking(country='KE')['top'][0]['region'], 'Nairobi')
+
+        # A rebuild ends at the same watermark
+        Person.objects.filter(personid=person.personid).update(communityid=self.mombasa)
+        call_command('update_leaderboard', rebuild=True, stdout=StringIO())
+
+        response = self.client.get(reverse('get_leaderboard'), {'country': 'KE'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual([entry['region'] for entry in response.json()['top']], ['Mombasa'])
+        self.assertEqual(leaderboard.top()['communities'], 1)
+
+    def test_counts_responses_not_ids(self):
+        self.respond(self.people['Nairobi'][:2], [self.health_question])
+        Response.objects.order_by('responseid').first().delete()
+        # Nobody to count towards a community
+        self.respond([Person.objects.create()], [self.health_question])
+        self.respond(self.people['Kampala'][:1], [self.health_question])
+
+        self.assertEqual(update_leaderboard(batch_size=2), 2)
+
+    def test_rankings_are_kept_for_known_countries_and_surveys_only(self):
+        self.respond(self.people['Nairobi'][:1], [self.health_question])
+        update_leaderboard()
+
+        for params in ({'country': 'ZZ'}, {'country': 'Kenya'}, {'survey': 99999}, {'country': 'KE', 'survey': 99999}):
+            data = self.ranking(**params)
+            self.assertEqual((data['communities'], data['top']), (0, []))
+        self.assertEqual(self.ranking(country='KE')['communities'], 1)
+        self.assertEqual(set(leaderboard.rankings), {('KE', None, 'responses')})
+
+    def test_invalid_parameters(self):
+        for params in ({'metric': 'size'}, {'limit': '0'}, {'survey': 'water'}, {'community': 'x'}):
+            response = self.client.get(reverse('get_leaderboard'), params)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('error', response.json())
+
+
+class ExportTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.kenya = Country.objects.create(name='Kenya', code='KE')
+        uganda = Country.objects.create(name='Uganda', code='UG')
+        cls.nairobi = Community.objects.create(countryid=cls.kenya, region='Nairobi')
+        kampala = Community.objects.create(countryid=uganda, region='Kampala')
+        cls.survey, (surveyquestion,) = create_survey('Food', [('Text Entry', [])])
+        cls.responses = [
+            Response.objects.create(
+                surveyquestionid=surveyquestion,
+                personid=Person.objects.create(gender='Female', communityid=community),
+                responsedata=answer,
+                responsetimestamp=datetime(2024, 3, day, tzinfo=timezone.utc),
+            )
+            for community, answer, day in [(cls.nairobi, 'Maize', 1), (kampala, 'Matoke', 2), (cls.nairobi, 'Beans', 3)]
+        ]
+
+    def setUp(self):
+        super().setUp()
+        self.client.defaults['HTTP_AUTHORIZATION'] = 'Bearer %s' % settings.EXPORT_TOKEN
+
+    def export(self, **params):
+        response = self.client.get(reverse('export_responses'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_token_required(self):
+        url = reverse('export_responses')
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='').status_code, 401)
+        with override_settings(EXPORT_TOKEN=None):
+            self.assertEqual(self.client.get(url).status_code, 403)
+
+    def test_ndjson(self):
+        response, content = self.export(country='KE')
+        rows = [json.loads(line) for line in content.splitlines()]
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual([row['responseData'] for row in rows], ['Maize', 'Beans'])
+        self.assertEqual(rows[0]['countryName'], 'Kenya')
+        self.assertEqual(rows[0]['surveyId'], self.survey.surveyid)
+
+    def test_csv_with_cursor_and_range(self):
+        _, content = self.export(format='csv', after=self.responses[0].responseid, until='2024-03-03')
+        header, *rows = list(csv.reader(content.splitlines()))
+
+        self.assertEqual(header[:3], ['responseId', 'responseData', 'responseTimestamp'])
+        self.assertEqual([row[1] for row in rows], ['Matoke'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(reverse('export_responses'), {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_responses'), {'since': 'yesterday'}).status_code, 400)
+
+    def test_command(self):
+        output = StringIO()
+        call_command('export_responses', community=str(self.nairobi.communityid), chunk_size=1, stdout=output)
+
+        self.assertEqual([json.loads(line)['responseData'] for line in output.getvalue().splitlines()], ['Maize', 'Beans'])
+
+
+class BenchmarkTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.responses = generate_dataset(seed=1, **SCALES['tiny'])
+
+    def test_dataset_is_seeded(self):
+        self.assertGreater(self.responses, 0)
+        self.assertEqual(Response.objects.count(), self.responses)
+        self.assertEqual(Community.objects.count(), 4)
+
+    def test_query_budgets(self):
+        results = run_benchmark(iterations=2)
+
+        self.assertEqual(set(results), {
+            'get_community', 'get_communities', 'survey_statistics', 'get_countries', 'get_country', 'get_crosstab',
+        })
+        self.assertEqual(check_budgets(results, load_budgets()['tiny'], latency=False), [])
+
+    def test_crosstab_comparison(self):
+        self.assertEqual(set(run_crosstab_benchmark(iterations=1)), {'crosstab_numpy', 'crosstab_orm'})
+
+    def test_budget_violations(self):
+        results = {'get_country': {'queries': 12, 'p50_ms': 1.0, 'p95_ms': 90.0}}
+        budgets = {'get_country': {'queries': 10, 'p95_ms': 50}}
+
+        self.assertEqual(len(check_budgets(results, budgets)), 2)
+        self.assertEqual(len(check_budgets(results, budgets, latency=False)), 1)
+
+
+class IndexAdvisorTests(ReportTestCase):
+
+    SHOWPLAN = """<ShowPlanXML xmlns="http://schemas.microsoft.com/sqlserver/2004/07/showplan"><BatchSequence><Batch>
+        <Statements><StmtSimple><QueryPlan>
+          <MissingIndexes><MissingIndexGroup Impact="87.5">
+            <MissingIndex Database="[db]" Schema="[dbo]" Table="[Response]">
+              <ColumnGroup Usage="EQUALITY"><Column Name="[personId]" ColumnId="3"/></ColumnGroup>
+              <ColumnGroup Usage="INCLUDE"><Column Name="[surveyQuestionId]" ColumnId="2"/></ColumnGroup>
+            </MissingIndex>
+          </MissingIndexGroup></MissingIndexes>
+          <RelOp PhysicalOp="Clustered Index Scan" LogicalOp="Clustered Index Scan">
+            <IndexScan><Object Database="[db]" Schema="[dbo]" Table="[Response]" Index="[PK_Response]"/></IndexScan>
+          </RelOp>
+          <RelOp PhysicalOp="Clustered Index Seek" LogicalOp="Clustered Index Seek">
+            <IndexScan><Object Database="[db]" Schema="[dbo]" Table="[Person]" Index="[PK_Person]"/></IndexScan>
+          </RelOp>
+        </QueryPlan></StmtSimple></Statements>
+    </Batch></BatchSequence></ShowPlanXML>"""
+
+    @classmethod
+    def setUpTestData(cls):
+        generate_dataset(seed=1, **SCALES['tiny'])
+
+    def test_sqlite_scans(self):
+        self.assertEqual(sqlite_scans(*Response.objects.filter(responsedata='x').query.sql_with_params()), ['Response'])
+        self.assertEqual(sqlite_scans(*Response.objects.filter(pk=1).query.sql_with_params()), [])
+
+    def test_showplan(self):
+        scans, suggestions = showplan_scans(self.SHOWPLAN)
+
+        self.assertEqual(scans, ['Response'])
+        self.assertEqual(suggestions, [(87.5, 'Response', ['personId'], ['surveyQuestionId'])])
+        self.assertEqual(
+            index_ddl('Response', ['personId'], ['surveyQuestionId']),
+            'CREATE NONCLUSTERED INDEX [IX_Response_personId] ON [dbo].[Response] ([personId]) INCLUDE ([surveyQuestionId])',
+        )
+
+    def test_advise(self):
+        # Like the legacy schema, with primary keys only
+        drop_secondary_indexes(['Response', 'Person'])
+        url = benchmark_urls()['get_country']
+
+        advice = advise({'get_country': url}, min_rows=0, min_benefit=None, repeat=1)['get_country']
+
+        self.assertEqual(advice['url'], url)
+        self.assertIn('Response', {scan['table'] for scan in advice['scans']})
+        self.assertIn(
+            index_ddl('Response', ['personId'], ['surveyQuestionId', 'responseTimestamp']),
+            [proposal['ddl'] for proposal in advice['proposals']],
+        )
+        # Candidate indexes are dropped again
+        self.assertEqual(sqlite_scans(*Response.objects.filter(personid=1).query.sql_with_params()), ['Response'])
+
+    def test_advise_leaves_the_report_cache_alone(self):
+        url = benchmark_urls()['get_communities']
+        report_cache().set('unrelated', 'kept')
+        self.client.get(url)
+
+        advice = advise({'get_communities': url}, min_rows=0, min_benefit=None, repeat=1)['get_communities']
+
+        self.assertGreater(advice['queries'], 0)
+        self.assertEqual(report_cache().get('unrelated'), 'kept')
+        self.assertEqual(self.client.get(url)['X-Cache'], 'HIT')
+
+    def test_sql_server_needs_the_database_named(self):
+        database = mock.Mock(vendor='microsoft', settings_dict={'NAME': 'GlobalSurveyTool'})
+        command = 'api.management.commands.advise_indexes'
+        with mock.patch(command + '.connection', database), mock.patch(command + '.advise', return_value={}) as advised:
+            for name in (None, 'other'):
+                with self.assertRaisesMessage(CommandError, '--database GlobalSurveyTool'):
+                    call_command('advise_indexes', database=name, stdout=StringIO())
+            advised.assert_not_called()
+
+            call_command('advise_indexes', database='GlobalSurveyTool', stdout=StringIO())
+        advised.assert_called_once()
+
+
+class PerformanceMiddlewareTests(ReportTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        country = Country.objects.create(name='Kenya', code='KE')
+        Person.objects.create(gender='Male', date_of_birth=date(1990, 1, 1), communityid=Community.objects.create(
+            countryid=country, region='Nairobi',
+        ))
+
+    def setUp(self):
+        super().setUp()
+        registry.reset()
+
+    def test_server_timing(self):
+        response = self.client.get(reverse('get_countries'))
+
+        timings = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timings), {'db', 'view', 'serialize', 'total'})
+        self.assertRegex(timings['db'], r'desc="\d+ queries"')
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('get_countries'))
+        self.client.get(reverse('get_countries'))
+        content = self.client.get(reverse('metrics')).content.decode()
+
+        self.assertIn('api_request_duration_seconds_count{route="get_countries"} 2', content)
+        self.assertIn('api_request_queries_bucket{route="get_countries",le="+Inf"} 2', content)
+        self.assertIn('api_report_cache_hits_total{view="get_countries"} 1', content)
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_timed(self):
+        response = self.client.get(reverse('get_countries'))
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('route="get_countries"', registry.render())
+
+    def test_slowest_statements_are_kept(self):
+        metrics = RequestMetrics(slow_queries=2)
+        for duration in (0.1, 0.5, 0.2, 0.05):
+            metrics.record_query('SELECT %s' % duration, duration)
+
+        self.assertEqual(metrics.queries, 4)
+        self.assertEqual([sql for _, sql in metrics.statements], ['SELECT 0.5', 'SELECT 0.2'])
+
+    def test_queries_of_streaming_responses_are_counted_once_sent(self):
+        response = self.client.get(reverse('export_responses'), HTTP_AUTHORIZATION='Bearer %s' % settings.EXPORT_TOKEN)
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('route="export_responses"', registry.render())
+
+        # The test client closes the response once its content is read
+        b''.join(response.streaming_content)
+        content = registry.render()
+        self.assertIn('api_request_queries_count{route="export_responses"} 1', content)
+        self.assertNotIn('api_request_queries_sum{route="export_responses"} 0.0', content)
+
+
+class AsyncReportTests(TransactionTestCase):
+    # Sections run on other threads, so the data has to be committed
+
+    def setUp(self):
+        report_cache().clear()
+        catalog.reset()
+        conversations.reset()
+        country = Country.objects.create(name='Kenya', code='KE')
+        self.community = Community.objects.create(countryid=country, region='Nairobi')
+        person = Person.objects.create(gender='Female', date_of_birth=date(1990, 1, 1), communityid=self.community)
+        for title in ('Water', 'Health', 'Education'):
+            _, (surveyquestion,) = create_survey(title, [('Multiple Choice', ['Yes', 'No'])])
+            Response.objects.create(
+                surveyquestionid=surveyquestion, personid=person, responsedata=str(option_ids(surveyquestion)[0]),
+                responsetimestamp=datetime(2024, 3, 1, tzinfo=timezone.utc),
+            )
+
+    def assertSamePayload(self, view, url_name, *args):
+        async_response = async_to_sync(view)(AsyncRequestFactory().get('/'), *args)
+        report_cache().clear()
+        sync_response = self.client.get(reverse(url_name, args=args))
+
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(json.loads(async_response.content), sync_response.json())
+
+    def test_community(self):
+        self.assertSamePayload(async_views.get_community, 'get_community', self.community.communityid)
+        self.assertSamePayload(async_views.get_community, 'get_community', 0)
+
+    def test_country(self):
+        self.assertSamePayload(async_views.get_country, 'get_country', 'KE')
+        self.assertSamePayload(async_views.get_country, 'get_country', 'XX')
+
+    def test_survey_statistics(self):
+        self.assertSamePayload(async_views.survey_statistics, 'survey_statistics')
+
+    def test_concurrency_is_bounded(self):
+        lock = threading.Lock()
+        running = []
+        peak = []
+
+        def section(value):
+            with lock:
+                running.append(value)
+                peak.append(len(running))
+            time.sleep(0.01)
+            with lock:
+                running.remove(value)
+            return value
+
+        results = run_concurrently([partial(section, value) for value in range(12)])
+
+        self.assertEqual(results, list(range(12)))
+        self.assertLessEqual(max(peak), settings.REPORT_CONCURRENCY)
+        self.assertGreater(max(peak), 1)
+
+    def test_queries_on_the_pool_count_towards_the_request(self):
+        metrics = RequestMetrics()
+        with wrapped_queries(metrics):
+            run_concurrently([Country.objects.count, Community.objects.count, Person.objects.count])
+        run_concurrently([Country.objects.count])
+
+        self.assertEqual(metrics.queries, 3)
+
+    @override_settings(REPORT_CONNECTION_MAX_AGE=300)
+    def test_pool_threads_keep_their_connections(self):
+        def database_connection(opened, errors=False, usable=True):
+            database = mock.Mock(
+                connection=object(), in_atomic_block=False, errors_occurred=errors,
+                close_at=opened, settings_dict={'CONN_MAX_AGE': 0},
+            )
+            database.is_usable.return_value = usable
+            return database
+
+        now = time.monotonic()
+        current = database_connection(now)
+        recovered = database_connection(now, errors=True)
+        broken = database_connection(now, errors=True, usable=False)
+        old = database_connection(now - 600)
+        with mock.patch('api.concurrency.connections') as handler:
+            handler.all.return_value = [current, recovered, broken, old]
+            self.assertEqual(run_in_connection(lambda: 'done'), 'done')
+
+        current.close.assert_not_called()
+        recovered.close.assert_not_called()
+        self.assertFalse(recovered.errors_occurred)
+        broken.close.assert_called_once_with()
+        old.close.assert_called_once_with()
+
+
+class WarmReportsTests(TransactionTestCase):
+    # Reports are computed on other threads, so the data has to be committed
+
+    def setUp(self):
+        # Warming refuses caches the web workers cannot read
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        shared = override_settings(CACHES={
+            **settings.CACHES,
+            settings.REPORT_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory},
+        })
+        shared.enable()
+        self.addCleanup(shared.disable)
+        report_cache().clear()
+        catalog.reset()
+        conversations.reset()
+        kenya = Country.objects.create(name='Kenya', code='KE')
+        uganda = Country.objects.create(name='Uganda', code='UG')
+        self.communities = [
+            Community.objects.create(countryid=kenya, region='Nairobi'),
+            Community.objects.create(countryid=kenya, region='Mombasa'),
+            Community.objects.create(countryid=uganda, region='Kampala'),
+        ]
+        _, (surveyquestion,) = create_survey('Water', [('Text Entry', [])])
+        for day, community in [(1, self.communities[0]), (3, self.communities[2])]:
+            Response.objects.create(
+                surveyquestionid=surveyquestion, responsedata='ok',
+                personid=Person.objects.create(communityid=community),
+                responsetimestamp=datetime(2024, 3, day, tzinfo=timezone.utc),
+            )
+
+    def test_paths(self):
+        ids = [community.communityid for community in self.communities]
+        community_paths = [reverse('get_community', args=[communityid]) for communityid in ids]
+
+        self.assertEqual(
+            warm_paths(),
+            community_paths + [reverse('get_country', args=[code]) for code in ('KE', 'UG')],
+        )
+        self.assertEqual(
+            warm_paths(recent_first=True, countries=False),
+            [community_paths[2], community_paths[0], community_paths[1]],
+        )
+        self.assertEqual(
+            warm_paths(recent_first=True, communities=False),
+            [reverse('get_country', args=[code]) for code in ('UG', 'KE')],
+        )
+
+    def test_warm_reports(self):
+        output = StringIO()
+        call_command('warm_reports', workers=3, stdout=output)
+        self.assertIn('Warmed 5 reports (5 computed, 0 already cached)', output.getvalue())
+
+        for community in self.communities:
+            response = self.client.get(reverse('get_community', args=[community.communityid]))
+            self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('get_country', args=['UG']))['X-Cache'], 'HIT')
+
+        output = StringIO()
+        call_command('warm_reports', only='countries', recent_first=True, limit=1, stdout=output)
+        self.assertIn('Warmed 1 reports (0 computed, 1 already cached)', output.getvalue())
+
+    def test_a_shared_cache_is_needed(self):
+        local = {**settings.CACHES, settings.REPORT_CACHE_ALIAS: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=local):
+            for processes in (False, True):
+                with self.assertRaisesMessage(CommandError, 'shared with the web workers, not LocMemCache'):
+                    call_command('warm_reports', processes=processes, stdout=StringIO())
+
+    def test_async_views(self):
+        path = reverse('get_community', args=[self.communities[0].communityid])
+        match = ResolverMatch(async_views.get_community, (), {'communityid': self.communities[0].communityid})
+
+        with mock.patch('api.warming.resolve', return_value=match):
+            self.assertEqual(warm_report(path)[1:3], (200, 'MISS'))
+        self.assertEqual(self.client.get(path)['X-Cache'], 'HIT')
+
+
+class LoadTestTests(TransactionTestCase):
+    # Requests are made from other threads, so the data has to be committed
+
+    def setUp(self):
+        report_cache().clear()
+        catalog.reset()
+        conversations.reset()
+        leaderboard.reset()
+        generate_dataset(seed=1, **SCALES['tiny'])
+
+    def test_plan_is_seeded(self):
+        plan = request_plan(DEFAULT_MIX, 200, seed=3)
+
+        self.assertEqual(plan, request_plan(DEFAULT_MIX, 200, seed=3))
+        self.assertEqual(len(plan), 200)
+        self.assertEqual({route for route, _ in plan}, {route for route, weight in DEFAULT_MIX.items() if weight})
+        for route, url in plan:
+            self.assertEqual(resolve(url.partition('?')[0]).url_name, route)
+
+    def test_mix(self):
+        mix = parse_mix('get_community=3, get_country=1')
+        self.assertEqual({route: weight for route, weight in mix.items() if weight}, {'get_community': 3, 'get_country': 1})
+
+        for value in ('get_everything=1', 'get_community=x', 'get_community=-1', 'get_community=0'):
+            with self.assertRaises(LoadTestError):
+                parse_mix(value)
+
+    def test_run_load_test(self):
+        plan = request_plan(parse_mix('get_community=2,get_country=1,metrics=1'), 30, seed=1)
+        results = run_load_test(plan, workers=4, warmup=6)
+
+        self.assertEqual(results['requests'], 24)
+        self.assertEqual(results['errors'], 0)
+        self.assertEqual(sum(route['requests'] for route in results['routes'].values()), 24)
+        self.assertGreater(results['rps'], 0)
+        for route in results['routes'].values():
+            self.assertLessEqual(route['p50_ms'], route['p95_ms'])
+            self.assertLessEqual(route['p95_ms'], route['p99_ms'])
+        self.assertGreater(results['routes']['get_community']['queries_max'], 0)
+        self.assertEqual(results['routes']['metrics']['queries_max'], 0)
+
+    def test_compare_results(self):
+        baseline = {'rps': 100, 'p95_ms': 20.0, 'routes': {'get_community': {'rps': 50, 'p95_ms': 10.0}}}
+        results = {
+            'rps': 120, 'p95_ms': 15.0,
+            'routes': {'get_community': {'rps': 40, 'p95_ms': 12.0}, 'get_country': {'rps': 1, 'p95_ms': 1.0}},
+        }
+
+        self.assertEqual(compare_results(results, baseline), {
+            'total': {'rps_change_pct': 20.0, 'p95_change_pct': -25.0},
+            'get_community': {'rps_change_pct': -20.0, 'p95_change_pct': 20.0},
+        })
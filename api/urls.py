@@ -1,15 +1,37 @@
+from django.conf import settings
 from django.urls import path
 from .views import get_community
 from .views import get_communities
+from .views import get_text_answers
 from .views import survey_statistics
 from .views import get_country
 from .views import get_countries
+from .views import get_reports
+from .views import get_timeseries
+from .views import get_leaderboard
+from .views import get_crosstab
+from .views import export_responses
+from .views import metrics
+from .views import ingest
+
+if settings.ASYNC_REPORT_VIEWS:
+    from .async_views import get_community
+    from .async_views import survey_statistics
+    from .async_views import get_country
 
 urlpatterns = [
     # Add other URL patterns if needed
     path('community/<int:communityid>/', get_community, name='get_community'),
+    path('community/<int:communityid>/answers/<int:surveyquestionid>/', get_text_answers, name='get_text_answers'),
     path('communities', get_communities, name='get_communities'),
     path('surveys', survey_statistics, name='survey_statistics'),
     path('countries', get_countries, name='get_countries'),
     path('country/<str:countrycode>/', get_country, name='get_country'),
+    path('reports', get_reports, name='get_reports'),
+    path('crosstab', get_crosstab, name='get_crosstab'),
+    path('timeseries', get_timeseries, name='get_timeseries'),
+    path('leaderboard', get_leaderboard, name='get_leaderboard'),
+    path('export', export_responses, name='export_responses'),
+    path('metrics', metrics, name='metrics'),
+    path('ingest', ingest, name='ingest'),
 ]
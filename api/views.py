@@ -1,316 +1,264 @@
+import json
+
 from django.shortcuts import render
 from collections import Counter
 
-from django.http import JsonResponse
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from .models import *
-from django.db.models import Max
-from datetime import date, timedelta
-
-def calculate_gender_composition(queryset):
-
-    genders = ['Male', 'Female', 'Other', 'I prefer not to say']
-    gender_composition = {}
-    respondents = 1
-
-    for gender in genders:
-        count = queryset.filter(gender=gender).count()
-        gender_composition[gender] =  round((count/respondents) * 100, 1) if respondents else 0
-    
-    return gender_composition
-
-def calculate_age(birthdate):
-
-    today = date.today()
-    return today.year - birthdate.year - ((today.month, today.day) < (birthdate.month, birthdate.day))
-
-def calculate_age_composition(queryset):
-
-    respondents = queryset.count()
-
-    # Initialize age counts
-    age_counts = {
-        '0-14': 0,
-        '15-21': 0,
-        '22-29': 0,
-        '30-39': 0,
-        '40-59': 0,
-        'Over 60': 0,
-    }
-
-    # Calculate ages and increment corresponding age range counts
-    for person in queryset:
-        age = calculate_age(person.date_of_birth)
-        if age <= 14:
-            age_counts['0-14'] += 1
-        elif 15 <= age <= 21:
-            age_counts['15-21'] += 1
-        elif 22 <= age <= 29:
-            age_counts['22-29'] += 1
-        elif 30 <= age <= 39:
-            age_counts['30-39'] += 1
-        elif 40 <= age <= 59:
-            age_counts['40-59'] += 1
-        else:  # Over 60
-            age_counts['Over 60'] += 1
-
-    age_composition = {age_range: round((count / respondents) * 100, 1) if respondents else 0 for age_range, count in age_counts.items()}
-
-    return age_composition
-
+from .routers import replica_reads
+from .cache import cached_report
+from .crosstab import crosstab
+from .metrics import TimedJSONEncoder, registry
+from .activity import ActivityError, activity_filters, activity_series
+from .fields import FieldError, requested_fields
+from .leaderboard import LeaderboardError, leaderboard, leaderboard_filters
+from .export import FORMATS, ExportError, export_filters, export_lines, export_rows
+from .ingest import IngestError, ingest_messages, ingest_queue, parse_messages
+from .pagination import PaginationError, cursor, flag, page_size, page_url
+from .reports import (
+    BatchError, batch_filters, communities_page, community_report, community_reports, countries_report,
+    country_report, country_reports, statistics_report, text_answer_limit, text_answers_page,
+)
+
+@replica_reads
+@cached_report('community', 'communityid')
 def get_community(request, communityid):
-    
+
+    try:
+        text_limit = page_size(request, text_answer_limit(), name='answers')
+        fields = requested_fields(request)
+    except (PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
     try:
-        respondents = Person.objects.filter(communityid=communityid).count()
-
-        most_recent_response = Response.objects.filter(
-            personid__communityid=communityid
-        ).aggregate(response_timestamp=Max('responsetimestamp'))['response_timestamp']
-
-        survey_data = []
-        
-        surveys = Survey.objects.all()
-
-        for survey in surveys:
-            unique_respondents_count = Response.objects.filter(
-                surveyquestionid__surveyid=survey.surveyid, 
-                personid__communityid=communityid
-            ).values('personid').distinct().count()
-
-            person_ids = Person.objects.filter(communityid=communityid).values_list('personid', flat=True)
-
-            number_of_responses = Response.objects.filter(
-                surveyquestionid__surveyid=survey.surveyid,  # Assuming surveyquestion_ids is a list of relevant survey question IDs
-                personid__in=person_ids
-            ).values(
-                'personid', 'surveyquestionid__surveyid'  # This fetches the surveyid through the surveyquestionid foreign key
-            ).distinct().count()
-
-            response_rate = round((number_of_responses/respondents)*100, 1) if respondents else 0
-
-            def retrieve_answers(surveyquestionid, question_type):
-            
-                # Filter responses by surveyquestionid and personid being in the list of person_ids
-                responses = Response.objects.filter(surveyquestionid=surveyquestionid, personid__in=person_ids)
-                
-                # For multiple choice questions, use a counter to tally option selections
-                if question_type == 'Multiple Choice':
-                    # Initialize a counter to keep track of option selections
-                    frequency = Counter()
-
-                    for response in responses:
-                        selected_options = response.responsedata.split(',')
-                        frequency.update(selected_options)
-
-                    # Convert option IDs back to their texts
-                    option_ids = [int(option_id) for option_id in frequency.keys()]
-                    selected_options = Option.objects.filter(optionid__in=option_ids)
-                    option_text = {option.optionid: option.optiontext for option in selected_options}
-
-                    # Prepare the answer list using the counter and option texts
-                    answers = [{'answer': option_text[int(option_id)], 'total': count} for option_id, count in frequency.items()]
-                else:
-                    answers = [{'answer': response.responsedata, 'total': 1} for response in responses]
-
-                return answers
-
-            questiondict = []
-            surveyquestions = Surveyquestion.objects.filter(surveyid=survey.surveyid)
-
-            for surveyquestion in surveyquestions:
-                question = surveyquestion.questionid
-                question_id = question.questionid
-                options_count = Questionoption.objects.filter(questionid=question_id).count()
-
-                if question.type == 'Text Entry':
-                    chartType = 'text'
-                elif options_count <= 4:
-                    chartType = 'bar'
-                else:
-                    chartType = 'pie'
-
-                question_dict = {
-                    'questionid': question_id,
-                    'question': question.question,
-                    'chartType': chartType,
-                    'answers':retrieve_answers(surveyquestion.surveyquestionid, question.type),
-                }
-                questiondict.append(question_dict)
-
-            survey_dict = {
-                'surveyid': survey.surveyid,
-                'title': survey.title,
-                'description': survey.description,
-                'responseRate': response_rate,
-                'responses': questiondict,
-            }
-            survey_data.append(survey_dict)
-
-        community = Community.objects.get(communityid=communityid)
-        gender_composition = calculate_gender_composition(Person.objects.filter(communityid=communityid))
-        age_composition = calculate_age_composition(Person.objects.filter(communityid=communityid))
-        
-        data = {
-            'communityInfo': {
-                'id': communityid,
-                'region': community.region,
-                'country': community.countryid.name,
-                'responders': respondents,
-                'lastResponseDate': most_recent_response,
-                'genderRatio': {
-                    'male': gender_composition['Male'],
-                    'female': gender_composition['Female'],                    
-                },
-                'ageDistribution': [
-                    {'ageGroup': '0-14', 'percentage': age_composition['0-14']},
-                    {'ageGroup': '15-21', 'percentage': age_composition['15-21']},
-                    {'ageGroup': '22-29', 'percentage': age_composition['22-29']},
-                    {'ageGroup': '30-39', 'percentage': age_composition['30-39']},
-                    {'ageGroup': '40-59', 'percentage': age_composition['40-59']},
-                    {'ageGroup': '60+', 'percentage': age_composition['Over 60']},
-                ],
-            },
-            'surveyInfo': survey_data,
-        }
-
-        return JsonResponse(data)
+        data = community_report(
+            communityid, text_limit=text_limit, group_text=flag(request, 'group_text'),
+            approximate=flag(request, 'approximate'), fields=fields,
+        )
+        return JsonResponse(data, encoder=TimedJSONEncoder)
 
     except Community.DoesNotExist:
         return JsonResponse({'error': 'Community not found'}, status=404)
-    
-def get_communities(request):
 
-    communities = Community.objects.select_related('countryid').all() 
-    data = [
-        {"id": community.communityid, "region": community.region, "country": community.countryid.name}
-        for community in communities
-    ]
+@replica_reads
+@cached_report('community', 'communityid')
+def get_text_answers(request, communityid, surveyquestionid):
+
+    try:
+        after = cursor(request)
+        limit = page_size(request, text_answer_limit())
+        fields = requested_fields(request)
+    except (PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
 
-    return JsonResponse(data, safe=False)
+    data = text_answers_page(communityid, surveyquestionid, after, limit)
+    return JsonResponse(fields.apply(data), encoder=TimedJSONEncoder)
+
+@cached_report('communities')
+def get_communities(request):
 
+    try:
+        after = cursor(request)
+        limit = page_size(request, getattr(settings, 'COMMUNITY_PAGE_SIZE', 100))
+        fields = requested_fields(request)
+    except (PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    data, next_cursor = communities_page(after, limit)
+    response = JsonResponse(fields.apply(data), safe=False, encoder=TimedJSONEncoder)
+    if next_cursor is not None:
+        response['Link'] = '<%s>; rel="next"' % request.build_absolute_uri(page_url(request.path, next_cursor, limit=limit))
+    return response
+
+@replica_reads
+@cached_report('global')
 def survey_statistics(request):
 
-    all_people = Person.objects.all()
-    age_composition = calculate_age_composition(all_people)
-    total_responses = Response.objects.all().count()
-    
-    number_of_responses = 0
-    for survey in Survey.objects.all():
-        number_of_responses += Response.objects.filter(
-            surveyquestionid__surveyid=survey.surveyid, 
-            personid__in=all_people
-        ).values(
-            'personid', 'surveyquestionid__surveyid'  # This fetches the surveyid through the surveyquestionid foreign key
-        ).distinct().count()
-
-    number_of_countries = Person.objects.values_list('communityid__countryid', flat=True).distinct().count()
-
-    statistics = {
-        'totalResponses': number_of_responses,
-        'totalRespondants': all_people.count(),
-        'numberofCountries': number_of_countries,
-        'ageDistribution': [
-            {'ageGroup': '0-14', 'percentage': age_composition['0-14']},
-            {'ageGroup': '15-21', 'percentage': age_composition['15-21']},
-            {'ageGroup': '22-29', 'percentage': age_composition['22-29']},
-            {'ageGroup': '30-39', 'percentage': age_composition['30-39']},
-            {'ageGroup': '40-59', 'percentage': age_composition['40-59']},
-            {'ageGroup': '60+', 'percentage': age_composition['Over 60']},
-        ],
-    }
-
-    return JsonResponse(statistics, safe=False)
+    try:
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    data = statistics_report(approximate=flag(request, 'approximate'), fields=fields)
+    return JsonResponse(data, safe=False, encoder=TimedJSONEncoder)
 
+@replica_reads
+@cached_report('global')
 def get_countries(request):
-    countryList = []
-
-    # Get all country IDs that exist in the Community table
-    country_ids = Community.objects.values_list('countryid', flat=True).distinct()
-    # Use those IDs to filter Country instances
-    countries = Country.objects.filter(countryid__in=country_ids)
-
-    for country in countries:
-        communities = Community.objects.filter(countryid=country.countryid)
-        respondents = 0
-        for community in communities:
-            respondents += Person.objects.filter(communityid=community.communityid).count()        
-        
-        countryInfo = {
-            'code': country.code,
-            'country': country.name,
-            'latitude': country.latitude, 
-            'longitude': country.longitude, 
-            'regionNumber': country.countryid, 
-            'respondants': respondents,
-        }
-
-        countryList.append(countryInfo)
-
-    return JsonResponse(countryList, safe=False)
 
+    try:
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    return JsonResponse(countries_report(fields), safe=False, encoder=TimedJSONEncoder)
+
+@replica_reads
+@cached_report('country', 'countrycode')
 def get_country(request, countrycode):
 
     try:
-        
-        country = Country.objects.get(code=countrycode)
-        number_of_regions = Community.objects.filter(countryid=country.countryid).distinct().count()
-        
-        community_ids = Community.objects.filter(countryid=country.countryid).values_list('communityid', flat=True)
-        respondents = 0
-        for community in Community.objects.filter(communityid__in=community_ids):
-            respondents += Person.objects.filter(communityid=community.communityid).count()   
-        
-        people = Person.objects.filter(communityid__in=community_ids)
-        age_composition = calculate_age_composition(people)
-        most_recent_response = Response.objects.filter(personid__in=people).order_by('-responsetimestamp').first()
-
-        # Extract the timestamp if a response exists, else default to None or a suitable placeholder.
-        most_recent_response_date = most_recent_response.responsetimestamp if most_recent_response else 'No responses'
-
-        gender_composition = calculate_gender_composition(people)
-
-        countryRegions = []
-        for community in Community.objects.filter(communityid__in=community_ids):
-            person_ids = Person.objects.filter(communityid=community.communityid).values_list('personid', flat=True)
-            number_of_responses = 0
-            for survey in Survey.objects.all():
-                number_of_responses += Response.objects.filter(
-                    surveyquestionid__surveyid=survey.surveyid, 
-                    personid__in=person_ids
-                ).values(
-                    'personid', 'surveyquestionid__surveyid'  # This fetches the surveyid through the surveyquestionid foreign key
-                ).distinct().count()
-
-            community_info = {
-                'id': community.communityid,
-                'region': community.region,
-                'responses': number_of_responses
-            }
-            countryRegions.append(community_info)
-
-        countryResponse = {
-            'countryInfo': {
-                'code': countrycode,
-                'countryName': country.name,
-                'respondents': respondents,
-                'regions': number_of_regions,
-                'lastResponseDate': most_recent_response_date.strftime("%B %d, %Y") if most_recent_response else most_recent_response_date,
-                'genderRatio': {
-                    'male': gender_composition['Male'],
-                    'female': gender_composition['Female'],
-                },
-                'ageDistribution': [
-                    {'ageGroup': '0-14', 'percentage': age_composition['0-14']},
-                    {'ageGroup': '15-21', 'percentage': age_composition['15-21']},
-                    {'ageGroup': '22-29', 'percentage': age_composition['22-29']},
-                    {'ageGroup': '30-39', 'percentage': age_composition['30-39']},
-                    {'ageGroup': '40-59', 'percentage': age_composition['40-59']},
-                    {'ageGroup': '60+', 'percentage': age_composition['Over 60']},
-                ],
-            },
-            'countryRegions': countryRegions,
-        }
-
-        return JsonResponse(countryResponse, safe=False)
-    
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    try:
+        data = country_report(countrycode, approximate=flag(request, 'approximate'), fields=fields)
+        return JsonResponse(data, safe=False, encoder=TimedJSONEncoder)
+
     except Country.DoesNotExist:
-        return JsonResponse({'error': 'Country not found'}, status=404)
\ No newline at end of file
+        return JsonResponse({'error': 'Country not found'}, status=404)
+
+@replica_reads
+@cached_report('global')
+def get_reports(request):
+
+    try:
+        scope, values = batch_filters(request.GET.getlist('community'), request.GET.getlist('country'))
+        text_limit = page_size(request, text_answer_limit(), name='answers')
+        fields = requested_fields(request)
+    except (BatchError, PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    if scope == 'community':
+        reports = community_reports(
+            values, text_limit=text_limit, group_text=flag(request, 'group_text'),
+            approximate=flag(request, 'approximate'), fields=fields,
+        )
+        data = {'communities': {
+            value: reports.get(value, {'error': 'Community not found'}) for value in values
+        }}
+    else:
+        reports = country_reports(values, approximate=flag(request, 'approximate'), fields=fields)
+        data = {'countries': {
+            value: reports.get(value, {'error': 'Country not found'}) for value in values
+        }}
+    return JsonResponse(data, encoder=TimedJSONEncoder)
+
+@replica_reads
+@cached_report('global')
+def get_crosstab(request):
+
+    try:
+        fields = requested_fields(request)
+    except FieldError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    community = request.GET.get('community')
+    country = request.GET.get('country')
+    if community and country:
+        return JsonResponse({'error': "Give either 'community' or 'country'"}, status=400)
+    if community:
+        if not community.isdecimal():
+            return JsonResponse({'error': "'community' must be an integer"}, status=400)
+        data = crosstab('community', int(community))
+    elif country:
+        data = crosstab('country', country)
+    else:
+        data = crosstab()
+
+    return JsonResponse(fields.apply(data), safe=False, encoder=TimedJSONEncoder)
+
+@replica_reads
+@cached_report('activity')
+def get_timeseries(request):
+
+    try:
+        filters = activity_filters(
+            granularity=request.GET.get('granularity'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            community=request.GET.get('community'),
+            country=request.GET.get('country'),
+            survey=request.GET.get('survey'),
+        )
+        fields = requested_fields(request)
+    except (ActivityError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    return JsonResponse(fields.apply(activity_series(**filters)), safe=False, encoder=TimedJSONEncoder)
+
+@replica_reads
+@cached_report('leaderboard')
+def get_leaderboard(request):
+
+    try:
+        filters = leaderboard_filters(
+            metric=request.GET.get('metric'),
+            country=request.GET.get('country'),
+            survey=request.GET.get('survey'),
+            community=request.GET.get('community'),
+        )
+        limit = page_size(request, 10)
+        fields = requested_fields(request)
+    except (LeaderboardError, PaginationError, FieldError) as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    return JsonResponse(fields.apply(leaderboard.top(limit=limit, **filters)), safe=False, encoder=TimedJSONEncoder)
+
+def authorized(request, token):
+
+    return constant_time_compare(request.headers.get('Authorization', ''), 'Bearer %s' % token)
+
+def export_responses(request):
+
+    # Every respondent's answers and demographics: never served without a token
+    token = getattr(settings, 'EXPORT_TOKEN', None)
+    if not token:
+        return JsonResponse({'error': 'Export is disabled; set EXPORT_TOKEN to enable it'}, status=403)
+    if not authorized(request, token):
+        return JsonResponse({'error': 'Invalid export token'}, status=401)
+
+    format = request.GET.get('format', 'ndjson')
+    if format not in FORMATS:
+        return JsonResponse({'error': "'format' must be one of: %s" % ', '.join(FORMATS)}, status=400)
+
+    try:
+        filters = export_filters(
+            survey=request.GET.get('survey'),
+            country=request.GET.get('country'),
+            community=request.GET.get('community'),
+            since=request.GET.get('since'),
+            until=request.GET.get('until'),
+            after=request.GET.get('after'),
+        )
+    except ExportError as error:
+        return JsonResponse({'error': str(error)}, status=400)
+
+    content_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export_lines(export_rows(filters), format), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="responses.%s"' % format
+    return response
+
+def metrics(request):
+
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@csrf_exempt
+@require_POST
+def ingest(request):
+
+    # Creates people and responses: never accepted without a token
+    token = getattr(settings, 'INGEST_TOKEN', None)
+    if not token:
+        return JsonResponse({'error': 'Ingest is disabled; set INGEST_TOKEN to enable it'}, status=403)
+    if not authorized(request, token):
+        return JsonResponse({'error': 'Invalid ingest token'}, status=401)
+
+    try:
+        messages = parse_messages(json.loads(request.body))
+    except ValueError as error:
+        # IngestError, or a body that is not JSON at all
+        return JsonResponse({'error': str(error)}, status=400)
+
+    maximum = getattr(settings, 'INGEST_MAX_MESSAGES', 10000)
+    if len(messages) > maximum:
+        return JsonResponse({'error': 'At most %d messages per request' % maximum}, status=400)
+
+    if getattr(settings, 'INGEST_WRITE_BEHIND', False):
+        return JsonResponse({'queued': ingest_queue().put(messages)}, status=202)
+    return JsonResponse({'results': ingest_messages(messages)})
@@ -0,0 +1,118 @@
+"""
+Warming the report cache for every community and country.
+
+Each report is requested through its view, so it is stored under exactly the
+key a visitor's request would look up. Reports are computed on a pool of
+threads, each with its own database connection, or of processes. Either way
+the report cache has to be shared with the web workers (e.g. Redis or
+memcached): a local memory cache would be warmed for this process alone and
+be gone when it exits.
+"""
+
+import time
+from asyncio import iscoroutinefunction
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from asgiref.sync import async_to_sync
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connections
+from django.db.models import Max
+from django.test import RequestFactory
+from django.urls import resolve, reverse
+
+from .cache import report_cache
+from .concurrency import run_in_connection
+from .models import *
+
+# Report caches no other process can read
+LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class WarmingError(ValueError):
+    pass
+
+
+def recent_order(scopes, latest):
+
+    # Most recent response first; scopes without responses last, in id order
+    return sorted(scopes, key=lambda scope: (latest.get(scope) is None, -(latest.get(scope) or 0), str(scope)))
+
+
+def warm_paths(recent_first=False, communities=True, countries=True):
+    """
+    Report URLs to warm: every community and country page, in id and code
+    order, or with the scopes that had the latest responses first.
+    """
+
+    paths = []
+    if communities:
+        community_ids = list(Community.objects.order_by('communityid').values_list('communityid', flat=True))
+        if recent_first:
+            latest = dict(
+                Response.objects.filter(responsetimestamp__isnull=False)
+                .values('personid__communityid')
+                .annotate(latest=Max('responsetimestamp'))
+                .order_by()
+                .values_list('personid__communityid', 'latest')
+            )
+            latest = {communityid: timestamp.timestamp() for communityid, timestamp in latest.items()}
+            community_ids = recent_order(community_ids, latest)
+        paths += [reverse('get_community', args=[communityid]) for communityid in community_ids]
+
+    if countries:
+        codes = list(
+            Country.objects.exclude(code__isnull=True).order_by('code').values_list('code', flat=True).distinct()
+        )
+        if recent_first:
+            latest = dict(
+                Response.objects.filter(responsetimestamp__isnull=False)
+                .values('personid__communityid__countryid__code')
+                .annotate(latest=Max('responsetimestamp'))
+                .order_by()
+                .values_list('personid__communityid__countryid__code', 'latest')
+            )
+            latest = {code: timestamp.timestamp() for code, timestamp in latest.items()}
+            codes = recent_order(codes, latest)
+        paths += [reverse('get_country', args=[code]) for code in codes]
+
+    return paths
+
+
+def warm_report(path):
+    """
+    Request the report at ``path`` on a connection of its own. Returns the
+    path, status code, whether it was computed ('MISS') or already cached
+    ('HIT'), and the time taken in seconds.
+    """
+
+    request = RequestFactory().get(path)
+    match = resolve(path)
+    # The async report views, with ASYNC_REPORT_VIEWS
+    view = async_to_sync(match.func) if iscoroutinefunction(match.func) else match.func
+    start = time.perf_counter()
+    response = run_in_connection(view, request, *match.args, **match.kwargs)
+    return path, response.status_code, response.get('X-Cache'), time.perf_counter() - start
+
+
+def warm_reports(paths, workers=4, processes=False):
+    """
+    Warm ``paths`` on a pool of ``workers`` threads or processes, yielding
+    the ``warm_report`` results in the order of ``paths``.
+    """
+
+    cache = report_cache()
+    if isinstance(cache, LOCAL_CACHES):
+        raise WarmingError(
+            "Warming needs a report cache shared with the web workers, not %s" % type(cache).__name__
+        )
+    if processes:
+        # Children must not share the parent's database connections
+        connections.close_all()
+        pool = ProcessPoolExecutor(max_workers=workers)
+    else:
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='warm')
+
+    with pool:
+        # Submitted in order, so the first paths are computed first
+        yield from pool.map(warm_report, paths)
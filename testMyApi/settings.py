@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.PerformanceMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -54,6 +55,11 @@ MIDDLEWARE = [
 
 CORS_ALLOW_ALL_ORIGINS = True
 
+# Fraction of requests timed by api.middleware.PerformanceMiddleware, and how
+# many of their slowest SQL statements are logged to 'api.performance'.
+PERFORMANCE_SAMPLE_RATE = 0.1
+PERFORMANCE_SLOW_QUERIES = 3
+
 ROOT_URLCONF = 'testMyApi.urls'
 
 TEMPLATES = [
@@ -74,6 +80,72 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'testMyApi.wsgi.application'
 
+ASGI_APPLICATION = 'testMyApi.asgi.application'
+
+# Serve the community, country and survey reports with their async views.
+# Only worth enabling when running under an ASGI server (e.g. uvicorn).
+ASYNC_REPORT_VIEWS = False
+
+# Page sizes: text answers per question in a community report, communities per
+# page of /api/communities, and the largest page a client may ask for.
+TEXT_ANSWER_PAGE_SIZE = 20
+COMMUNITY_PAGE_SIZE = 100
+REPORT_MAX_PAGE_SIZE = 1000
+
+# Most communities or countries a client may ask for in one /api/reports request
+REPORT_BATCH_SIZE = 50
+
+# Number of report sections (per-survey and per-region aggregations) that may
+# query the database at once, across all requests in a process.
+REPORT_CONCURRENCY = 4
+
+# Threads of the report pool keep their database connections between sections
+# rather than logging in again for each; they are replaced after this many seconds.
+REPORT_CONNECTION_MAX_AGE = 300
+
+# Directory of the local columnar response snapshot kept by the
+# snapshot_responses command. When set, survey statistics read it instead of
+# counting every survey's responses in the database.
+REPORT_SNAPSHOT_DIR = None
+
+# Registers (2 ** precision bytes) of each respondent sketch kept by the
+# update_sketches command for ?approximate=1 reports; the relative standard
+# error of their counts is 1.04 / sqrt(2 ** precision), 1.6% at 12. Run
+# update_sketches --rebuild after changing it.
+RESPONDENT_SKETCH_PRECISION = 12
+
+# Seconds between checks of whether the surveys, questions or options changed;
+# the survey catalog is reloaded when they did.
+CATALOG_CHECK_INTERVAL = 30
+
+# Seconds after which the catalog is reloaded even if its version did not
+# change: the version only sees edits in place (e.g. a question's text) on SQL Server.
+CATALOG_MAX_AGE = 600
+
+# Inbound messages (POST /api/ingest). With INGEST_WRITE_BEHIND, requests are
+# acknowledged at once and messages written in batches of INGEST_BATCH_SIZE, or
+# INGEST_FLUSH_INTERVAL seconds after they arrived; batches that then fail are
+# kept in INGEST_DEAD_LETTER_PATH until the replay_ingest command writes them.
+# Requests need an "Authorization: Bearer <token>" header with INGEST_TOKEN;
+# without one ingestion is disabled.
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN')
+INGEST_MAX_MESSAGES = 10000
+INGEST_WRITE_BEHIND = False
+INGEST_BATCH_SIZE = 500
+INGEST_FLUSH_INTERVAL = 1.0
+INGEST_DEAD_LETTER_PATH = os.path.join(BASE_DIR, 'ingest_dead_letters.jsonl')
+
+# Bulk export of responses (GET /api/export) needs an "Authorization: Bearer
+# <token>" header with this token; without one the export is disabled.
+EXPORT_TOKEN = os.environ.get('EXPORT_TOKEN')
+
+# Conversation states of recent senders kept in memory per process. Entries
+# expire after CONVERSATION_CACHE_TTL seconds, which bounds how long a state
+# changed by another worker can go unnoticed; route a sender's messages to one
+# worker, or keep this short, when running several.
+CONVERSATION_CACHE_SIZE = 10000
+CONVERSATION_CACHE_TTL = 300
+
 
 # Database
 # https://docs.djangoproject.com/en/2.1/ref/settings/#databases
@@ -93,6 +165,41 @@ DATABASES = {
     },
 }
 
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+#
+# Report payloads are cached under a key that includes the version of the data
+# they were built from, so stale entries are never served and simply fall out of
+# the cache through LRU eviction. Point 'reports' at a shared backend (e.g.
+# Redis with an allkeys-lru policy) to share payloads between workers.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reports': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'reports',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 2000,
+        },
+    },
+}
+
+REPORT_CACHE_ALIAS = 'reports'
+
+# Read replicas for the report views (aliases in DATABASES). Reads go to the
+# primary when this is empty, or when every replica fails its health check or
+# lags more than REPORT_REPLICA_MAX_LAG seconds behind.
+
+DATABASE_ROUTERS = ['api.routers.ReportReplicaRouter']
+
+REPORT_REPLICAS = []
+REPORT_REPLICA_STRATEGY = 'round_robin'  # or 'least_latency'
+REPORT_REPLICA_MAX_LAG = 30
+REPORT_REPLICA_CHECK_INTERVAL = 10
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
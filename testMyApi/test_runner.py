@@ -0,0 +1,23 @@
+from django.apps import apps
+from django.test.runner import DiscoverRunner
+
+
+class UnmanagedModelTestRunner(DiscoverRunner):
+    """
+    Test runner that creates tables for unmanaged models.
+
+    The ``api`` models map onto a legacy schema and are declared with
+    ``managed = False``; for tests they are treated as managed so the test
+    database gets the tables they need.
+    """
+
+    def setup_test_environment(self, *args, **kwargs):
+        self.unmanaged_models = [m for m in apps.get_models() if not m._meta.managed]
+        for model in self.unmanaged_models:
+            model._meta.managed = True
+        super().setup_test_environment(*args, **kwargs)
+
+    def teardown_test_environment(self, *args, **kwargs):
+        super().teardown_test_environment(*args, **kwargs)
+        for model in self.unmanaged_models:
+            model._meta.managed = False